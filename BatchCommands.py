@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+"""
+Команды пакетного режима (PortraitBatch.py): задания пула и обработчики.
+
+Задание — namedtuple своего типа на команду, первое поле — путь или метка,
+по нему run_jobs подписывает результат. Функции _*_job выполняются в
+процессах пула. Обработчик run_<команда>(args) собирает задания из
+разобранных аргументов, запускает их, печатает результат и возвращает
+(результаты run_jobs, секунды, дополнительные поля сводки).
+"""
+import csv
+import glob
+import json
+import mmap
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from SF1PortraitParser import SF1PortraitParser
+from SF1PortraitDecompressor import SF1PortraitDecompressor
+from SF1PortraitCompressor import SF1PortraitCompressor
+from SF1NativeCompressor import SF1NativeCompressor
+from RLEDecompressor import decode_my_compressor, read_palette_from_header
+from RleParser import RleParser
+from PortraitRenderer import render_indices, decode_sf1_palette
+from PortraitCache import shared_cache
+from PaletteOptimizer import optimize_palette, format_mapping
+from BudgetFitter import fit_to_budget
+import RomScanner
+from RoundTripVerifier import VerifyJob, verify_job, size_stats, format_mismatch, format_stats
+from PortraitCorpus import KINDS, corpus
+from Transcoder import transcode
+from FormatDetector import detect, decode_any
+from StageTimer import stage
+
+FORMATS = ('sf1', 'rle')
+
+# Задания пула, по одному типу на команду; первое поле — путь (метка в сводке)
+DecodeJob = namedtuple('DecodeJob', 'path fmt cache_dir out_dir')
+EncodeJob = namedtuple('EncodeJob', 'path effort merge_distance merge_workers out_dir')
+TranscodeJob = namedtuple('TranscodeJob', 'path target effort out_dir')
+ClassifyJob = namedtuple('ClassifyJob', 'path')
+HeadersJob = namedtuple('HeadersJob', 'path fmt')
+FitJob = namedtuple('FitJob', 'path budget effort preview out_dir')
+# offset — смещение графики в ROM, None для файла .bin
+CompareJob = namedtuple('CompareJob', 'path offset')
+
+# Один кодер на процесс пула (на каждый уровень сжатия): encode() сбрасывает
+# состояние перед каждой картинкой
+_encoder = SF1PortraitCompressor()
+_encoders = {'fast': _encoder}
+_native = SF1NativeCompressor()
+
+
+def get_encoder(effort='fast'):
+    if effort not in _encoders:
+        _encoders[effort] = SF1PortraitCompressor(effort=effort)
+    return _encoders[effort]
+
+
+def collect_inputs(inputs, extension):
+    """Разворачивает файлы, каталоги (по расширению) и glob-шаблоны в список путей."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(sorted(glob.glob(os.path.join(item, '*' + extension))))
+        elif glob.has_magic(item):
+            paths.extend(sorted(glob.glob(item)))
+        else:
+            paths.append(item)
+    return paths
+
+
+def output_path(path, out_dir, extension):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(out_dir or os.path.dirname(path), stem + extension)
+
+
+def decode_sf1_file(path, cache=None):
+    """Оригинальный портрет SF1 -> (палитра, индексы, картинка 'P')."""
+    parser = SF1PortraitParser(path)
+    graphics = parser.data[parser.graphic_offset or 0:]
+    if cache is not None:
+        img, indices = cache.render('sf1', graphics, parser.palette)
+        return decode_sf1_palette(parser.palette), indices, img
+    decompressor = SF1PortraitDecompressor(graphics)
+    indices, _ = decompressor.get_indices(0)
+    palette = decode_sf1_palette(parser.palette)
+    return palette, indices, render_indices(indices, palette, decompressor.width, decompressor.height)
+
+
+def decode_rle_file(path, cache=None):
+    """Портрет SF1PortraitCompressor -> (палитра, индексы, картинка 'P')."""
+    with stage('read'), open(path, 'rb') as f:
+        data = f.read()
+    if cache is None:
+        return decode_my_compressor(data)
+    palette, graphic_offset = read_palette_from_header(data)
+    # Палитра — 32 байта перед magic
+    img, indices = cache.render('rle', data[graphic_offset:], data[graphic_offset - 34:graphic_offset - 2])
+    return palette, indices, img
+
+
+def decode_any_file(path, cache=None):
+    """Портрет любого формата (FormatDetector.decode_any) -> (палитра, индексы, картинка 'P')."""
+    with stage('read'), open(path, 'rb') as f:
+        data = f.read()
+    _, palette, indices, img = decode_any(data, cache=cache)
+    return palette, indices, img
+
+
+def _decode_job(job):
+    path, fmt, cache_dir, out_dir = job
+    cache = shared_cache(cache_dir) if cache_dir else None
+    if fmt == 'auto':
+        _, _, img = decode_any_file(path, cache)
+    elif fmt == 'sf1':
+        _, _, img = decode_sf1_file(path, cache)
+    else:
+        _, _, img = decode_rle_file(path, cache)
+    dest = output_path(path, out_dir, '.png')
+    img.save(dest)
+    return os.path.getsize(path), os.path.getsize(dest)
+
+
+def _encode_job(job):
+    path, effort, merge_distance, merge_workers, out_dir = job
+    dest = output_path(path, out_dir, '.bin')
+    encoder = get_encoder(effort)
+    report = None
+    with Image.open(path) as img:
+        if merge_distance is None:
+            data, bpp = encoder.encode(img), encoder.stats['bpp']
+        else:
+            result = optimize_palette(img, effort, merge_distance, workers=merge_workers)
+            data, bpp, report = result['data'], result['bpp'], format_mapping(result)
+    with open(dest, 'wb') as f:
+        f.write(data)
+    return os.path.getsize(path), len(data), bpp, report
+
+
+def _transcode_job(job):
+    path, target, effort, out_dir = job
+    # Без --out результат ложится рядом с исходником и не должен его затереть
+    dest = output_path(path, out_dir, '.bin' if out_dir else f'.{target}.bin')
+    with open(path, 'rb') as f:
+        data = f.read()
+    # Файл уже в целевом формате перекодировался бы в мусор без всякой ошибки
+    found = detect(data)
+    if found['format'] is None:
+        raise ValueError(f"Not a portrait: {found['reason']}")
+    if found['format'] == target and found['confidence'] != 'low':
+        raise ValueError(f"Already a {target} portrait ({found['reason']})")
+    result = transcode(data, target, effort, get_encoder(effort) if target == 'rle' else _native)
+    with open(dest, 'wb') as f:
+        f.write(result)
+    return len(data), len(result)
+
+
+def _classify_job(job):
+    path, = job
+    with open(path, 'rb') as f:
+        data = f.read()
+    return len(data), detect(data)
+
+
+def _headers_job(job):
+    path, fmt = job
+    parser = SF1PortraitParser(path) if fmt == 'sf1' else RleParser(path)
+    text = f"== {path}\n{parser.get_summary_text()}\n"
+    if parser.warnings:
+        text += "\n".join(parser.warnings) + "\n"
+    return parser.ln, text
+
+
+def _fit_job(job):
+    path, budget, effort, preview, out_dir = job
+    dest = output_path(path, out_dir, '.bin')
+    with Image.open(path) as img:
+        result = fit_to_budget(img, budget, effort)
+    with open(dest, 'wb') as f:
+        f.write(result['data'])
+    if preview:
+        _, _, img = decode_my_compressor(result['data'])
+        img.save(output_path(path, out_dir, '.fit.png'))
+    steps = ", ".join(f"{name} {level}" for name, level in result['steps'].items())
+    report = (f"{path}: {result['bytes']}/{budget} bytes, error {result['error']} "
+              f"({steps}; {result['tried']} candidates measured)")
+    return os.path.getsize(path), result['bytes'], report
+
+
+def compare_sizes(indices, original_length, width=64, height=64):
+    """
+    Размеры графики (с байтами 08 08) для одного портрета:
+    оригинал, SF1NativeCompressor и SF1PortraitCompressor (None, если кадр не 64x64).
+    """
+    native = len(SF1NativeCompressor(width=width, height=height).encode_graphics(indices))
+    rle = None
+    if width * height == _encoder.size:
+        # 36 = blink + talk + палитра, magic остаётся в графике
+        rle = len(_encoder.encode_indices(bytes(indices).replace(b'\xff', b'\0'), bytes(32))) - 36
+    return original_length, native, rle
+
+
+def _compare_job(job):
+    path, offset = job
+    if offset is None:
+        parser = SF1PortraitParser(path)
+        decompressor = SF1PortraitDecompressor(parser.data)
+        indices, _ = decompressor.get_indices(parser.graphic_offset or 0)
+    else:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            decompressor = SF1PortraitDecompressor(mm, offset)
+            indices, _ = decompressor.get_indices()
+    original = decompressor.stream_length
+    return (original,) + compare_sizes(indices, original, decompressor.width, decompressor.height)
+
+
+def _run_one(args):
+    func, job = args
+    start = time.perf_counter()
+    try:
+        result = func(job)
+        return job[0], None, result, time.perf_counter() - start
+    except Exception as e:
+        return job[0], f"{type(e).__name__}: {e}", None, time.perf_counter() - start
+
+
+def run_jobs(func, jobs, workers=None):
+    """
+    Выполняет func(job) для каждого задания в пуле процессов.
+    Возвращает список (путь, ошибка или None, результат, секунды) в исходном порядке.
+    """
+    tasks = [(func, job) for job in jobs]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) <= 1:
+        return [_run_one(task) for task in tasks]
+    chunksize = max(1, len(tasks) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_run_one, tasks, chunksize=chunksize))
+
+
+def _run(func, jobs, args):
+    start = time.perf_counter()
+    results = run_jobs(func, jobs, args.jobs)
+    return results, time.perf_counter() - start
+
+
+def _ok(results):
+    return [(path, result) for path, error, result, _ in results if not error]
+
+
+def run_decode(args):
+    jobs = [DecodeJob(path, args.format, args.cache_dir, args.out) for path in collect_inputs(args.inputs, '.bin')]
+    results, elapsed = _run(_decode_job, jobs, args)
+    return results, elapsed, {}
+
+
+def run_encode(args):
+    paths = collect_inputs(args.inputs, '.png')
+    merge_workers = args.merge_workers
+    if args.profile or args.trace:
+        merge_workers = 1
+    elif merge_workers is None:
+        # Одну картинку пул файлов не распараллелит — отдаём процессы перебору слияний
+        merge_workers = (args.jobs or os.cpu_count() or 1) if len(paths) == 1 else 1
+    jobs = [EncodeJob(path, args.effort, args.merge_distance, merge_workers, args.out) for path in paths]
+    results, elapsed = _run(_encode_job, jobs, args)
+    encoded = _ok(results)
+    for path, (_, size, bpp, report) in encoded:
+        print(f"{path}: {size} bytes, {bpp:.3f} bpp")
+        if report:
+            print("  " + report.replace("\n", "\n  "))
+    if encoded:
+        total = sum(result[1] for _, result in encoded)
+        mean = sum(result[2] for _, result in encoded) / len(encoded)
+        print(f"effort {args.effort}: {total} bytes total, {mean:.3f} bpp average")
+    return results, elapsed, {}
+
+
+def run_transcode(args):
+    jobs = [TranscodeJob(path, args.to, args.effort, args.out) for path in collect_inputs(args.inputs, '.bin')]
+    results, elapsed = _run(_transcode_job, jobs, args)
+    done = _ok(results)
+    for path, (size_in, size_out) in done:
+        print(f"{path}: {size_in} -> {size_out} bytes")
+    if done:
+        print(f"to {args.to}: {sum(r[0] for _, r in done)} -> {sum(r[1] for _, r in done)} bytes total")
+    return results, elapsed, {}
+
+
+def run_classify(args):
+    jobs = [ClassifyJob(path) for path in collect_inputs(args.inputs, '.bin')]
+    results, elapsed = _run(_classify_job, jobs, args)
+    counts = {}
+    for path, (_, found) in _ok(results):
+        name = found['format'] or 'unknown'
+        counts[name] = counts.get(name, 0) + 1
+        confidence = f"{found['confidence']}, " if found['confidence'] else ""
+        print(f"{path}: {name} ({confidence}{found['reason']})")
+    print(", ".join(f"{name}: {count}" for name, count in sorted(counts.items())))
+    return results, elapsed, {'formats': {path: result[1] for path, result in _ok(results)}}
+
+
+def run_headers(args):
+    jobs = [HeadersJob(path, args.format) for path in collect_inputs(args.inputs, '.bin')]
+    results, elapsed = _run(_headers_job, jobs, args)
+    for _, result in _ok(results):
+        print(result[1])
+    return results, elapsed, {}
+
+
+def run_fit(args):
+    jobs = [FitJob(path, args.budget, args.effort, args.preview, args.out)
+            for path in collect_inputs(args.inputs, '.png')]
+    results, elapsed = _run(_fit_job, jobs, args)
+    for _, result in _ok(results):
+        print(result[2])
+    return results, elapsed, {}
+
+
+INDEX_FIELDS = ('offset', 'graphic_offset', 'compressed_length', 'width', 'height',
+                'non_transparent', 'blink_frames', 'talk_frames', 'palette_offset')
+
+
+def write_index(records, path):
+    """Индекс найденных портретов: JSON (по умолчанию) или CSV по расширению."""
+    if path.lower().endswith('.csv'):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=INDEX_FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(records, f, indent=2)
+
+
+def run_rom(args):
+    if args.extract:
+        os.makedirs(args.extract, exist_ok=True)
+    pointers = None
+    if args.pointer_table is not None:
+        if not args.count:
+            raise SystemExit("--pointer-table needs --count")
+        pointers = RomScanner.read_pointer_table(args.rom, args.pointer_table, args.count)
+    workers = args.jobs or os.cpu_count() or 1
+    func, jobs = RomScanner.scan_jobs(args.rom, args.extract, args.chunk_size, pointers, workers)
+
+    start = time.perf_counter()
+    results = run_jobs(func, jobs, workers)
+    elapsed = time.perf_counter() - start
+
+    records = RomScanner.merge_records(result for _, error, result, _ in results if not error)
+    for r in records:
+        print(f"{r['offset']:06X}  graphics {r['graphic_offset']:06X}  {r['compressed_length']:5d} bytes  "
+              f"{r['width']}x{r['height']}  {r['non_transparent']} px")
+    print(f"{len(records)} portraits found")
+    if args.index:
+        write_index(records, args.index)
+    return results, elapsed, {}
+
+
+def _percent(size, original):
+    return f"{size:6d} ({size * 100 / original:5.1f}%)" if size is not None and original else f"{'n/a':>15}"
+
+
+def run_compare(args):
+    jobs = [CompareJob(path, None) for path in collect_inputs(args.inputs, '.bin')]
+    workers = args.jobs or os.cpu_count() or 1
+    if args.rom:
+        func, scan = RomScanner.scan_jobs(args.rom, workers=workers)
+        found = run_jobs(func, scan, workers)
+        records = RomScanner.merge_records(result for _, error, result, _ in found if not error)
+        jobs.extend(CompareJob(args.rom, r['graphic_offset']) for r in records)
+    if not jobs:
+        raise SystemExit("compare: no inputs (give .bin files and/or --rom)")
+
+    start = time.perf_counter()
+    results = run_jobs(_compare_job, jobs, workers)
+    elapsed = time.perf_counter() - start
+
+    totals = [0, 0, 0]
+    skipped = 0
+    print(f"{'portrait':40} {'original':>8} {'native':>15} {'rle':>15}")
+    for (path, offset), (_, error, result, _) in zip(jobs, results):
+        if error:
+            continue
+        name = path if offset is None else f"{os.path.basename(path)}@{offset:06X}"
+        _, original, native, rle = result
+        print(f"{name[-40:]:40} {original:8d} {_percent(native, original)} {_percent(rle, original)}")
+        if rle is None:
+            # Кадр не 64x64 — RLE его не кодирует; в итогах все три столбца по одним портретам
+            skipped += 1
+            continue
+        totals[0] += original
+        totals[1] += native
+        totals[2] += rle
+    print(f"{'total':40} {totals[0]:8d} {_percent(totals[1], totals[0])} {_percent(totals[2], totals[0])}")
+    if skipped:
+        print(f"{skipped} portraits without an RLE size (frame not 64x64) left out of the total")
+    return results, elapsed, {'rle_skipped': skipped}
+
+
+def run_verify(args):
+    effort = args.effort
+    jobs = [VerifyJob(path, effort, None, args.save_failures) for path in collect_inputs(args.inputs, '.png')]
+    for item in args.corpus:
+        kind, _, count = item.partition(':')
+        if kind not in KINDS:
+            raise SystemExit(f"verify: unknown corpus kind {kind!r} (expected one of {', '.join(KINDS)})")
+        for i, img in enumerate(corpus(kind, int(count or 100), args.seed)):
+            jobs.append(VerifyJob(f"corpus:{kind}#{i}", effort, img.tobytes(), args.save_failures))
+    if not jobs:
+        raise SystemExit("verify: no inputs (give PNG files and/or --corpus)")
+    if args.save_failures:
+        os.makedirs(args.save_failures, exist_ok=True)
+
+    start = time.perf_counter()
+    results = run_jobs(verify_job, jobs, args.jobs)
+    elapsed = time.perf_counter() - start
+
+    done = [(label, result) for label, error, result, _ in results if not error]
+    mismatches = [(label, result[3]) for label, result in done if result[3]]
+    for label, error, _, _ in results:
+        if error:
+            print(f"FAILED {label}: {error}")
+    for label, mismatch in mismatches:
+        print(format_mismatch(label, mismatch))
+    print(format_stats(f"size ({effort})", size_stats([result[1] for _, result in done])) + " bytes")
+    print(format_stats("bpp", size_stats([result[2] for _, result in done]), 3))
+    print(f"{len(done) - len(mismatches)}/{len(jobs)} round trips match, {len(mismatches)} mismatches")
+    return results, elapsed, {
+        'mismatches': [{'path': label, **m} for label, m in mismatches],
+        'sizes': size_stats([result[1] for _, result in done]),
+        'bpp': size_stats([result[2] for _, result in done]),
+    }
+
+
+# Команда -> (обработчик, единица счёта в сводке)
+COMMANDS = {
+    'decode': (run_decode, 'files'),
+    'encode': (run_encode, 'files'),
+    'transcode': (run_transcode, 'files'),
+    'classify': (run_classify, 'files'),
+    'headers': (run_headers, 'files'),
+    'rom': (run_rom, 'jobs'),
+    'fit': (run_fit, 'files'),
+    'compare': (run_compare, 'files'),
+    'verify': (run_verify, 'portraits'),
+}
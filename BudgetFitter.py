@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Подгонка портрета под размер слота в ROM.
+
+Кандидаты строятся упрощениями нарастающей силы:
+  * merges — слияние ближайших цветов палитры (по одной паре за шаг);
+  * smooth — короткие серии внутри строки, окружённые с обеих сторон одним
+    цветом, перекрашиваются в него (1 — одиночные пиксели, 2 — пары и т.д.);
+  * extend — короткие серии внутри строки поглощаются предыдущей серией
+    (или следующей, если строка с них начинается).
+Прозрачные пиксели не трогаются и не появляются — силуэт остаётся прежним.
+
+Каждому кандидату считается искажение — сумма квадратов разницы цветов
+Genesis по всем пикселям. Кандидаты проверяются по возрастанию искажения
+размером без записи потока (SF1PortraitCompressor.measure_indices);
+первый влезающий и есть результат с лучшим качеством.
+"""
+from SF1PortraitCompressor import SF1PortraitCompressor
+from PaletteOptimizer import genesis_colors, forced_merges, build
+
+MAX_MERGES = 8
+MAX_SMOOTH = 3
+MAX_EXTEND = 4
+
+
+def row_runs(indices, width, start):
+    """Серии одной строки: список (начало, длина, индекс)."""
+    runs = []
+    pos = start
+    end = start + width
+    while pos < end:
+        pixel = indices[pos]
+        length = 1
+        while pos + length < end and indices[pos + length] == pixel:
+            length += 1
+        runs.append((pos, length, pixel))
+        pos += length
+    return runs
+
+
+def smooth(indices, width, max_len):
+    """Серии до max_len между двумя сериями одного цвета перекрашиваются в этот цвет."""
+    out = bytearray(indices)
+    for start in range(0, len(out), width):
+        runs = row_runs(out, width, start)
+        for i in range(1, len(runs) - 1):
+            pos, length, pixel = runs[i]
+            left, right = runs[i - 1][2], runs[i + 1][2]
+            if pixel and left and length <= max_len and left == right:
+                out[pos:pos + length] = bytes([left]) * length
+    return out
+
+
+def extend(indices, width, max_len):
+    """Серии до max_len поглощаются соседней непрозрачной серией той же строки (сначала левой)."""
+    out = bytearray(indices)
+    for start in range(0, len(out), width):
+        runs = row_runs(out, width, start)
+        for i, (pos, length, pixel) in enumerate(runs):
+            if not pixel or length > max_len:
+                continue
+            left = out[pos - 1] if i > 0 else 0
+            right = runs[i + 1][2] if i + 1 < len(runs) else 0
+            fill = left or right
+            if fill:
+                out[pos:pos + length] = bytes([fill]) * length
+    return out
+
+
+def distortion(original, indices, slot_colors):
+    """Сумма квадратов разницы цветов Genesis: original — цвет каждого пикселя, indices — новые слоты."""
+    error = 0
+    for before, slot in zip(original, indices):
+        if before is not None:
+            after = slot_colors[slot]
+            error += sum((a - b) ** 2 for a, b in zip(before, after))
+    return error
+
+
+def candidates(keys, colors, width):
+    """
+    Все кандидаты сетки merges x smooth x extend.
+    Возвращает список dict: steps, indices, palette, искажение error.
+    """
+    base_mapping = forced_merges(colors)
+    original = [colors[key]['genesis'] if key else None for key in keys]
+    alive = len(colors) - len(base_mapping)
+    seen = set()
+    result = []
+    for merges in range(min(MAX_MERGES, max(alive - 1, 0)) + 1):
+        mapping = forced_merges(colors, alive - merges)
+        indices, palette, slots = build(keys, colors, mapping)
+        slot_colors = {0: None}
+        for slot, key, _ in slots:
+            slot_colors[slot] = colors[key]['genesis']
+        for level in range(MAX_SMOOTH + 1):
+            smoothed = smooth(indices, width, level) if level else indices
+            for ext in range(MAX_EXTEND + 1):
+                final = extend(smoothed, width, ext) if ext else smoothed
+                key = bytes(final)
+                if key in seen:
+                    continue
+                seen.add(key)
+                result.append({
+                    'steps': {'merges': merges, 'smooth': level, 'extend': ext},
+                    'indices': final,
+                    'palette': palette,
+                    'error': distortion(original, final, slot_colors),
+                })
+    return result
+
+
+def fit_to_budget(image, budget, effort='lazy'):
+    """
+    Лучший по качеству вариант картинки, чей .bin (SF1PortraitCompressor) не больше budget байт.
+    Возвращает dict: data, bytes, budget, error, steps, tried — сколько кандидатов измерено.
+    ValueError — если не влезает даже самый упрощённый вариант.
+    """
+    encoder = SF1PortraitCompressor(effort=effort)
+    keys, colors = genesis_colors(encoder.load_image(image))
+    pool = candidates(keys, colors, encoder.width)
+    pool.sort(key=lambda c: (c['error'], sum(c['steps'].values())))
+    smallest = None
+    for tried, candidate in enumerate(pool, 1):
+        size = encoder.measure_indices(candidate['indices'])
+        if smallest is None or size < smallest:
+            smallest = size
+        if size <= budget:
+            data = encoder.encode_indices(candidate['indices'], encoder.encode_palette(candidate['palette']))
+            return {
+                'data': data,
+                'bytes': len(data),
+                'budget': budget,
+                'error': candidate['error'],
+                'steps': candidate['steps'],
+                'tried': tried,
+            }
+    raise ValueError(f"Cannot fit portrait into {budget} bytes (smallest candidate: {smallest} bytes)")
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Сравнение табличного и побитового декодеров на корпусе портретов.
+
+    python DecoderBenchmark.py                      # синтетический корпус (RLE — PortraitCorpus)
+    python DecoderBenchmark.py --sf1 roms/*.bin     # оригинальные портреты SF1
+    python DecoderBenchmark.py --rle custom/*.bin   # портреты SF1PortraitCompressor
+
+Оба декодера и путь через PortraitIR (разбор в команды + fill) прогоняются
+на одних и тех же потоках, результаты сверяются, затем печатается скорость
+(портретов в секунду) и ускорение табличного декодера.
+"""
+import argparse
+import glob
+import random
+import time
+
+from SF1PortraitDecompressor import SF1PortraitDecompressor
+from RLEDecompressor import decode_stream, parse_stream
+
+# blink (00 00) + talk (00 00) + палитра + magic (08 08) у файлов SF1PortraitCompressor
+RLE_HEADER_SIZE = 2 + 2 + 32 + 2
+
+
+def _bits_to_bytes(bits):
+    while len(bits) % 16:
+        bits.append(0)
+    return bytes(int(''.join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8))
+
+
+def _put_run(bits, value):
+    t3 = 0
+    while value >= (2 << (t3 + 1)) - 2:
+        t3 += 1
+    rem = value - ((2 << t3) - 2)
+    bits.extend([0] * t3)
+    bits.append(1)
+    bits.extend((rem >> i) & 1 for i in range(t3, -1, -1))
+
+
+def synth_sf1_stream(rnd, width=64, height=64):
+    """Случайный, но корректный поток SF1: пропуски, пиксели и цепочки копирования."""
+    bits = []
+    size = width * height
+    pos = -1
+    while True:
+        skip = rnd.choice([1, 1, 1, 2, 3, 5, 8, rnd.randrange(1, 200)])
+        _put_run(bits, skip)
+        pos += skip
+        if pos >= size:
+            break
+        pixel = rnd.randrange(1, 16)
+        bits.extend((pixel >> i) & 1 for i in range(3, -1, -1))
+        if rnd.random() < 0.6:
+            bits.append(1)
+            for _ in range(rnd.randrange(1, height)):
+                bits.extend(rnd.choice([(1, 0), (1, 0), (1, 1), (0, 1), (0, 0, 1, 1), (0, 0, 1, 0)]))
+            bits.extend((0, 0, 0))
+        else:
+            bits.append(0)
+    return bytes([width // 8, height // 8]) + _bits_to_bytes(bits)
+
+
+def synth_rle_files(count, seed=1):
+    """
+    count портретов корпуса PortraitCorpus (виды по очереди; тот же seed — те же
+    картинки, что у PortraitBenchmark), сжатых SF1PortraitCompressor.
+    """
+    from PortraitCorpus import KINDS, corpus
+    from SF1PortraitCompressor import SF1PortraitCompressor
+
+    per_kind = -(-count // len(KINDS))
+    by_kind = [corpus(kind, per_kind, seed) for kind in KINDS]
+    images = [img for group in zip(*by_kind) for img in group][:count]
+    return list(SF1PortraitCompressor().compress_many(images))
+
+
+def load_sf1(paths):
+    from SF1PortraitParser import SF1PortraitParser
+    streams = []
+    for path in paths:
+        parser = SF1PortraitParser(path)
+        streams.append(parser.data[parser.graphic_offset or 0:])
+    return streams
+
+
+def load_rle(paths):
+    from RleParser import RleParser
+    streams = []
+    for path in paths:
+        parser = RleParser(path)
+        streams.append(parser.data[(parser.graphic_offset or 0) + 2:])
+    return streams
+
+
+def expand_paths(patterns):
+    """Пути из списка файлов и glob-шаблонов (шаблон без совпадений остаётся как есть)."""
+    paths = []
+    for pattern in patterns or []:
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+    return paths
+
+
+def _time(func, streams, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for s in streams:
+            func(s)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_sf1(streams, repeat):
+    def bitwise(s):
+        return SF1PortraitDecompressor(s).get_indices(0, tables=False)[0]
+
+    def tables(s):
+        return SF1PortraitDecompressor(s).get_indices(0)[0]
+
+    def ir(s):
+        return SF1PortraitDecompressor(s).get_ir(0).fill(0xFF)
+
+    for i, s in enumerate(streams):
+        if bitwise(s) != tables(s):
+            raise AssertionError(f"SF1 stream #{i}: table decoder differs from bitwise decoder")
+        if ir(s) != tables(s):
+            raise AssertionError(f"SF1 stream #{i}: PortraitIR fill differs from table decoder")
+    return _time(bitwise, streams, repeat), _time(tables, streams, repeat), _time(ir, streams, repeat)
+
+
+def check_stream_lengths(streams):
+    """
+    Длина синтетического потока известна — len(s): stream_length обоих декодеров
+    должен совпасть с ней и тогда, когда за потоком идут чужие байты (как в ROM).
+    """
+    for i, s in enumerate(streams):
+        for tables in (True, False):
+            decompressor = SF1PortraitDecompressor(s + bytes(64))
+            decompressor.get_indices(0, tables)
+            if decompressor.stream_length != len(s):
+                raise AssertionError(f"SF1 stream #{i}: stream_length {decompressor.stream_length} "
+                                     f"instead of {len(s)} (tables={tables})")
+
+
+def bench_rle(streams, repeat):
+    for i, s in enumerate(streams):
+        if decode_stream(s, tables=False) != decode_stream(s):
+            raise AssertionError(f"RLE stream #{i}: table decoder differs from bitwise decoder")
+        if parse_stream(s).fill() != decode_stream(s):
+            raise AssertionError(f"RLE stream #{i}: PortraitIR fill differs from table decoder")
+    return (_time(lambda s: decode_stream(s, tables=False), streams, repeat),
+            _time(decode_stream, streams, repeat),
+            _time(lambda s: parse_stream(s).fill(), streams, repeat))
+
+
+def _report(name, count, bitwise, tables, ir):
+    print(f"{name:4} {count:5d} portraits | bitwise {count / bitwise:9.1f}/s | "
+          f"tables {count / tables:9.1f}/s | x{bitwise / tables:.2f} | ir+fill {count / ir:9.1f}/s")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark table-driven vs bit-at-a-time portrait decoders")
+    ap.add_argument('--sf1', nargs='*', help="original SF1 portrait .bin files (globs allowed)")
+    ap.add_argument('--rle', nargs='*', help="SF1PortraitCompressor .bin files (globs allowed)")
+    ap.add_argument('--synthetic', type=int, default=64, help="synthetic portraits per format when no files given")
+    ap.add_argument('--repeat', type=int, default=5, help="timing repeats, best run is reported")
+    ap.add_argument('--seed', type=int, default=1)
+    args = ap.parse_args(argv)
+
+    rnd = random.Random(args.seed)
+    sf1_paths, rle_paths = expand_paths(args.sf1), expand_paths(args.rle)
+    synthetic = not sf1_paths and not rle_paths
+    sf1 = load_sf1(sf1_paths) if sf1_paths else (
+        [synth_sf1_stream(rnd) for _ in range(args.synthetic)] if synthetic else [])
+    rle = load_rle(rle_paths) if rle_paths else (
+        [f[RLE_HEADER_SIZE:] for f in synth_rle_files(args.synthetic, args.seed)] if synthetic else [])
+
+    if sf1:
+        if not sf1_paths:
+            check_stream_lengths(sf1)
+        _report('SF1', len(sf1), *bench_sf1(sf1, args.repeat))
+    if rle:
+        _report('RLE', len(rle), *bench_rle(rle, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Определение формата .bin портрета: оригинальный SF1 или RLE SF1PortraitCompressor.
+
+Заголовки у форматов одинаковые (blink, talk, палитра, 08 08), а битовые
+потоки почти совпадают по грамматике: RLE — это '11', затем команды
+(пиксель, префикс копирования, код серии), и тот же поток читается как SF1,
+где '11' — пропуск 1, код серии — следующий пропуск, а префиксы копирования
+RLE — цепочки из одного шага (-1,) или (-2,). Поэтому хватает одного
+разбора начала потока (PROBE_BYTES) табличным парсером SF1 в PortraitIR,
+без заливки кадра, и подсчёта признаков каждого формата:
+
+  * за RLE — пиксель 0: в SF1 прозрачность — незаписанный пиксель, кодер
+    игры 0 не пишет, а RLE пишет им каждую прозрачную серию;
+  * за SF1 — то, чего кодер RLE не выдаёт: цепочки, кроме (-1,) и (-2,),
+    повтор позиции (серия 0), две команды подряд одного цвета без копии
+    (RLE слил бы их в одну серию), первая команда не в позиции 0
+    (поток RLE начинается с '11').
+
+Без признаков (непрозрачная картинка без копий) обе распаковки дают
+одни и те же пиксели в начале серий; такой файл считается RLE с низкой
+уверенностью. Кадр не 64x64 бывает только у SF1.
+
+    result = detect(open('portrait.bin', 'rb').read())
+    result['format']  # 'sf1', 'rle' или None
+    python PortraitBatch.py classify assets/
+"""
+from SF1PortraitDecompressor import SF1PortraitDecompressor
+from RLEDecompressor import decode_my_compressor, read_palette_from_header
+from PortraitRenderer import render_indices, decode_sf1_palette
+from RomScanner import MAGIC, record_at
+
+FORMATS = ('sf1', 'rle')
+PROBE_BYTES = 64
+# Ровно один шаг копирования вниз-влево — всё, что умеет префикс RLE
+_RLE_CHAINS = ((-1,), (-2,))
+
+
+def _result(fmt, confidence, reason, evidence=None, width=None, height=None):
+    return {
+        'format': fmt,
+        'confidence': confidence,
+        'reason': reason,
+        'evidence': evidence or {'sf1': 0, 'rle': 0},
+        'width': width,
+        'height': height,
+    }
+
+
+def probe_evidence(ir, complete=False):
+    """
+    Признаки форматов в разобранном начале потока (PortraitIR чтения как SF1).
+    complete=False — поток обрезан: последняя команда могла прочитаться не целиком.
+    Возвращает dict: 'sf1' и 'rle' — число признаков каждого формата.
+    """
+    count = len(ir) if complete else len(ir) - 1
+    sf1 = rle = 0
+    if count > 0 and ir.pos[0] != 0:
+        sf1 += 1
+    previous = None
+    for i in range(count):
+        pos, pixel, chain = ir.pos[i], ir.pixel[i], ir.chain(i)
+        if pixel == 0:
+            rle += 1
+        if chain and chain not in _RLE_CHAINS:
+            sf1 += 1
+        if previous is not None:
+            prev_pos, prev_pixel, prev_chain = previous
+            if pos == prev_pos or (pixel == prev_pixel and not prev_chain):
+                sf1 += 1
+        previous = pos, pixel, chain
+    return {'sf1': sf1, 'rle': rle}
+
+
+def detect(data, probe_bytes=PROBE_BYTES):
+    """
+    Определяет формат bytes/memoryview портрета по заголовку и началу потока.
+    Возвращает dict: format ('sf1', 'rle' или None — не портрет), confidence
+    ('header', 'high', 'low' или None), reason, evidence (признаки форматов),
+    width, height.
+    """
+    data = memoryview(data)
+    # Заголовок — та же проверка, что у RomScanner: blink, talk, палитра Genesis
+    record = record_at(data, 0, magic=None)
+    if record is None:
+        return _result(None, None, "no blink/talk/Genesis palette header")
+    start = record['graphic_offset']
+    width, height = data[start] * 8, data[start + 1] * 8
+    if not width or not height:
+        return _result(None, None, f"empty {width}x{height} frame")
+    if data[start:start + 2] != MAGIC:
+        # У RLE здесь всегда magic 08 08, другой размер кадра — только у SF1
+        return _result('sf1', 'header', f"{width}x{height} frame", width=width, height=height)
+
+    end = min(len(data), start + 2 + probe_bytes)
+    ir = SF1PortraitDecompressor(data[start:end]).get_ir(0)
+    evidence = probe_evidence(ir, complete=end == len(data))
+    if evidence['sf1'] == evidence['rle']:
+        return _result('rle', 'low', "no format-specific commands in the probe", evidence, width, height)
+    fmt = 'sf1' if evidence['sf1'] > evidence['rle'] else 'rle'
+    confidence = 'high' if abs(evidence['sf1'] - evidence['rle']) > 1 else 'low'
+    return _result(fmt, confidence, f"{evidence[fmt]} {fmt}-only commands in the probe", evidence, width, height)
+
+
+def decode_any(data, probe_bytes=PROBE_BYTES, cache=None):
+    """
+    Распаковывает портрет любого формата: detect, затем декодер этого формата.
+    cache — PortraitCache: тот же поток второй раз не распаковывается.
+    Возвращает: (результат detect, палитра RGBA, индексы, картинка 'P').
+    Формат не распознан — ValueError.
+    """
+    result = detect(data, probe_bytes)
+    if result['format'] is None:
+        raise ValueError(f"Not a portrait: {result['reason']}")
+    if result['format'] == 'rle':
+        if cache is None:
+            palette, indices, img = decode_my_compressor(data)
+            return result, palette, indices, img
+        palette, graphic_offset = read_palette_from_header(data)
+        # Палитра — 32 байта перед magic
+        img, indices = cache.render('rle', data[graphic_offset:], data[graphic_offset - 34:graphic_offset - 2])
+        return result, palette, indices, img
+    record = record_at(memoryview(data), 0, magic=None)
+    palette_data = data[record['palette_offset']:record['graphic_offset']]
+    palette = decode_sf1_palette(palette_data)
+    if cache is not None:
+        img, indices = cache.render('sf1', data[record['graphic_offset']:], palette_data)
+        return result, palette, indices, img
+    decompressor = SF1PortraitDecompressor(data, record['graphic_offset'])
+    indices, _ = decompressor.get_indices()
+    return result, palette, indices, render_indices(indices, palette, decompressor.width, decompressor.height)
@@ -0,0 +1,513 @@
+# -*- coding: utf-8 -*-
+"""
+Фаззинг декодеров портретов: случайные и мутированные файлы, проверка свойств и времени.
+
+    python FuzzHarness.py --count 2000 --seed 1
+    python FuzzHarness.py --targets rle --inputs custom/*.bin --save-failures fuzz/
+    python FuzzHarness.py --seed 1 --replay 374
+
+Затравки — корректные файлы обоих форматов (синтетические потоки DecoderBenchmark
+и файлы из --inputs). Вход — затравка после нескольких мутаций (биты, байты,
+обрезка, хвост из нулей/0xFF/мусора, вставка, удаление и повтор куска, склейка
+двух файлов, заголовок, ширина/высота кадра) либо просто случайные байты.
+Вход номер i зависит только от (seed, i), поэтому любой найденный вход
+повторяется через --replay i.
+
+Для каждой цели (TARGETS) проверяется:
+  * исключения — декодер поднимает только PortraitDecodeError, detect — ничего;
+    заголовок, который не разбирается, — вход отвергнут, а не ошибка;
+  * табличный и побитовый декодеры, разбор в PortraitIR (+ fill) и iter_rows дают
+    одни и те же индексы и останавливаются на том же бите по той же причине,
+    strict=True падает ровно тогда, когда кадр не дописан, с тем же partial
+    (у iter_rows — и без strict, и со strict), а брошенный после первого
+    диапазона iter_rows не читает поток дальше полной распаковки;
+  * время: оно делится на пиксели кадра (бюджет бит тоже пропорционален кадру),
+    так что больший кадр SF1 не считается медленным. Вход, у которого время на
+    пиксель больше factor медиан своей цели (и само время больше --min-ms),
+    перемеряется (лучший из --repeat, без сборщика мусора) и, если медленный
+    и так, считается провалом.
+Перед фаззингом check_record_layouts проверяет поиск записей в ROM на собранных
+вручную образах, где хвост настоящего блока blink/talk сам читается как блок
+с меньшим count.
+Провалы минимизируются: из входа удаляются куски (от половины до байта), пока
+провал того же вида повторяется.
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+from DecoderBenchmark import synth_sf1_stream, synth_rle_files, expand_paths
+from SF1PortraitDecompressor import SF1PortraitDecompressor
+from RLEDecompressor import read_palette_from_header, decode_stream, parse_stream
+from FormatDetector import FORMATS, detect
+from RomScanner import MAGIC, record_at, record_before_magic
+from PortraitDecodeError import PortraitDecodeError, STREAM_ENDED, BITS_EXCEEDED, COMMANDS_EXCEEDED
+
+# Пустые blink и talk перед палитрой синтетических файлов SF1
+EMPTY_BLOCKS = b'\x00\x00\x00\x00'
+# Размеры кадров синтетических SF1 (в игре бывают и не 64x64)
+SF1_FRAMES = ((64, 64), (64, 64), (64, 64), (48, 64), (32, 32))
+REJECTED = 'rejected'
+SLOW = 'slow'
+
+
+class PropertyFailure(Exception):
+    """Декодер отработал, но нарушил свойство (разные пути распаковки и т.п.)."""
+
+
+def _expect(condition, message):
+    if not condition:
+        raise PropertyFailure(message)
+
+
+def _outcome(error):
+    # Итог распаковки для сводки: ok, причина бюджета или ошибка заголовка кадра
+    if error is None:
+        return 'ok'
+    if error.reason in (STREAM_ENDED, BITS_EXCEEDED, COMMANDS_EXCEEDED):
+        return error.reason
+    return 'bad frame header'
+
+
+def _strict(decode):
+    # PortraitDecodeError из decode() или None, если кадр дописан
+    try:
+        decode()
+    except PortraitDecodeError as e:
+        return e
+    return None
+
+
+def _random_bytes(rnd, size):
+    return bytes(rnd.getrandbits(8) for _ in range(size))
+
+
+def _kind(failed):
+    # Вид провала без подробностей: 'crash IndexError', 'property ...'
+    return (failed or '').split(':')[0]
+
+
+def _same_error(a, b):
+    return a is None and b is None or (a is not None and b is not None
+                                       and (a.reason, a.bit_pos) == (b.reason, b.bit_pos))
+
+
+def fuzz_sf1(data):
+    """Оригинальный формат: заголовок как у RomScanner (любой WxH), затем все пути распаковки."""
+    record = record_at(memoryview(data), 0, magic=None)
+    if record is None:
+        return REJECTED, None, None
+    offset = record['graphic_offset']
+    start = time.perf_counter()
+    try:
+        decompressor = SF1PortraitDecompressor(data, offset)
+        indices, _ = decompressor.get_indices()
+    except PortraitDecodeError as e:
+        return _outcome(e), time.perf_counter() - start, 1
+    seconds = time.perf_counter() - start
+    error = decompressor.error
+
+    _expect(len(indices) == decompressor.size, "frame is not width*height bytes")
+    bitwise = SF1PortraitDecompressor(data, offset)
+    _expect(bitwise.get_indices(tables=False)[0] == indices, "bitwise decoder differs from table decoder")
+    _expect(_same_error(bitwise.error, error), "bitwise decoder stops elsewhere")
+    _expect(bitwise.stream_length == decompressor.stream_length, "bitwise decoder reports another stream length")
+    parser = SF1PortraitDecompressor(data, offset)
+    _expect(parser.get_ir().fill(0xFF) == indices, "PortraitIR fill differs from table decoder")
+    _expect(_same_error(parser.error, error), "get_ir stops elsewhere")
+    progressive = SF1PortraitDecompressor(data, offset)
+    ranges = list(progressive.iter_rows())
+    _expect(b''.join(r for _, _, r in ranges) == indices, "iter_rows differs from table decoder")
+    _expect(_same_error(progressive.error, error), "iter_rows stops elsewhere")
+    strict_rows = _strict(lambda: list(SF1PortraitDecompressor(data, offset).iter_rows(strict=True)))
+    _expect(_same_error(strict_rows, error), "strict iter_rows stops elsewhere")
+    # Генератор брошен после первого диапазона: строки те же, дальше поток не читается
+    dropped = SF1PortraitDecompressor(data, offset)
+    y0, y1, first = next(dropped.iter_rows())
+    _expect(first == indices[:y1 * dropped.width], "first iter_rows range differs from table decoder")
+    _expect(dropped.bits_consumed <= decompressor.bits_consumed, "dropped iter_rows read past the full decode")
+    strict = _strict(lambda: SF1PortraitDecompressor(data, offset).get_indices(strict=True))
+    _expect(_same_error(strict, error), "strict error differs from decompressor.error")
+    _expect(strict is None or strict.partial == indices, "strict partial differs from the default result")
+    return _outcome(error), seconds, decompressor.size
+
+
+def fuzz_rle(data):
+    """Формат SF1PortraitCompressor: заголовок read_palette_from_header, затем все пути распаковки."""
+    try:
+        _, offset = read_palette_from_header(data)
+    except ValueError:
+        return REJECTED, None, None
+    stream = data[offset:]
+    start = time.perf_counter()
+    indices = decode_stream(stream)
+    seconds = time.perf_counter() - start
+
+    _expect(len(indices) == 64 * 64, "frame is not 64x64")
+    _expect(decode_stream(stream, tables=False) == indices, "bitwise decoder differs from table decoder")
+    _expect(parse_stream(stream).fill() == indices, "PortraitIR fill differs from table decoder")
+    error = _strict(lambda: decode_stream(stream, strict=True))
+    _expect(error is None or error.partial == indices, "strict partial differs from the default result")
+    _expect(_same_error(_strict(lambda: decode_stream(stream, False, True)), error),
+            "bitwise decoder stops elsewhere")
+    _expect(_same_error(_strict(lambda: parse_stream(stream, strict=True)), error),
+            "parse_stream stops elsewhere")
+    return _outcome(error), seconds, 64 * 64
+
+
+def fuzz_detect(data):
+    """
+    FormatDetector.detect не поднимает исключений ни на каком входе.
+    Время не делится на кадр: читаются только заголовок и PROBE_BYTES потока.
+    """
+    start = time.perf_counter()
+    result = detect(data)
+    seconds = time.perf_counter() - start
+    _expect(result['format'] in FORMATS + (None,), f"unknown format {result['format']!r}")
+    return f"format {result['format']}", seconds, 1
+
+
+TARGETS = {'sf1': fuzz_sf1, 'rle': fuzz_rle, 'detect': fuzz_detect}
+
+
+def run_target(target, data):
+    """
+    Один вход через цель. Возвращает: (итог, секунды, пиксели кадра, провал);
+    секунды и пиксели — None, если вход отвергнут или провален, провал —
+    None или строка вида 'crash TypeError: ...' / 'property ...'.
+    """
+    try:
+        outcome, seconds, pixels = TARGETS[target](data)
+    except PropertyFailure as e:
+        return 'failed', None, None, f"property {e}"
+    except Exception as e:
+        return 'failed', None, None, f"crash {type(e).__name__}: {e}"
+    return outcome, seconds, pixels, None
+
+
+def best_time(target, data, repeat):
+    """
+    Лучшее из repeat времён цели на входе, без сборщика мусора.
+    Возвращает: (секунды, пиксели кадра) или None, если вход не декодировался.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        runs = [run_target(target, data) for _ in range(repeat)]
+    finally:
+        if enabled:
+            gc.enable()
+    if any(seconds is None for _, seconds, _, _ in runs):
+        return None
+    return min(seconds for _, seconds, _, _ in runs), runs[0][2]
+
+
+# Мутации: (rnd, bytearray, затравки) -> bytearray
+
+def _graphic_offset(data):
+    record = record_at(memoryview(data), 0, magic=None)
+    return record['graphic_offset'] if record else None
+
+
+def flip_bits(rnd, data, seeds):
+    for _ in range(rnd.randrange(1, 9)):
+        if data:
+            data[rnd.randrange(len(data))] ^= 1 << rnd.randrange(8)
+    return data
+
+
+def set_bytes(rnd, data, seeds):
+    for _ in range(rnd.randrange(1, 5)):
+        if data:
+            data[rnd.randrange(len(data))] = rnd.choice((0, 0xFF, rnd.randrange(256)))
+    return data
+
+
+def truncate(rnd, data, seeds):
+    return data[:rnd.randrange(len(data) + 1)]
+
+
+def extend(rnd, data, seeds):
+    size = rnd.choice((1, 16, 256, 4096, 20000))
+    fill = rnd.choice((b'\x00', b'\xff', None))
+    return data + (fill * size if fill else _random_bytes(rnd, size))
+
+
+def insert_chunk(rnd, data, seeds):
+    at = rnd.randrange(len(data) + 1)
+    return data[:at] + _random_bytes(rnd, rnd.randrange(1, 64)) + data[at:]
+
+
+def delete_chunk(rnd, data, seeds):
+    at = rnd.randrange(len(data) + 1)
+    del data[at:at + rnd.randrange(1, 64)]
+    return data
+
+
+def repeat_chunk(rnd, data, seeds):
+    # Повтор куска: зацикленные команды (серии длины 0, одни и те же цепочки)
+    at = rnd.randrange(len(data) + 1)
+    chunk = data[at:at + rnd.randrange(1, 16)]
+    return data[:at] + chunk * rnd.randrange(2, 400) + data[at:]
+
+
+def splice(rnd, data, seeds):
+    other = rnd.choice(seeds)
+    return data[:rnd.randrange(len(data) + 1)] + other[rnd.randrange(len(other) + 1):]
+
+
+def mutate_header(rnd, data, seeds):
+    # Байт blink/talk/палитры: число кадров анимации, лишние биты цвета Genesis
+    end = _graphic_offset(data) or min(len(data), 38)
+    if end:
+        data[rnd.randrange(end)] = rnd.choice((0, 1, 0xFF, rnd.randrange(256)))
+    return data
+
+
+def mutate_frame(rnd, data, seeds):
+    # Ширина/высота кадра в восьмёрках пикселей (0 — пустой кадр)
+    offset = _graphic_offset(data)
+    if offset is not None:
+        data[offset + rnd.randrange(2)] = rnd.randrange(17)
+    return data
+
+
+MUTATIONS = (flip_bits, flip_bits, set_bytes, truncate, extend, insert_chunk, delete_chunk,
+             repeat_chunk, splice, mutate_header, mutate_frame)
+
+
+def genesis_palette_bytes(rnd):
+    """16 случайных слов Genesis 0000BBB0 GGG0RRR0 (их проверяет RomScanner)."""
+    return bytes(b for _ in range(16) for b in (rnd.randrange(8) << 1, rnd.randrange(256) & 0xEE))
+
+
+def seed_files(count, seed, paths=()):
+    """Затравки: count синтетических файлов каждого формата и файлы paths."""
+    rnd = random.Random(seed)
+    seeds = []
+    for _ in range(count):
+        width, height = rnd.choice(SF1_FRAMES)
+        seeds.append(EMPTY_BLOCKS + genesis_palette_bytes(rnd) + synth_sf1_stream(rnd, width, height))
+    seeds.extend(synth_rle_files(count, seed))
+    for path in paths:
+        with open(path, 'rb') as f:
+            seeds.append(f.read())
+    return seeds
+
+
+# Записи, где несколько длин блока подходят: (blink, talk). Хвост 00 00 — это и блок
+# count=0, а 00 01 за четыре байта до конца — блок count=1
+AMBIGUOUS_RECORDS = (
+    (b'\x00\x01\x05\x06\x07\x08', b'\x00\x02\x00\x01\x00\x00\x00\x00\x00\x00'),
+    (b'\x00\x02\x11\x12\x00\x01\x00\x00\x00\x00', b'\x00\x00'),
+    (b'\x00\x00', b'\x00\x03' + bytes(12)),
+)
+
+
+def check_record_layouts(records=AMBIGUOUS_RECORDS):
+    """
+    Образ ROM из мусора 0xFF и записи blink + talk + палитра + 08 08:
+    RomScanner.record_before_magic должен найти запись с её начала.
+    """
+    palette = b'\x0e\xee' * 16
+    for i, (blink, talk) in enumerate(records):
+        offset = 40
+        rom = b'\xff' * offset + blink + talk + palette + MAGIC + bytes(64)
+        found = record_before_magic(memoryview(rom), offset + len(blink) + len(talk) + len(palette))
+        expected = (offset, blink[1], talk[1])
+        got = found and (found['offset'], found['blink_frames'], found['talk_frames'])
+        if got != expected:
+            raise AssertionError(f"record layout #{i}: found {got} instead of {expected}")
+
+
+def make_input(seeds, seed, index):
+    """
+    Вход номер index: зависит только от seed, index и затравок.
+    Возвращает: (bytes, список применённых мутаций).
+    """
+    rnd = random.Random(f"{seed}:{index}")
+    roll = rnd.random()
+    if roll < 0.05:
+        return _random_bytes(rnd, rnd.randrange(600)), ['random']
+    data = bytearray(rnd.choice(seeds))
+    if roll < 0.15:
+        # Корректный заголовок, поток — мусор
+        offset = _graphic_offset(data)
+        if offset is not None:
+            data = data[:offset + 2] + _random_bytes(rnd, rnd.randrange(1, 2000))
+            return bytes(data), ['random stream']
+    names = []
+    for _ in range(rnd.choice((1, 1, 1, 2, 3, 8))):
+        mutation = rnd.choice(MUTATIONS)
+        data = mutation(rnd, data, seeds)
+        names.append(mutation.__name__)
+    return bytes(data), names
+
+
+def minimize(data, fails, budget=500):
+    """
+    Жадная минимизация: удаляет куски от половины входа до байта, пока
+    fails(вход) остаётся True; не больше budget проверок.
+    """
+    tries = 0
+    chunk = len(data) // 2
+    while chunk and tries < budget:
+        i = 0
+        while i < len(data) and tries < budget:
+            candidate = data[:i] + data[i + chunk:]
+            tries += 1
+            if fails(candidate):
+                data = candidate
+            else:
+                i += chunk
+        chunk //= 2
+    return data
+
+
+def _failure(target, index, kind, data, names, minimized):
+    return {
+        'target': target,
+        'index': index,
+        'kind': kind,
+        'mutations': names,
+        'size': len(data),
+        'minimized_size': len(minimized),
+        'minimized': minimized.hex(),
+    }
+
+
+def _save(failure, data, save_dir):
+    stem = os.path.join(save_dir, f"{failure['target']}_{failure['index']}")
+    with open(stem + '.bin', 'wb') as f:
+        f.write(data)
+    with open(stem + '.min.bin', 'wb') as f:
+        f.write(bytes.fromhex(failure['minimized']))
+
+
+def _ms_stats(times):
+    if not times:
+        return None
+    ordered = sorted(times)
+    return {
+        'median': round(statistics.median(ordered) * 1000, 4),
+        'p99': round(ordered[min(len(ordered) - 1, (len(ordered) * 99) // 100)] * 1000, 4),
+        'max': round(ordered[-1] * 1000, 4),
+    }
+
+
+def fuzz(targets=tuple(TARGETS), count=1000, seed=1, seeds=None, factor=10.0, min_ms=0.5,
+         repeat=3, minimize_budget=500, save_dir=None, indices=None):
+    """
+    Весь прогон. Возвращает dict: meta, targets (итоги и время по цели), failures.
+    indices — номера входов (по умолчанию range(count)).
+    """
+    seeds = seeds or seed_files(8, seed)
+    indices = range(count) if indices is None else indices
+    outcomes = {t: {} for t in targets}
+    times = {t: [] for t in targets}
+    failures = []
+    inputs = {}
+    for index in indices:
+        data, names = make_input(seeds, seed, index)
+        for target in targets:
+            outcome, seconds, pixels, failed = run_target(target, data)
+            outcomes[target][outcome] = outcomes[target].get(outcome, 0) + 1
+            if failed:
+                minimized = minimize(data, lambda d: _kind(run_target(target, d)[3]) == _kind(failed),
+                                     minimize_budget)
+                failures.append(_failure(target, index, failed, data, names, minimized))
+            elif seconds is not None:
+                times[target].append(seconds)
+                inputs[target, index] = (data, names, seconds, pixels)
+
+    # Медленные входы: время на пиксель против медианы цели, с перемером
+    for target in targets:
+        if not times[target]:
+            continue
+        rate = factor * statistics.median(s / w for (t, _), (_, _, s, w) in inputs.items() if t == target)
+
+        def slow(d, timing=None):
+            timing = timing or best_time(target, d, repeat)
+            return timing is not None and timing[0] * 1000 > min_ms and timing[0] / timing[1] > rate
+
+        for (t, index), (data, names, seconds, pixels) in inputs.items():
+            if t != target or not slow(data, (seconds, pixels)):
+                continue
+            best = best_time(target, data, repeat)
+            if not slow(data, best):
+                continue
+            outcomes[target][SLOW] = outcomes[target].get(SLOW, 0) + 1
+            minimized = minimize(data, slow, minimize_budget // repeat)
+            failures.append(_failure(target, index, f"{SLOW} {best[0] * 1000:.2f} ms, "
+                                     f"{best[0] / best[1] / rate * factor:.1f}x the median time per pixel",
+                                     data, names, minimized))
+
+    if save_dir:
+        os.makedirs(save_dir, exist_ok=True)
+        for failure in failures:
+            _save(failure, make_input(seeds, seed, failure['index'])[0], save_dir)
+    return {
+        'meta': {
+            'seed': seed,
+            'count': len(indices),
+            'seeds': len(seeds),
+            'targets': list(targets),
+            'factor': factor,
+            'min_ms': min_ms,
+            'repeat': repeat,
+        },
+        'targets': {t: {'outcomes': outcomes[t], 'ms': _ms_stats(times[t])} for t in targets},
+        'failures': failures,
+    }
+
+
+def format_report(report):
+    lines = []
+    for target, result in report['targets'].items():
+        counts = ", ".join(f"{k} {v}" for k, v in sorted(result['outcomes'].items()))
+        ms = result['ms']
+        timing = f"median {ms['median']:.3f} ms, p99 {ms['p99']:.3f} ms, max {ms['max']:.3f} ms" if ms else "no decodes"
+        lines.append(f"{target:6} {counts} | {timing}")
+    for failure in report['failures']:
+        lines.append(f"FAIL {failure['target']} input {failure['index']} ({' '.join(failure['mutations'])}): "
+                     f"{failure['kind']}; {failure['size']} -> {failure['minimized_size']} bytes: "
+                     f"{failure['minimized'][:128]}")
+    lines.append(f"{report['meta']['count']} inputs, seed {report['meta']['seed']}: "
+                 f"{len(report['failures'])} failures")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Fuzz the portrait decoders with random and mutated files")
+    ap.add_argument('--count', type=int, default=1000, help="number of generated inputs")
+    ap.add_argument('--seed', type=int, default=1, help="input seed (same seed, same inputs)")
+    ap.add_argument('--seeds', type=int, default=8, help="synthetic seed files per format")
+    ap.add_argument('--inputs', nargs='*', help="extra seed .bin files of either format (globs allowed)")
+    ap.add_argument('--targets', nargs='+', choices=list(TARGETS), default=list(TARGETS))
+    ap.add_argument('--factor', type=float, default=10.0, help="flag inputs slower than this many medians")
+    ap.add_argument('--min-ms', type=float, default=0.5, help="never flag inputs faster than this")
+    ap.add_argument('--repeat', type=int, default=3, help="timing repeats for inputs over the limit")
+    ap.add_argument('--minimize-budget', type=int, default=500, help="maximum runs to minimize one failure")
+    ap.add_argument('--replay', type=int, nargs='+', metavar='INDEX', help="run only these input numbers")
+    ap.add_argument('--save-failures', help="save every failing input and its minimized form here")
+    ap.add_argument('--out', '-o', help="write the report to this JSON file")
+    args = ap.parse_args(argv)
+
+    check_record_layouts()
+    seeds = seed_files(args.seeds, args.seed, expand_paths(args.inputs))
+    report = fuzz(args.targets, args.count, args.seed, seeds, args.factor, args.min_ms, args.repeat,
+                  args.minimize_budget, args.save_failures, args.replay)
+    print(format_report(report))
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 1 if report['failures'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
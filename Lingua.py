@@ -3,6 +3,7 @@ LANGS = {
     'ru': {
         'open_file': '📁 Открыть портрет SF1',
         'open_portrait': '📁 Открыть портрет',
+        'open_any': '📂 Открыть любой .bin',
         'open_png_file': '📁 Открыть PNG',
         'save_png': '💾 Сохранить PNG',
         'save_log': '📝 Сохранить лог',
@@ -12,11 +13,13 @@ LANGS = {
         'scale_up': '🔍 Увеличить',
         'scale_down': '🔎 Уменьшить',
         'language': 'Язык:',
-        'edit_animations': '✏️ Редактировать анимацию'
+        'edit_animations': '✏️ Редактировать анимацию',
+        'timing': '⏱ Замер стадий'
     },
     'en': {
         'open_file': '📁 Open SF1 Portrait',
         'open_portrait': '📁 Open Portrait',
+        'open_any': '📂 Open Any .bin',
         'open_png_file': '📁 Open PNG',
         'save_png': '💾 Save PNG',
         'save_log': '📝 Save Log',
@@ -26,11 +29,13 @@ LANGS = {
         'scale_up': '🔍 Zoom In',
         'scale_down': '🔎 Zoom Out',
         'language': 'Language:',
-        'edit_animations': '✏️ Edit Animations'
+        'edit_animations': '✏️ Edit Animations',
+        'timing': '⏱ Stage timing'
     },
     'it': {
         'open_file': '📁 Apri ritratto SF1',
         'open_portrait': '📁 Apri ritratto',
+        'open_any': '📂 Apri qualsiasi .bin',
         'open_png_file': '📁 Apri PNG',
         'save_png': '💾 Salva PNG',
         'save_log': '📝 Salva Log',
@@ -40,11 +45,13 @@ LANGS = {
         'scale_up': '🔍 Ingrandisci',
         'scale_down': '🔎 Riduci',
         'language': 'Lingua:',
-        'edit_animations': '✏️ Modifica Animazioni'
+        'edit_animations': '✏️ Modifica Animazioni',
+        'timing': '⏱ Tempi delle fasi'
     },
     'fr': {
         'open_file': '📁 Ouvrir portrait SF1',
         'open_portrait': '📁 Ouvrir portrait',
+        'open_any': '📂 Ouvrir un .bin',
         'open_png_file': '📁 Ouvrir PNG',
         'save_png': '💾 Enregistrer PNG',
         'save_log': '📝 Enregistrer log',
@@ -54,11 +61,13 @@ LANGS = {
         'scale_up': '🔍 Zoom avant',
         'scale_down': '🔎 Zoom arrière',
         'language': 'Langue:',
-        'edit_animations': '✏️ Modifier Animations'
+        'edit_animations': '✏️ Modifier Animations',
+        'timing': '⏱ Chronométrage des étapes'
     },
     'es': {
         'open_file': '📁 Abrir retrato SF1',
         'open_portrait': '📁 Abrir retrato',
+        'open_any': '📂 Abrir cualquier .bin',
         'open_png_file': '📁 Abrir PNG',
         'save_png': '💾 Guardar PNG',
         'save_log': '📝 Guardar Log',
@@ -68,11 +77,13 @@ LANGS = {
         'scale_up': '🔍 Ampliar',
         'scale_down': '🔎 Reducir',
         'language': 'Idioma:',
-        'edit_animations': '✏️ Editar Animaciones'
+        'edit_animations': '✏️ Editar Animaciones',
+        'timing': '⏱ Tiempos por etapa'
     },
     'ja': {
         'open_file': '📁 ポートレートを開く',
         'open_portrait': '📁 ポートレートを開く',
+        'open_any': '📂 .bin を自動判別して開く',
         'open_png_file': '📁 PNGを開く',
         'save_png': '💾 PNGを保存',
         'save_log': '📝 ログを保存',
@@ -82,11 +93,13 @@ LANGS = {
         'scale_up': '🔍 拡大',
         'scale_down': '🔎 縮小',
         'language': '言語:',
-        'edit_animations': '✏️ アニメーションを編集'
+        'edit_animations': '✏️ アニメーションを編集',
+        'timing': '⏱ 処理時間の計測'
     },
     'pt': {
         'open_file': '📁 Abrir retrato SF1',
         'open_portrait': '📁 Abrir retrato',
+        'open_any': '📂 Abrir qualquer .bin',
         'open_png_file': '📁 Abrir PNG',
         'save_png': '💾 Salvar PNG',
         'save_log': '📝 Salvar log',
@@ -96,11 +109,13 @@ LANGS = {
         'scale_up': '🔍 Aumentar zoom',
         'scale_down': '🔎 Diminuir zoom',
         'language': 'Idioma:',
-        'edit_animations': '✏️ Editar Animações'
+        'edit_animations': '✏️ Editar Animações',
+        'timing': '⏱ Tempo por etapa'
     },
     'el': {
         'open_file': '📁 Άνοιγμα πορτρέτου SF1',
         'open_portrait': '📁 Άνοιγμα πορτρέτου',
+        'open_any': '📂 Άνοιγμα οποιουδήποτε .bin',
         'open_png_file': '📁 Άνοιγμα PNG',
         'save_png': '💾 Αποθήκευση PNG',
         'save_log': '📝 Αποθήκευση αρχείου καταγραφής',
@@ -110,6 +125,7 @@ LANGS = {
         'scale_up': '🔍 Μεγέθυνση',
         'scale_down': '🔎 Σμίκρυνση',
         'language': 'Γλώσσα:',
-        'edit_animations': '✏️ Επεξεργασία Κινήσεων'
+        'edit_animations': '✏️ Επεξεργασία Κινήσεων',
+        'timing': '⏱ Χρονομέτρηση σταδίων'
     },
 }
\ No newline at end of file
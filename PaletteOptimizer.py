@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Предпроход перед SF1PortraitCompressor: подбор палитры под минимальный размер.
+
+Что влияет на размер, а что нет:
+  * порядок слотов палитры — нет: пиксель всегда занимает 4 бита, а серии и
+    копирования зависят только от равенства соседних индексов. Порядок
+    выбирается параметром order (first-seen, как у кодера, по частоте или
+    по яркости) и на размер не влияет;
+  * слияние близких цветов Genesis — да: серии разных цветов склеиваются.
+
+Поиск: каждое слияние пары цветов на расстоянии не больше max_distance
+(по максимуму разницы 3-битных каналов) оценивается отдельно, кандидаты
+считаются параллельно. Слияния, дающие хотя бы min_gain байт, применяются
+вместе. Если цветов Genesis больше 15, сначала сливаются ближайшие пары,
+пока палитра не влезет (сейчас кодер в этом случае просто отказывает).
+
+Байты палитры переписываются под новый порядок, картинка без слияний
+остаётся той же самой.
+"""
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from SF1PortraitCompressor import SF1PortraitCompressor, quantize_image
+
+ORDERS = ('first-seen', 'frequency', 'brightness')
+# Кроме прозрачного индекса 0
+MAX_COLORS = 15
+
+
+def genesis_colors(img):
+    """
+    Цвета картинки после квантования до Genesis.
+    Возвращает: (keys — ключ каждого пикселя, colors — dict ключ -> описание цвета
+    в порядке первого появления: rgb исходного первого пикселя, genesis (r3, g3, b3),
+    count — число пикселей, first — позиция первого пикселя).
+    """
+    raw, keys = quantize_image(img.convert('RGBA'))
+    counts = Counter(keys)
+    colors = {}
+    for key in dict.fromkeys(keys):
+        if not key:
+            continue
+        first = keys.index(key)
+        rgb = tuple(raw[first * 4:first * 4 + 3])
+        colors[key] = {
+            'rgb': rgb,
+            'genesis': tuple(c >> 5 for c in rgb),
+            'count': counts[key],
+            'first': first,
+        }
+    return keys, colors
+
+
+def distance(a, b):
+    """Расстояние между цветами Genesis: максимум разницы 3-битных каналов."""
+    return max(abs(x - y) for x, y in zip(a, b))
+
+
+def resolve(mapping, key):
+    # Идёт по цепочке слияний до цвета, который остался в палитре
+    while key in mapping:
+        key = mapping[key]
+    return key
+
+
+def merge_pair(colors, a, b):
+    """Пара (откуда, куда): более редкий цвет сливается в более частый."""
+    if (colors[a]['count'], -colors[a]['first']) > (colors[b]['count'], -colors[b]['first']):
+        a, b = b, a
+    return a, b
+
+
+def near_pairs(colors, max_distance, mapping=None):
+    """Все пары оставшихся цветов на расстоянии не больше max_distance, ближайшие первыми."""
+    mapping = mapping or {}
+    alive = [k for k in colors if k not in mapping]
+    pairs = []
+    for i, a in enumerate(alive):
+        for b in alive[i + 1:]:
+            d = distance(colors[a]['genesis'], colors[b]['genesis'])
+            if d <= max_distance:
+                pairs.append((d, merge_pair(colors, a, b)))
+    pairs.sort(key=lambda item: item[0])
+    return [pair for _, pair in pairs]
+
+
+def forced_merges(colors, limit=MAX_COLORS):
+    """Сливает ближайшие пары, пока цветов не станет не больше limit. Возвращает mapping."""
+    mapping = {}
+    while len(colors) - len(mapping) > limit:
+        alive = [k for k in colors if k not in mapping]
+        best = min(((distance(colors[a]['genesis'], colors[b]['genesis']),
+                     colors[a]['count'] + colors[b]['count'], a, b)
+                    for i, a in enumerate(alive) for b in alive[i + 1:]),
+                   key=lambda item: item[:2])
+        src, dst = merge_pair(colors, best[2], best[3])
+        mapping[src] = dst
+    return mapping
+
+
+def build(keys, colors, mapping, order='first-seen'):
+    """
+    Индексы и палитра после слияний mapping в порядке order.
+    Возвращает: (bytearray индексов, палитра из 16 цветов RGBA, слоты:
+    список (слот, ключ цвета, ключи слитых в него цветов)).
+    """
+    if order not in ORDERS:
+        raise ValueError(f"Unknown palette order {order!r}, expected one of {ORDERS}")
+    merged = {}
+    for key in colors:
+        merged.setdefault(resolve(mapping, key), []).append(key)
+    kept = list(merged)
+    if order == 'frequency':
+        kept.sort(key=lambda k: -sum(colors[m]['count'] for m in merged[k]))
+    elif order == 'brightness':
+        kept.sort(key=lambda k: sum(colors[k]['genesis']))
+
+    lut = {0: 0}
+    palette = [(0, 0, 0, 0)]
+    slots = []
+    for slot, key in enumerate(kept, 1):
+        for member in merged[key]:
+            lut[member] = slot
+        palette.append(colors[key]['rgb'] + (255,))
+        slots.append((slot, key, merged[key]))
+    while len(palette) < 16:
+        palette.append((0, 0, 0, 0))
+    return bytearray(map(lut.__getitem__, keys)), palette, slots
+
+
+def _size_job(job):
+    # Задание пула: (индексы, байты палитры, уровень сжатия) -> размер .bin
+    indices, palette_data, effort = job
+    return len(SF1PortraitCompressor(effort=effort).encode_indices(indices, palette_data))
+
+
+def _sizes(jobs, workers):
+    if workers == 1 or len(jobs) <= 1:
+        return [_size_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_size_job, jobs))
+
+
+def optimize_palette(image, effort='lazy', max_distance=1, order='first-seen', min_gain=1, workers=1):
+    """
+    Подбирает палитру для картинки 64x64.
+    Возвращает dict: data (bytes .bin), bytes, bpp, baseline (размер без слияний,
+    None, если без слияний палитра не влезает), order, slots, merges —
+    список (откуда, куда, выигрыш в байтах), colors — описание исходных цветов.
+    """
+    encoder = SF1PortraitCompressor(effort=effort)
+    keys, colors = genesis_colors(encoder.load_image(image))
+    mapping = forced_merges(colors)
+    forced = [(src, dst, None) for src, dst in mapping.items()]
+
+    def candidate(extra):
+        merges = dict(mapping)
+        for src, dst in extra:
+            merges[src] = dst
+        indices, palette, _ = build(keys, colors, merges, order)
+        return bytes(indices), bytes(encoder.encode_palette(palette)), effort
+
+    pairs = near_pairs(colors, max_distance, mapping)
+    sizes = _sizes([candidate([])] + [candidate([pair]) for pair in pairs], workers)
+    base = sizes[0]
+    gains = sorted(((base - size, pair) for size, pair in zip(sizes[1:], pairs) if base - size >= min_gain),
+                   key=lambda item: -item[0])
+
+    # Выигрышные слияния вместе; цвет, уже слитый в другой, повторно не трогаем
+    chosen = []
+    used = set()
+    for gain, (src, dst) in gains:
+        if src in used:
+            continue
+        chosen.append((src, dst, gain))
+        used.add(src)
+    # Слияния идут только от более редкого цвета к более частому, циклов не бывает
+    merges = dict(mapping)
+    for src, dst, _ in chosen:
+        merges[src] = dst
+    indices, palette, slots = build(keys, colors, merges, order)
+    data = encoder.encode_indices(indices, encoder.encode_palette(palette))
+    if chosen and len(data) > base - gains[0][0]:
+        # Вместе слияния вышли хуже лучшего одиночного — берём его
+        src, dst = gains[0][1]
+        merges = dict(mapping)
+        merges[src] = dst
+        chosen = [(src, dst, gains[0][0])]
+        indices, palette, slots = build(keys, colors, merges, order)
+        data = encoder.encode_indices(indices, encoder.encode_palette(palette))
+    return {
+        'data': data,
+        'bytes': len(data),
+        'bpp': encoder.stats['bpp'],
+        'baseline': None if mapping else base,
+        'order': order,
+        'slots': slots,
+        'merges': forced + chosen,
+        'colors': colors,
+    }
+
+
+def _hex(colors, key):
+    r, g, b = colors[key]['genesis']
+    return f"#{r << 5:02X}{g << 5:02X}{b << 5:02X}"
+
+
+def format_mapping(result):
+    """Текст отчёта: слоты палитры, слитые цвета и выигрыш."""
+    colors = result['colors']
+    lines = []
+    for slot, key, members in result['slots']:
+        sources = ", ".join(f"{_hex(colors, m)} ({colors[m]['count']} px)" for m in members)
+        lines.append(f"slot {slot:2d} {_hex(colors, key)} <- {sources}")
+    for src, dst, gain in result['merges']:
+        why = "to fit 15 colors" if gain is None else f"saves {gain} bytes"
+        lines.append(f"merge {_hex(colors, src)} -> {_hex(colors, dst)} ({why})")
+    baseline = result['baseline']
+    lines.append(f"{result['bytes']} bytes" + (f" (was {baseline})" if baseline is not None else ""))
+    return "\n".join(lines)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Пакетная обработка портретов без GUI.
+
+    python PortraitBatch.py decode portraits/ --format sf1 --out png/ --jobs 8
+    python PortraitBatch.py decode "custom/*.bin" --format rle --out png/
+    python PortraitBatch.py encode png/ --out bin/
+    python PortraitBatch.py headers portraits/ --format sf1
+    python PortraitBatch.py rom shining_force.bin --index portraits.json --extract png/
+    python PortraitBatch.py compare portraits/ --rom shining_force.bin
+    python PortraitBatch.py fit new_face.png --budget 1412 --out bin/ --preview
+    python PortraitBatch.py verify png/ --corpus lineart:200 --effort lazy
+    python PortraitBatch.py transcode portraits/ --to rle --out custom/
+    python PortraitBatch.py classify assets/
+    python PortraitBatch.py decode assets/ --format auto --out png/
+
+Работа раздаётся пулу процессов (--jobs, по умолчанию — число ядер),
+в конце печатается сводка: сколько файлов, скорость, ошибки.
+--profile / --trace включают замер стадий (StageTimer) и выполняют всё
+в одном процессе, чтобы стадии попали в одну временную шкалу.
+--parser-log пишет разбор заголовков в файл (тоже в одном процессе).
+Здесь — только разбор аргументов и сводка; обработчики команд и задания
+пула — в BatchCommands.py.
+"""
+import argparse
+import json
+import os
+import sys
+
+from SF1PortraitCompressor import EFFORTS
+from PortraitHeader import enable_parser_log
+import RomScanner
+from PortraitCorpus import KINDS
+from Transcoder import TARGETS
+from BatchCommands import FORMATS, COMMANDS
+from StageTimer import timer
+
+
+def summarize(command, results, elapsed, stream=sys.stdout, unit='files'):
+    """Печатает сводку по пропускной способности и ошибкам, возвращает её как dict."""
+    failed = [(path, error) for path, error, _, _ in results if error]
+    done = [result for _, error, result, _ in results if not error]
+    bytes_in = sum(r[0] for r in done)
+    summary = {
+        'command': command,
+        'files': len(results),
+        'ok': len(done),
+        'failed': len(failed),
+        'seconds': round(elapsed, 4),
+        'files_per_second': round(len(results) / elapsed, 2) if elapsed else None,
+        'bytes_in': bytes_in,
+        'failures': [{'path': path, 'error': error} for path, error in failed],
+    }
+    print(f"{command}: {summary['files']} {unit}, {summary['ok']} ok, {summary['failed']} failed "
+          f"in {elapsed:.2f}s ({summary['files_per_second'] or 0:.1f} {unit}/s, "
+          f"{bytes_in / 1024 / (elapsed or 1):.1f} KiB/s in)", file=stream)
+    for path, error in failed:
+        print(f"  FAILED {path}: {error}", file=stream)
+    return summary
+
+
+def build_parser():
+    ap = argparse.ArgumentParser(description="Headless batch conversion for SF1 portraits")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--jobs', '-j', type=int, default=None, help="worker processes (default: CPU count)")
+    common.add_argument('--summary-json', help="also write the run summary to this JSON file")
+    common.add_argument('--profile', help="time every stage and write the records to this JSON file (runs in one process)")
+    common.add_argument('--trace', help="time every stage and write a Chrome trace (chrome://tracing, Perfetto) to this file")
+    common.add_argument('--parser-log', help="log header parsing to this file (runs in one process)")
+    sub = ap.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('decode', parents=[common], help="decode .bin portraits to PNG")
+    p.add_argument('inputs', nargs='+', help="files, directories or glob patterns")
+    p.add_argument('--format', '-f', choices=FORMATS + ('auto',), default='sf1',
+                   help="sf1 = original portraits, rle = SF1PortraitCompressor output, auto = detect per file")
+    p.add_argument('--out', '-o', help="output directory (default: next to each input)")
+    p.add_argument('--cache-dir', help="keep decoded portraits here and reuse them on the next run")
+
+    p = sub.add_parser('encode', parents=[common], help="encode 64x64 PNGs to .bin with SF1PortraitCompressor")
+    p.add_argument('inputs', nargs='+', help="files, directories or glob patterns")
+    p.add_argument('--out', '-o', help="output directory (default: next to each input)")
+    p.add_argument('--effort', '-e', choices=EFFORTS, default='fast',
+                   help="fast = greedy, lazy = greedy without useless copies")
+    p.add_argument('--merge-distance', type=int, default=None,
+                   help="search palette merges of Genesis colors this close (0-7) and print the mapping")
+    p.add_argument('--merge-workers', type=int, default=None,
+                   help="worker processes for the merge search of each image "
+                        "(default: --jobs for a single image, otherwise 1 since images already run in parallel)")
+
+    p = sub.add_parser('transcode', parents=[common],
+                       help="convert .bin portraits between the original SF1 and the RLE format without re-quantizing")
+    p.add_argument('inputs', nargs='+', help="files, directories or glob patterns")
+    p.add_argument('--to', '-t', choices=TARGETS, required=True,
+                   help="target format: rle (from original SF1) or sf1 (from RLE)")
+    p.add_argument('--effort', '-e', choices=EFFORTS, default='fast', help="RLE encoder effort (--to rle)")
+    p.add_argument('--out', '-o', help="output directory (default: next to each input as <name>.<format>.bin)")
+
+    p = sub.add_parser('classify', parents=[common],
+                       help="tell original SF1 and RLE portraits apart from the header and the first bytes of the stream")
+    p.add_argument('inputs', nargs='+', help="files, directories or glob patterns")
+
+    p = sub.add_parser('headers', parents=[common], help="dump blink/talk/palette/magic headers")
+    p.add_argument('inputs', nargs='+', help="files, directories or glob patterns")
+    p.add_argument('--format', '-f', choices=FORMATS, default='sf1')
+
+    p = sub.add_parser('rom', parents=[common], help="find and decode every portrait in a ROM image")
+    p.add_argument('rom', help="ROM image file")
+    p.add_argument('--index', '-i', help="write the portrait index here (.json or .csv)")
+    p.add_argument('--extract', '-x', help="also save every portrait as PNG into this directory")
+    p.add_argument('--pointer-table', type=lambda s: int(s, 0),
+                   help="offset of a table of 32-bit big-endian portrait pointers")
+    p.add_argument('--count', type=int, help="number of pointers in --pointer-table")
+    p.add_argument('--chunk-size', type=int, default=RomScanner.CHUNK_SIZE,
+                   help="bytes of ROM per scan job")
+
+    p = sub.add_parser('fit', parents=[common], help="simplify PNGs until the .bin fits a byte budget")
+    p.add_argument('inputs', nargs='+', help="files, directories or glob patterns")
+    p.add_argument('--budget', '-b', type=int, required=True, help="maximum .bin size in bytes")
+    p.add_argument('--effort', '-e', choices=EFFORTS, default='lazy')
+    p.add_argument('--out', '-o', help="output directory (default: next to each input)")
+    p.add_argument('--preview', action='store_true', help="also save the decoded result as <name>.fit.png")
+
+    p = sub.add_parser('compare', parents=[common],
+                       help="re-encode original portraits and compare compressed sizes")
+    p.add_argument('inputs', nargs='*', help="original SF1 .bin files, directories or glob patterns")
+    p.add_argument('--rom', help="also take every portrait found in this ROM image")
+
+    p = sub.add_parser('verify', parents=[common],
+                       help="encode, decode and compare PNGs pixel by pixel (SF1PortraitCompressor round trip)")
+    p.add_argument('inputs', nargs='*', help="PNG files, directories or glob patterns")
+    p.add_argument('--corpus', nargs='+', default=[], metavar='KIND[:COUNT]',
+                   help=f"also verify generated portraits ({', '.join(KINDS)}), 100 per kind by default")
+    p.add_argument('--seed', type=int, default=1, help="seed of the generated portraits")
+    p.add_argument('--effort', '-e', choices=EFFORTS, default='fast')
+    p.add_argument('--save-failures', help="save the source PNG and .bin of every mismatch into this directory")
+    return ap
+
+
+def finish_timing(args):
+    """Печатает таблицу стадий и сохраняет --profile / --trace."""
+    if not timer.enabled:
+        return
+    print(timer.format_report())
+    if args.profile:
+        timer.save_json(args.profile)
+    if args.trace:
+        timer.save_chrome_trace(args.trace)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile or args.trace:
+        # В пуле стадии остались бы в процессах-исполнителях
+        args.jobs = 1
+        timer.enable()
+    if args.parser_log:
+        # Обработчик файла есть только в этом процессе
+        args.jobs = 1
+        enable_parser_log(args.parser_log)
+    if getattr(args, 'out', None):
+        os.makedirs(args.out, exist_ok=True)
+
+    handler, unit = COMMANDS[args.command]
+    results, elapsed, extra = handler(args)
+    finish_timing(args)
+    summary = summarize(args.command, results, elapsed, unit=unit)
+    summary.update(extra)
+    if args.summary_json:
+        with open(args.summary_json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+    return 1 if summary['failed'] or summary.get('mismatches') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
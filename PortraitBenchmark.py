@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Воспроизводимый бенчмарк кодеров и декодеров на синтетическом корпусе (PortraitCorpus).
+
+    python PortraitBenchmark.py --out bench.json
+    python PortraitBenchmark.py --kinds lineart noisy --count 64 --effort fast lazy
+    python PortraitBenchmark.py --out new.json --baseline old.json
+
+Для каждого вида корпуса замеряются (портретов в секунду, лучший из --repeat):
+  * encode — SF1PortraitCompressor.encode на каждом уровне сжатия
+    (compress — это encode плюс запись файла);
+  * decode-rle — decode_my_compressor (decompress_from_my_compressor без записи PNG);
+  * encode-native — SF1NativeCompressor.encode;
+  * decode-native — SF1PortraitDecompressor.get_data.
+Для кодеров — сжатый размер и биты графики на пиксель. Перед замером каждый
+декодер сверяется с исходными индексами.
+
+Результаты — JSON (--out): сведения о запуске (коммит, Python, Pillow) и список
+замеров; --baseline сравнивает с файлом прошлого запуска по (вид, операция, effort).
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import PIL
+
+from PortraitCorpus import KINDS, corpus
+from SF1PortraitCompressor import SF1PortraitCompressor, EFFORTS, HEADER_SIZE
+from SF1NativeCompressor import SF1NativeCompressor
+from SF1PortraitDecompressor import SF1PortraitDecompressor
+from RLEDecompressor import decode_my_compressor
+
+# blink + talk + палитра перед графикой у SF1NativeCompressor
+NATIVE_HEADER_SIZE = 2 + 2 + 32
+
+
+def _best(func, items, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _record(kind, operation, effort, count, seconds, sizes=None, graphics_bits=None):
+    record = {
+        'kind': kind,
+        'operation': operation,
+        'effort': effort,
+        'portraits': count,
+        'seconds': round(seconds, 6),
+        'per_second': round(count / seconds, 2) if seconds else None,
+    }
+    if sizes is not None:
+        record['bytes'] = sum(sizes)
+        record['bpp'] = round(graphics_bits / (count * 64 * 64), 4)
+    return record
+
+
+def bench_kind(kind, images, efforts, repeat):
+    """Замеры для одного вида корпуса: список dict (см. _record)."""
+    count = len(images)
+    records = []
+    rle_files = None
+    for effort in efforts:
+        encoder = SF1PortraitCompressor(effort=effort)
+        files = list(encoder.compress_many(images))
+        seconds = _best(encoder.encode, images, repeat)
+        bits = sum((len(f) - HEADER_SIZE) * 8 for f in files)
+        records.append(_record(kind, 'encode', effort, count, seconds, [len(f) for f in files], bits))
+        if rle_files is None:
+            rle_files = files
+            expected = []
+            for img in images:
+                encoder.index_pixels(img)
+                expected.append(bytes(encoder.indexed_pixels))
+
+    for i, data in enumerate(rle_files):
+        if bytes(decode_my_compressor(data)[1]) != expected[i]:
+            raise AssertionError(f"{kind} #{i}: decode_my_compressor differs from the encoded image")
+    records.append(_record(kind, 'decode-rle', None, count, _best(decode_my_compressor, rle_files, repeat)))
+
+    native = SF1NativeCompressor()
+    native_files = list(native.compress_many(images))
+    seconds = _best(native.encode, images, repeat)
+    # Графика без байт ширины/высоты
+    bits = sum((len(f) - NATIVE_HEADER_SIZE - 2) * 8 for f in native_files)
+    records.append(_record(kind, 'encode-native', None, count, seconds, [len(f) for f in native_files], bits))
+
+    def decode_native(data):
+        return SF1PortraitDecompressor(data).get_data(NATIVE_HEADER_SIZE)
+
+    for i, data in enumerate(native_files):
+        indices, _ = SF1PortraitDecompressor(data).get_indices(NATIVE_HEADER_SIZE)
+        if bytes(indices).replace(b'\xff', b'\0') != expected[i]:
+            raise AssertionError(f"{kind} #{i}: SF1PortraitDecompressor differs from the encoded image")
+    records.append(_record(kind, 'decode-native', None, count, _best(decode_native, native_files, repeat)))
+    return records
+
+
+def run(kinds=KINDS, count=32, seed=1, repeat=3, efforts=EFFORTS):
+    """Весь бенчмарк. Возвращает dict: meta (параметры и окружение) и results."""
+    results = []
+    for kind in kinds:
+        results.extend(bench_kind(kind, corpus(kind, count, seed), efforts, repeat))
+    return {
+        'meta': {
+            'commit': _commit(),
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'kinds': list(kinds),
+            'count': count,
+            'seed': seed,
+            'repeat': repeat,
+            'efforts': list(efforts),
+        },
+        'results': results,
+    }
+
+
+def _key(record):
+    return record['kind'], record['operation'], record['effort']
+
+
+def format_results(report, baseline=None):
+    """Таблица результатов; с baseline — ускорение и изменение bpp относительно него."""
+    old = {_key(r): r for r in baseline['results']} if baseline else {}
+    lines = [f"{'kind':9} {'operation':14} {'effort':8} {'portraits/s':>12} {'bytes':>8} {'bpp':>7}"
+             + (f" {'speed':>7} {'d bpp':>8}" if baseline else "")]
+    for r in report['results']:
+        line = (f"{r['kind']:9} {r['operation']:14} {r['effort'] or '-':8} {r['per_second']:12.1f} "
+                f"{r.get('bytes', ''):>8} {r['bpp'] if 'bpp' in r else '':>7}")
+        prev = old.get(_key(r))
+        if prev:
+            speed = r['per_second'] / prev['per_second'] if prev['per_second'] else 0
+            delta = f"{r['bpp'] - prev['bpp']:+8.4f}" if 'bpp' in r and 'bpp' in prev else f"{'':>8}"
+            line += f" {speed:6.2f}x {delta}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark portrait encoders and decoders on a generated corpus")
+    ap.add_argument('--kinds', nargs='+', choices=KINDS, default=list(KINDS), help="corpus kinds to run")
+    ap.add_argument('--count', type=int, default=32, help="portraits per kind")
+    ap.add_argument('--seed', type=int, default=1, help="corpus seed (same seed, same portraits)")
+    ap.add_argument('--repeat', type=int, default=3, help="timing repeats, best run is reported")
+    ap.add_argument('--effort', nargs='+', choices=EFFORTS, default=list(EFFORTS), help="encoder effort levels")
+    ap.add_argument('--out', '-o', help="write the results to this JSON file")
+    ap.add_argument('--baseline', help="results JSON of an earlier run to compare against")
+    args = ap.parse_args(argv)
+
+    report = run(args.kinds, args.count, args.seed, args.repeat, args.effort)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('seed') != args.seed or baseline['meta'].get('count') != args.count:
+            print("warning: baseline was run on a different corpus (seed/count)", file=sys.stderr)
+    print(format_results(report, baseline))
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
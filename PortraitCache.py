@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Кэш распакованных портретов, общий для GUI и пакетного режима.
+
+Ключ — sha1 от имени декодера и сжатых байт графики: один и тот же поток
+в другом файле или по другому пути попадает в ту же запись, изменённый
+файл — в новую. В памяти держится ограниченный LRU (OrderedDict) с буфером
+индексов и отрисованными картинками (по одной на палитру), на диске —
+необязательный второй уровень: только индексы, по файлу на ключ.
+
+    cache = PortraitCache(cache_dir='~/.sf1cache')
+    img, indices = cache.render('rle', graphics, palette_data)
+"""
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+
+from SF1PortraitDecompressor import SF1PortraitDecompressor
+from RLEDecompressor import decode_stream
+from PortraitRenderer import render_indices, decode_sf1_palette, decode_rle_palette
+
+DEFAULT_CAPACITY = 256
+# Сколько разных палитр одной графики держать отрисованными
+IMAGES_PER_ENTRY = 4
+
+
+def _decode_sf1(graphics):
+    decompressor = SF1PortraitDecompressor(graphics)
+    indices, _ = decompressor.get_indices(0)
+    return indices, decompressor.width, decompressor.height
+
+
+def _decode_rle(graphics):
+    return decode_stream(graphics), 64, 64
+
+
+# Декодер: (функция распаковки графики, функция палитры)
+DECODERS = {
+    'sf1': (_decode_sf1, decode_sf1_palette),
+    'rle': (_decode_rle, decode_rle_palette),
+}
+
+
+class PortraitCache:
+    def __init__(self, capacity=DEFAULT_CAPACITY, cache_dir=None):
+        self.capacity = capacity
+        self.cache_dir = os.path.expanduser(cache_dir) if cache_dir else None
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(decoder, graphics):
+        """sha1 от имени декодера и сжатых байт графики."""
+        digest = hashlib.sha1(decoder.encode('ascii') + b':')
+        digest.update(graphics)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.idx')
+
+    def _load(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(key), 'rb') as f:
+                raw = f.read()
+        except OSError:
+            return None
+        # Файл: ширина/8, высота/8, затем индексы
+        if len(raw) < 2 or len(raw) - 2 != raw[0] * raw[1] * 64:
+            return None
+        return {'indices': raw[2:], 'width': raw[0] * 8, 'height': raw[1] * 8, 'images': OrderedDict()}
+
+    def _save(self, key, entry):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Через временный файл и os.replace: процессы пула пишут в один каталог
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(bytes([entry['width'] // 8, entry['height'] // 8]))
+                f.write(entry['indices'])
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """Запись по ключу из памяти или с диска, либо None."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        entry = self._load(key)
+        if entry is not None:
+            self.disk_hits += 1
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key, indices, width, height):
+        entry = {'indices': bytes(indices), 'width': width, 'height': height, 'images': OrderedDict()}
+        self._remember(key, entry)
+        if self.cache_dir:
+            self._save(key, entry)
+        return entry
+
+    def lookup(self, decoder, graphics):
+        """Запись для графики: из кэша или распаковкой декодером decoder ('sf1' / 'rle')."""
+        graphics = bytes(graphics)
+        key = self.key(decoder, graphics)
+        entry = self.get(key)
+        if entry is None:
+            self.misses += 1
+            entry = self.put(key, *DECODERS[decoder][0](graphics))
+        return entry
+
+    def render(self, decoder, graphics, palette_data):
+        """
+        Картинка 'P' для графики с палитрой palette_data (32 байта из заголовка).
+        Возвращает: (PIL.Image, bytes индексов). Картинка общая — менять копию.
+        """
+        entry = self.lookup(decoder, graphics)
+        images = entry['images']
+        palette_key = bytes(palette_data)
+        img = images.get(palette_key)
+        if img is None:
+            palette = DECODERS[decoder][1](palette_data)
+            img = render_indices(entry['indices'], palette, entry['width'], entry['height'])
+            images[palette_key] = img
+            while len(images) > IMAGES_PER_ENTRY:
+                images.popitem(last=False)
+        else:
+            images.move_to_end(palette_key)
+        return img, entry['indices']
+
+    def clear(self):
+        """Очищает только память; диск остаётся."""
+        self._entries.clear()
+
+    def stats(self):
+        return {'entries': len(self._entries), 'hits': self.hits,
+                'disk_hits': self.disk_hits, 'misses': self.misses}
+
+
+_shared = None
+
+
+def shared_cache(cache_dir=None):
+    """
+    Общий кэш процесса (GUI, пакетный режим). cache_dir включает дисковый
+    уровень; повторный вызов с другим каталогом переключает его.
+    """
+    global _shared
+    if _shared is None:
+        _shared = PortraitCache(cache_dir=cache_dir)
+    elif cache_dir and _shared.cache_dir != os.path.expanduser(cache_dir):
+        _shared.cache_dir = os.path.expanduser(cache_dir)
+    return _shared
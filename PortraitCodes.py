@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Префиксные коды битового потока портретов и таблицы для их декодирования
+целым окном бит за один поиск вместо побитового чтения.
+
+Код длины (t/t2/t3 в SF1PortraitCompressor.repeat_last, пропуск в
+SF1PortraitDecompressor.get_data):
+    t3 нулей, единица, затем t3+1 бит остатка;
+    значение = (2 << t3) - 2 + остаток.
+
+Цепочка копирования вниз (SF1PortraitDecompressor):
+    1b   — copy_down_bit_right (сдвиг 0 или +1)
+    01   — copy_down_left(1)
+    0011 — copy_down_right(2)
+    0010 — copy_down_left(2)
+    000  — конец цепочки
+
+Префикс команды после пикселя (RLEDecompressor):
+    0           — копирования нет
+    1 1 xx x    — копирования нет, служебные биты
+    1 0 1 xx x  — копирование вниз-влево на 1
+    1 0 0 yy xx x — копирование вниз-влево на 2
+"""
+
+RUN_WINDOW = 16
+CHAIN_WINDOW = 8
+PREFIX_WINDOW = 8
+# Самая длинная серия в кадре 64x64
+MAX_RUN = 64 * 64
+
+
+def run_code(value):
+    """Код длины для value: (биты кода, число бит), как в repeat_last."""
+    t3 = 0
+    while value >= (2 << (t3 + 1)) - 2:
+        t3 += 1
+    rem = value - ((2 << t3) - 2)
+    return (1 << (t3 + 1)) | rem, 2 * (t3 + 1)
+
+
+def _build_run_table():
+    # Запись: (значение << 5) | длина кода; 0 — код длиннее окна
+    table = [0] * (1 << RUN_WINDOW)
+    t3 = 0
+    while 2 * (t3 + 1) <= RUN_WINDOW:
+        n = 2 * (t3 + 1)
+        span = RUN_WINDOW - n
+        for rem in range(1 << (t3 + 1)):
+            start = ((1 << (t3 + 1)) | rem) << span
+            table[start:start + (1 << span)] = [(((2 << t3) - 2 + rem) << 5) | n] * (1 << span)
+        t3 += 1
+    return table
+
+
+def _parse_chain(window, nbits):
+    # Разбирает столько команд цепочки, сколько целиком помещается в окне
+    i = 0
+    dxs = []
+    while True:
+        left = nbits - i
+        bits = [(window >> (nbits - 1 - i - k)) & 1 for k in range(min(left, 4))]
+        if left >= 2 and bits[0]:
+            dxs.append(bits[1])
+            i += 2
+        elif left >= 2 and bits[1]:
+            dxs.append(-1)
+            i += 2
+        elif left >= 4 and bits[2]:
+            dxs.append(2 if bits[3] else -2)
+            i += 4
+        elif left >= 3 and not bits[2]:
+            return i + 3, tuple(dxs), True
+        else:
+            return i, tuple(dxs), False
+
+
+def _build_chain_table():
+    # Запись: (сколько бит съедено, сдвиги относительно width, цепочка закончилась)
+    return [_parse_chain(w, CHAIN_WINDOW) for w in range(1 << CHAIN_WINDOW)]
+
+
+def _build_prefix_table():
+    # Запись: (сколько бит съедено, смещение copy_down_left или 0)
+    table = []
+    for w in range(1 << PREFIX_WINDOW):
+        b = [(w >> (PREFIX_WINDOW - 1 - k)) & 1 for k in range(PREFIX_WINDOW)]
+        if not b[0]:
+            table.append((1, 0))
+        elif b[1]:
+            table.append((5, 0))
+        elif b[2]:
+            table.append((6, 1))
+        else:
+            table.append((8, 2))
+    return table
+
+
+# Коды цепочки для кодера: сдвиг относительно width -> (биты, число бит)
+CHAIN_CODES = {0: (0b10, 2), 1: (0b11, 2), -1: (0b01, 2), 2: (0b0011, 4), -2: (0b0010, 4)}
+CHAIN_END = (0b000, 3)
+
+RUN_CODES = [run_code(v) for v in range(MAX_RUN + 1)]
+RUN_TABLE = _build_run_table()
+CHAIN_TABLE = _build_chain_table()
+PREFIX_TABLE = _build_prefix_table()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Синтетический корпус портретов 64x64 для бенчмарков и проверок.
+
+Виды (по возрастанию сложности для кодеров):
+  * flat     — несколько крупных залитых фигур, 3-5 цветов;
+  * lineart  — «лицо»: силуэт головы и волос на прозрачном фоне, тени,
+               тёмный контур в один пиксель (ближе всего к настоящим портретам);
+  * dithered — упорядоченный дизеринг (Байер 4x4) градиентов между парами цветов;
+  * noisy    — случайный пиксель из 15 цветов в каждой точке.
+
+Цвета берутся сразу на сетке Genesis (3 бита на канал, шаг 32), так что
+квантование кодера их не склеивает и палитра всегда влезает в 15 цветов.
+Один и тот же seed даёт один и тот же корпус.
+
+    images = corpus('lineart', 16, seed=1)
+"""
+import random
+
+from PIL import Image, ImageDraw
+
+KINDS = ('flat', 'lineart', 'dithered', 'noisy')
+SIZE = 64
+TRANSPARENT = (0, 0, 0, 0)
+
+_BAYER = [[0, 8, 2, 10], [12, 4, 14, 6], [3, 11, 1, 9], [15, 7, 13, 5]]
+
+
+def genesis_palette(rnd, count):
+    """count разных непрозрачных цветов на сетке Genesis."""
+    colors = set()
+    while len(colors) < count:
+        colors.add((rnd.randrange(8) << 5, rnd.randrange(8) << 5, rnd.randrange(8) << 5, 255))
+    return sorted(colors)
+
+
+def _box(rnd, low=4, high=60):
+    x0, x1 = sorted(rnd.sample(range(low, high), 2))
+    y0, y1 = sorted(rnd.sample(range(low, high), 2))
+    return [x0, y0, x1, y1]
+
+
+def flat(rnd):
+    img = Image.new('RGBA', (SIZE, SIZE), TRANSPARENT)
+    draw = ImageDraw.Draw(img)
+    colors = genesis_palette(rnd, rnd.randrange(3, 6))
+    for _ in range(rnd.randrange(3, 7)):
+        shape = rnd.choice((draw.rectangle, draw.ellipse))
+        shape(_box(rnd), fill=rnd.choice(colors))
+    return img
+
+
+def lineart(rnd):
+    img = Image.new('RGBA', (SIZE, SIZE), TRANSPARENT)
+    draw = ImageDraw.Draw(img)
+    skin, shade, hair, hair_shade, cloth, eye = genesis_palette(rnd, 6)
+    outline = (0, 0, 0, 255)
+    # Плечи, голова, тень на щеке, волосы
+    draw.rectangle([8, 50, 56, 63], fill=cloth, outline=outline)
+    cx = 32 + rnd.randrange(-4, 5)
+    draw.ellipse([cx - 16, 12, cx + 16, 54], fill=skin)
+    draw.ellipse([cx + 2, 30, cx + 15, 52], fill=shade)
+    draw.ellipse([cx - 16, 12, cx + 16, 54], outline=outline)
+    draw.chord([cx - 19, 4, cx + 19, 40], 180, 360, fill=hair, outline=outline)
+    for _ in range(rnd.randrange(3, 8)):
+        x = rnd.randrange(cx - 16, cx + 16)
+        draw.line([x, 6, x + rnd.randrange(-4, 5), 20], fill=hair_shade)
+    # Глаза, нос, рот
+    for ex in (cx - 8, cx + 4):
+        draw.rectangle([ex, 30, ex + 4, 32], fill=eye, outline=outline)
+    draw.line([cx, 34, cx - 2, 40], fill=outline)
+    draw.line([cx - 5, 45, cx + 5, 45], fill=outline)
+    return img
+
+
+def dithered(rnd):
+    img = Image.new('RGBA', (SIZE, SIZE), TRANSPARENT)
+    colors = genesis_palette(rnd, rnd.randrange(4, 9))
+    pixels = []
+    bands = [(rnd.choice(colors), rnd.choice(colors)) for _ in range(rnd.randrange(1, 4))]
+    for y in range(SIZE):
+        a, b = bands[y * len(bands) // SIZE]
+        for x in range(SIZE):
+            level = (x * 16) // SIZE
+            pixels.append(b if _BAYER[y % 4][x % 4] < level else a)
+    img.putdata(pixels)
+    return img
+
+
+def noisy(rnd):
+    img = Image.new('RGBA', (SIZE, SIZE))
+    colors = genesis_palette(rnd, 15)
+    img.putdata([rnd.choice(colors) for _ in range(SIZE * SIZE)])
+    return img
+
+
+GENERATORS = {'flat': flat, 'lineart': lineart, 'dithered': dithered, 'noisy': noisy}
+
+
+def corpus(kind, count, seed=1):
+    """Список count картинок RGBA вида kind; seed и вид задают корпус однозначно."""
+    if kind not in GENERATORS:
+        raise ValueError(f"Unknown corpus kind {kind!r}, expected one of {KINDS}")
+    rnd = random.Random(f"{kind}:{seed}")
+    return [GENERATORS[kind](rnd) for _ in range(count)]
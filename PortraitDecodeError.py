@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Ошибка распаковки портрета и бюджеты декодеров.
+
+Оба декодера (SF1PortraitDecompressor, RLEDecompressor) читают не больше
+bit_budget бит и не больше command_budget команд: бюджеты считаются от
+размера кадра и длины входа. Честный поток в них всегда укладывается, а
+мусор (битый файл, неверное смещение в ROM) останавливается сразу, а не
+дочитывает весь образ.
+
+По умолчанию декодеры, как и раньше, молча отдают недописанный кадр;
+с strict=True — PortraitDecodeError с причиной, битом остановки и этим
+же недописанным кадром в partial.
+"""
+
+# Самый дорогой честный пиксель — отдельная команда с копированием: меньше
+# 16 бит у обоих форматов; запас — на заголовок и код конца потока
+BITS_PER_PIXEL = 16
+SLACK_BITS = 256
+
+STREAM_ENDED = "stream ended before the frame was complete"
+BITS_EXCEEDED = "bit budget exceeded"
+COMMANDS_EXCEEDED = "command budget exceeded"
+
+
+def bit_budget(size, available_bits):
+    """Сколько бит потока можно прочитать для кадра из size пикселей."""
+    return min(available_bits, size * BITS_PER_PIXEL + SLACK_BITS)
+
+
+def command_budget(size):
+    """
+    Сколько команд может быть в кадре: позиции команд растут, так что
+    команд не больше, чем пикселей (плюс одна в позиции -1 у SF1).
+    """
+    return size + 1
+
+
+class PortraitDecodeError(ValueError):
+    """
+    Поток не распаковался до конца кадра.
+    reason — причина (STREAM_ENDED, BITS_EXCEEDED, COMMANDS_EXCEEDED или
+    ошибка заголовка), bit_pos — бит потока, на котором декодер остановился,
+    partial — bytearray уже распакованных индексов кадра или None.
+    """
+
+    def __init__(self, reason, bit_pos=None, partial=None):
+        where = f" at bit {bit_pos}" if bit_pos is not None else ""
+        super().__init__(f"{reason}{where}")
+        self.reason = reason
+        self.bit_pos = bit_pos
+        self.partial = partial
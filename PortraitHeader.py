@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Общий разбор заголовка портрета для SF1PortraitParser и RleParser.
+
+Раскладка (sf1_portrait_rules.txt):
+    blink: 00, count, count*4 байт
+    talk:  00, count, count*4 байт
+    палитра: 32 байта
+    magic: 08 08 — с них начинается графика, остаются декомпрессору
+
+Источник — путь к файлу либо bytes/bytearray/memoryview/mmap со смещением:
+данные не копируются, разбор идёт по memoryview. Смещения считаются лениво,
+при первом обращении к полям. Поля blink/talk/palette/magic отдаются как
+bytes (это десятки байт).
+
+Логирование — в логгер модуля подкласса ('SF1PortraitParser', 'RleParser'),
+без basicConfig. Строки сообщений (и hex-дампы на уровне DEBUG) собираются,
+только если этот уровень включён; включить запись в файл — enable_parser_log().
+"""
+import logging
+import os
+
+from StageTimer import stage, timed
+
+MAGIC = b"\x08\x08"
+PALETTE_SIZE = 32
+LOGGERS = ('SF1PortraitParser', 'RleParser')
+# Без обработчика предупреждения разбора уходили бы в stderr (logging.lastResort)
+for _name in LOGGERS:
+    logging.getLogger(_name).addHandler(logging.NullHandler())
+del _name
+
+
+class _Hex:
+    """hex-дамп, который строится только при форматировании сообщения."""
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __format__(self, spec):
+        return bytes(self.data).hex(' ').upper()
+
+
+def enable_parser_log(filename='parser.log', level=logging.INFO):
+    """Пишет сообщения парсеров в файл (как раньше parser.log). DEBUG — с hex-дампами."""
+    handler = logging.FileHandler(filename, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    for name in LOGGERS:
+        logger = logging.getLogger(name)
+        logger.setLevel(level)
+        logger.addHandler(handler)
+    return handler
+
+
+class PortraitHeader:
+    """
+    Ленивый разбор blink/talk/palette/magic.
+    Подкласс задаёт MESSAGES (тексты сообщений и предупреждений) и SUMMARY (подписи отчёта).
+    """
+    __slots__ = ('bin_path', 'data', 'ln', 'logger', '_parsed', '_warnings',
+                 '_blink', '_talk', '_palette', '_magic', '_graphic_offset')
+
+    MESSAGES = {
+        'loaded': "Loaded file {}, size={} bytes",
+        'first_bytes': "First 60 bytes: {}",
+        'not_zero': "Block at position {} does not start with 0x00 (found {:02X})",
+        'beyond': "Block at position {} is beyond file length",
+        'no_count': "Incomplete block at position {} (missing count byte)",
+        'too_long': "Block at position {} exceeds file length (count={}, expected length={}, available={})",
+        'skip': "Skipping block at position {}, count={}, length={}",
+        'blink': "Blink block parsed, size={}, data={}, pos={}",
+        'no_blink': "File does not start with 0x00 — blink block missing or corrupted",
+        'talk': "Talk block parsed, size={}, data={}, pos={}",
+        'talk_wrong': "Expected talk block with 0x00 at position {}, but found {:02X}",
+        'talk_eof': "Reached end of file after blink — talk block missing",
+        'palette': "Palette parsed, size={}, data={}, pos={}",
+        'short_palette': "Insufficient data for palette (available {} bytes instead of 32)",
+        'before_magic': "Data before magic bytes at position {}: {}",
+        'magic_read': "Reading magic bytes at position {}: {}",
+        'bad_magic': "Expected magic bytes 08 08, but found {} at position {}",
+        'magic_ok': "Found magic bytes: {}",
+        'no_magic': "Magic bytes not found (available {} bytes instead of 2)",
+        'graphic_offset': "Graphic offset (including magic bytes): {}",
+        'saved': "Saved SF1 .bin to {}, new size={}, graphic_offset={}",
+        'save_error': "Error saving SF1 file: {}",
+    }
+    SUMMARY = {'bytes': "bytes", 'missing': "Missing", 'palette': "Palette",
+               'palette32': "Palette (32 bytes)", 'magic': "Magic"}
+
+    def __init__(self, source, offset=0, length=None):
+        self.logger = logging.getLogger(type(self).__module__)
+        if isinstance(source, (str, os.PathLike)):
+            self.bin_path = source
+            with stage('read'), open(source, "rb") as f:
+                source = f.read()
+        else:
+            self.bin_path = None
+        view = memoryview(source)
+        end = len(view) if length is None else min(len(view), offset + length)
+        self.data = view[offset:end] if offset or end != len(view) else view
+        self.ln = len(self.data)
+        self._parsed = False
+        self._log(logging.INFO, 'loaded', self.bin_path or '<buffer>', self.ln)
+        self._log(logging.DEBUG, 'first_bytes', _Hex(self.data[:60]))
+
+    def _log(self, level, key, *args):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, self.MESSAGES[key].format(*args))
+
+    def _warn(self, key, *args):
+        message = self.MESSAGES[key].format(*args)
+        self.logger.warning(message)
+        self._warnings.append(f"⚠️ {message}")
+
+    def _ensure(self):
+        if not self._parsed:
+            self.parse()
+
+    # Поля считаются при первом обращении; присваивание (AnimationEditor) меняет разобранное значение
+    def _field(name):
+        attr = '_' + name
+
+        def get(self):
+            self._ensure()
+            return getattr(self, attr)
+
+        def set(self, value):
+            self._ensure()
+            setattr(self, attr, value)
+        return property(get, set)
+
+    blink = _field('blink')
+    talk = _field('talk')
+    palette = _field('palette')
+    magic = _field('magic')
+    graphic_offset = _field('graphic_offset')
+    del _field
+
+    @property
+    def warnings(self):
+        self._ensure()
+        return self._warnings
+
+    def _skip_block(self, data, pos):
+        ln = len(data)
+        if pos >= ln or data[pos] != 0x00:
+            # Если достигли конца файла, избегаем ошибки индексации
+            if pos < ln:
+                self._warn('not_zero', pos, data[pos])
+            else:
+                self._warn('beyond', pos)
+            return pos
+        if pos + 1 >= ln:
+            self._warn('no_count', pos)
+            return pos + 1  # Пропускаем только маркер, если нет счёта
+        count = data[pos + 1]
+        skip = 2 + count * 4
+        if pos + skip > ln:
+            self._warn('too_long', pos, count, skip, ln - pos)
+        self._log(logging.DEBUG, 'skip', pos, count, skip)
+        return min(pos + skip, ln)
+
+    @timed('parse')
+    def parse(self):
+        """Разбирает заголовок заново (например, после save)."""
+        self._parsed = True
+        self._warnings = []
+        self._blink = self._talk = self._palette = self._magic = b""
+        self._graphic_offset = None
+        data = self.data
+        ln = self.ln
+        pos = 0
+        # Блок blink
+        if ln > 0 and data[0] == 0x00:
+            pos = self._skip_block(data, pos)
+            self._blink = bytes(data[:pos])
+            self._log(logging.DEBUG, 'blink', len(self._blink), _Hex(self._blink), pos)
+        else:
+            self._warn('no_blink')
+
+        # Блок talk (всегда ожидается после blink)
+        if pos < ln and data[pos] == 0x00:
+            talk_start = pos
+            pos = self._skip_block(data, pos)
+            self._talk = bytes(data[talk_start:pos])
+            self._log(logging.DEBUG, 'talk', len(self._talk), _Hex(self._talk), pos)
+        elif pos < ln:
+            self._warn('talk_wrong', pos, data[pos])
+        else:
+            self._warn('talk_eof')
+
+        # Палитра (32 байта)
+        if pos + PALETTE_SIZE <= ln:
+            self._palette = bytes(data[pos:pos + PALETTE_SIZE])
+            pos += PALETTE_SIZE
+        else:
+            self._warn('short_palette', ln - pos)
+            self._palette = bytes(data[pos:])
+            pos = ln
+        self._log(logging.DEBUG, 'palette', len(self._palette), _Hex(self._palette), pos)
+
+        if pos < ln:
+            self._log(logging.DEBUG, 'before_magic', pos, _Hex(data[pos:min(pos + 4, ln)]))
+
+        # Байты магии (08 08) — оставляем для декомпрессора
+        if pos + 2 <= ln:
+            self._magic = bytes(data[pos:pos + 2])
+            self._log(logging.DEBUG, 'magic_read', pos, _Hex(self._magic))
+            if self._magic != MAGIC:
+                self._warn('bad_magic', _Hex(self._magic), pos)
+            else:
+                self._log(logging.DEBUG, 'magic_ok', self._magic.hex().upper())
+        else:
+            self._warn('no_magic', ln - pos)
+
+        # Графика начинается с байтов магии (08 08)
+        self._graphic_offset = pos
+        self._log(logging.INFO, 'graphic_offset', pos)
+
+    def get_summary_text(self):
+        words = self.SUMMARY
+        lines = []
+        lines.append(f"Size: {self.ln} {words['bytes']}")
+        lines.append("")
+        lines.append("Blink:")
+        if self.blink:
+            lines.append(f"  Hex: {self.blink[:16].hex(' ').upper()}{' ...' if len(self.blink)>16 else ''}")
+        else:
+            lines.append(f"  {words['missing']}")
+        lines.append("Talk:")
+        if self.talk:
+            lines.append(f"  Hex: {self.talk[:16].hex(' ').upper()}{' ...' if len(self.talk)>16 else ''}")
+        else:
+            lines.append(f"  {words['missing']}")
+        lines.append(f"Palette: {len(self.palette)} {words['bytes']}")
+        if self.palette:
+            # пары hex палитры
+            pairs = [f"{self.palette[i]:02X} {self.palette[i+1]:02X}" for i in range(0, min(len(self.palette), 32), 2)]
+            lines.append("  " + ", ".join(pairs))
+        lines.append(f"Magic: {len(self.magic)} {words['bytes']} {self.magic.hex(' ').upper() if self.magic else ''}")
+        lines.append(f"Graphic offset: {self.graphic_offset}")
+        lines.append(f"Graphic size: {max(0, self.ln - (self.graphic_offset or self.ln))} {words['bytes']}")
+        return "\n".join(lines)
+
+    def export_blocks_text(self):
+        """Текстовый отчёт о blink/talk/palette/magic."""
+        words = self.SUMMARY
+        lines = []
+        lines.append(f"Blink: {self.blink.hex(' ').upper() if self.blink else 'none'}")
+        lines.append(f"Talk: {self.talk.hex(' ').upper() if self.talk else 'none'}")
+        if self.palette:
+            pairs = [f"{self.palette[i]:02X} {self.palette[i+1]:02X}" for i in range(0, len(self.palette), 2)]
+            lines.append(f"{words['palette32']}: " + ", ".join(pairs))
+        else:
+            lines.append(f"{words['palette']}: none")
+        lines.append(f"{words['magic']}: {self.magic.hex(' ').upper() if self.magic else 'none'}")
+        return "\n".join(lines)
+
+    def save(self, dest_path=None):
+        """
+        Сохраняет .bin с текущими полями blink/talk/palette.
+        Если dest_path = None, перезаписывает исходный файл (self.bin_path);
+        у парсера, созданного из буфера, файла нет — тогда ValueError.
+        Файл собирается как:
+          [blink] + [talk] + [палитра (32 байта)] + [остальное с исходного graphic_offset]
+        Сжатая графика (байты магии + данные) сохраняется без изменений.
+        """
+        if dest_path is None:
+            if self.bin_path is None:
+                raise ValueError("Parser was created from a buffer: pass dest_path to save it")
+            dest_path = self.bin_path
+        try:
+            original = self.data
+
+            # graphic_offset; если его нет — ищем байты магии, иначе до конца
+            graph_off = self.graphic_offset
+            if graph_off is None:
+                idx = bytes(original).find(MAGIC)
+                graph_off = idx if idx != -1 else len(original)
+
+            blink_bytes = bytes(self.blink or b'')
+            talk_bytes = bytes(self.talk or b'')
+
+            # Палитра: ровно 32 байта (паддинг или обрезка)
+            palette_bytes = bytes(self.palette or b'')
+            if len(palette_bytes) < PALETTE_SIZE:
+                palette_bytes = palette_bytes + b'\x00' * (PALETTE_SIZE - len(palette_bytes))
+            else:
+                palette_bytes = palette_bytes[:PALETTE_SIZE]
+
+            rest = original[graph_off:] if graph_off < len(original) else b''
+            new_data = blink_bytes + talk_bytes + palette_bytes + bytes(rest)
+
+            with open(dest_path, "wb") as out:
+                out.write(new_data)
+
+            # Внутреннее состояние — как у нового файла
+            self.data = memoryview(new_data)
+            self.ln = len(new_data)
+            self._graphic_offset = len(blink_bytes) + len(talk_bytes) + PALETTE_SIZE
+            self._log(logging.INFO, 'saved', dest_path, self.ln, self._graphic_offset)
+            return dest_path
+
+        except Exception as e:
+            self.logger.error(self.MESSAGES['save_error'].format(e))
+            raise
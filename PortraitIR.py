@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Промежуточное представление портрета: список команд, общий для обоих форматов.
+
+Команда — (pos, pixel, run, chain):
+    pos   — позиция пикселя в кадре;
+    pixel — индекс палитры 0..15;
+    run   — длина серии: пиксели pos..pos+run-1 (в потоке SF1 всегда 1);
+    chain — сдвиги цепочки копирования вниз относительно width: каждый шаг
+            pos2 += width + dx и запись pixel (у RLE — одна копия -1 или -2).
+
+Команды применяются по порядку: пиксель, цепочка, затем остаток серии,
+поэтому перекрытия разрешаются так же, как в декодерах. Хранится в
+упакованных массивах array: pos, pixel, run по команде, цепочки — подряд
+в dxs, где цепочка команды i — dxs[chain_start[i]:chain_start[i + 1]].
+
+Декодеры (SF1PortraitDecompressor.get_ir, RLEDecompressor.parse_stream)
+только разбирают биты в IR; fill() отдельно превращает его в индексы,
+заливая серии срезами. Кодеры пишут поток из IR (emit / write_ir).
+"""
+from array import array
+
+_FILL = [bytes([v]) for v in range(256)]
+
+
+class PortraitIR:
+    __slots__ = ('width', 'height', 'pos', 'pixel', 'run', 'chain_start', 'dxs')
+
+    def __init__(self, width=64, height=64):
+        self.width = width
+        self.height = height
+        self.pos = array('i')
+        self.pixel = array('B')
+        self.run = array('I')
+        self.chain_start = array('I', [0])
+        self.dxs = array('b')
+
+    @classmethod
+    def packed(cls, width, height, pos, pixel, run, chain_start, dxs):
+        """IR из готовых последовательностей (chain_start — с ведущим 0, длиной len(pos) + 1)."""
+        ir = cls(width, height)
+        ir.pos.extend(pos)
+        ir.pixel.extend(pixel)
+        ir.run.extend(run)
+        ir.chain_start = array('I', chain_start)
+        ir.dxs.extend(dxs)
+        return ir
+
+    def append(self, pos, pixel, run=1, chain=()):
+        self.pos.append(pos)
+        self.pixel.append(pixel)
+        self.run.append(run)
+        if chain:
+            self.dxs.extend(chain)
+        self.chain_start.append(len(self.dxs))
+
+    def __len__(self):
+        return len(self.pos)
+
+    def chain(self, i):
+        return tuple(self.dxs[self.chain_start[i]:self.chain_start[i + 1]])
+
+    def __iter__(self):
+        """Команды как кортежи (pos, pixel, run, chain)."""
+        starts = self.chain_start
+        dxs = self.dxs
+        for i, (pos, pixel, run) in enumerate(zip(self.pos, self.pixel, self.run)):
+            yield pos, pixel, run, tuple(dxs[starts[i]:starts[i + 1]])
+
+    def fill(self, background=0):
+        """
+        Индексы кадра (bytearray width*height); незаписанные пиксели — background.
+        Серии заливаются срезом, цепочки — по шагам; записи за кадром отбрасываются.
+        """
+        width = self.width
+        size = width * self.height
+        data = bytearray(_FILL[background]) * size
+        starts = self.chain_start
+        dxs = self.dxs
+        fill = _FILL
+        for i, (pos, pixel, run) in enumerate(zip(self.pos, self.pixel, self.run)):
+            data[pos] = pixel
+            a, b = starts[i], starts[i + 1]
+            if a != b:
+                pos2 = pos
+                for dx in dxs[a:b]:
+                    pos2 += width + dx
+                    if pos2 < size:
+                        data[pos2] = pixel
+            if run > 1:
+                stop = min(pos + run, size)
+                if stop > pos + 1:
+                    data[pos + 1:stop] = fill[pixel] * (stop - pos - 1)
+        return data
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Общий путь отрисовки: буфер индексов палитры + 16 цветов -> PIL.Image.
+
+Картинка строится одним вызовом frombytes в режиме 'P' с putpalette,
+индекс 0 прозрачный. Индексы вне палитры (например, 0xFF — незаписанные
+пиксели SF1PortraitDecompressor) тоже считаются прозрачными.
+"""
+from PIL import Image
+
+from StageTimer import timed
+
+PALETTE_SIZE = 16
+# Индексы >= 16 -> 0 (прозрачный)
+_CLAMP = bytes(i if i < PALETTE_SIZE else 0 for i in range(256))
+
+
+def _flat_palette(palette):
+    flat = []
+    for color in list(palette)[:PALETTE_SIZE]:
+        flat.extend(color[:3])
+    flat.extend([0] * (PALETTE_SIZE * 3 - len(flat)))
+    return flat
+
+
+@timed('palette')
+def decode_sf1_palette(palette_data):
+    """
+    Палитра оригинального портрета SF1 (слово Genesis 0000BBB0GGG0RRR0,
+    3 бита на канал, шаг 255 // 7). Индекс 0 прозрачный.
+    """
+    pal = []
+    for i in range(16):
+        if i*2+1 >= len(palette_data):
+            pal.append((0,0,0,255))
+            continue
+        low = palette_data[i*2]
+        high = palette_data[i*2+1]
+        word = (low << 8) | high
+        r = ((word >> 0) & 0x0E) >> 1
+        g = ((word >> 4) & 0x0E) >> 1
+        b = ((word >> 8) & 0x0E) >> 1
+        scale = 255 // 7
+        r = r * scale
+        g = g * scale
+        b = b * scale
+        alpha = 0 if i == 0 else 255
+        pal.append((r,g,b,alpha))
+    return pal
+
+
+@timed('palette')
+def decode_rle_palette(palette_data):
+    """
+    Палитра портрета SF1PortraitCompressor (ниблы B / G,R, масштаб /15).
+    Индекс 0 прозрачный.
+    """
+    pal = []
+    for i in range(0, 32, 2):
+        first = palette_data[i]
+        second = palette_data[i+1]
+        b_n = first & 0x0F
+        g_n = (second >> 4) & 0x0F
+        r_n = second & 0x0F
+        r = int(round(r_n * 255 / 15))
+        g = int(round(g_n * 255 / 15))
+        b = int(round(b_n * 255 / 15))
+        alpha = 0 if i == 0 else 255
+        pal.append((r, g, b, alpha))
+    return pal
+
+
+@timed('render')
+def render_indices(indices, palette, width=64, height=64):
+    """
+    Рисует один портрет.
+    indices — bytes/bytearray/memoryview длиной width*height,
+    palette — до 16 цветов (r, g, b[, a]); альфа берётся только у индекса 0.
+    Возвращает: PIL.Image в режиме 'P' с прозрачностью на индексе 0.
+    """
+    frame = width * height
+    img = Image.frombytes('P', (width, height), bytes(indices[:frame]).ljust(frame, b'\0').translate(_CLAMP))
+    img.putpalette(_flat_palette(palette))
+    img.info['transparency'] = 0
+    return img
@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 import io
-from PIL import Image
+from itertools import accumulate
+from PortraitRenderer import render_indices
+from PortraitCodes import RUN_WINDOW, RUN_TABLE, PREFIX_WINDOW, PREFIX_TABLE
+from StageTimer import timed
+from PortraitIR import PortraitIR
+from PortraitDecodeError import (PortraitDecodeError, bit_budget, command_budget,
+                                 STREAM_ENDED, BITS_EXCEEDED, COMMANDS_EXCEEDED)
 
 class BitReader:
     def __init__(self, data: bytes):
@@ -38,6 +44,7 @@ class BitReader:
         return val
 
 
+@timed('palette')
 def read_palette_from_header(data):
     """
     Динамически находит и читает палитру, учитывая переменную длину блоков BLINK и TALK.
@@ -71,94 +78,357 @@ def read_palette_from_header(data):
         b = int(round(b_n * 255 / 15))
         pal.append((r, g, b, 255))
     graphic_offset = offset + 32 + 2  # +2 для MAGIC байтов после палитры
-    # Для отладки: убери print после теста
-    print(f"Calculated graphic_offset: {graphic_offset}")
     return pal, graphic_offset
 
 
-def decompress_from_my_compressor(data_stream: io.BytesIO, output_png_path: str):
+def _decode_bitwise(br, indexed, pos=0, commands=0, max_commands=command_budget(64*64)):
     """
-    Распаковывает BIN, созданный SF1PortraitCompressor, в PNG 64x64.
-    Теперь самодостаточная: читает палитру и рассчитывает offset графики внутри.
-    Возвращает: путь к сохранённому PNG файлу.
+    Эталонный побитовый цикл: каждый бит через BitReader.
+    Продолжает распаковку с позиции pos; конец потока посреди команды
+    останавливает цикл (пиксель и копия этой команды уже записаны).
+    Возвращает: (позиция остановки, число команд).
     """
-    data = data_stream.read()
-    palette, graphic_offset = read_palette_from_header(data)
-    stream = data[graphic_offset:]
-    br = BitReader(stream)
-
-    W, H, SIZE = 64, 64, 64*64
-    indexed = [0]*SIZE
-    pos, last = 0, 0
-
-    br.get_bit(); br.get_bit()
+    W, SIZE = 64, 64*64
 
     while pos < SIZE:
         pix = br.get_bits(4)
         if pix is None: break
+        commands += 1
+        if commands > max_commands: break
         pix &= 0xF
         indexed[pos] = pix
-        last = pix
 
         nxt = br.get_bit()
         if nxt is None: break
 
         if nxt == 1:
-            b0 = br.get_bit()
-            if b0 == 0:
-                b1 = br.get_bit()
-                offset = 1 if b1==1 else 2
-                if offset==2: br.get_bit(); br.get_bit()
+            if br.get_bit() == 0:
+                offset = 1 if br.get_bit() == 1 else 2
+                if offset == 2: br.get_bits(2)
                 target = pos + W - offset
                 if 0 <= target < SIZE:
-                    indexed[target] = last
-            br.get_bit(); br.get_bit()
-            br.get_bit()
-            t3=0
-            while True:
-                b=br.get_bit()
-                if b==1: break
-                t3+=1
-            t=2; t2=2
-            for _ in range(t3):
-                t+=t2; t2*=2
-            rem=0
-            for _ in range(t3+1):
-                rem=(rem<<1)|br.get_bit()
-            repeat=(t-2)+rem
-            for k in range(1,repeat):
-                idx=pos+k
-                if idx<SIZE: indexed[idx]=last
-            pos+=repeat
-            continue
+                    indexed[target] = pix
+            br.get_bits(3)
+        repeat = _read_run(br)
+        if repeat is None: break
+        # серия за кадр не пишется: длина из мусорного кода может быть огромной
+        for idx in range(pos + 1, min(pos + repeat, SIZE)):
+            indexed[idx] = pix
+        pos += repeat
+    return pos, commands
+
+
+# Запас бит, при котором команда гарантированно читается без конца потока
+_TAIL_BITS = 64
+_FILL = [bytes([v]) for v in range(16)]
+
+
+def _bit_pos(br):
+    # Бит остановки BitReader; нечётный последний байт дополнен нулями — их не считаем
+    return min(br.offset * 8 - br.length, len(br.data) * 8)
+
+
+def _decode_tables(stream, indexed, max_commands=command_budget(64*64)):
+    """
+    Табличный цикл: пиксель, префикс команды и код длины серии разбираются
+    окнами через таблицы PortraitCodes, серии заливаются срезом.
+    Хвост потока (меньше _TAIL_BITS бит) и аномально длинные коды
+    дочитываются эталонным _decode_bitwise с начала команды.
+    Возвращает: (позиция остановки, число команд, бит остановки).
+    """
+    W, SIZE = 64, 64*64
+    prefix_table = PREFIX_TABLE
+    run_table = RUN_TABLE
+    fill = _FILL
+    end = len(stream) & ~1  # только целые слова; нечётный байт — в побитовый хвост
+    if not end:
+        br = BitReader(stream)
+        br.get_bit(); br.get_bit()
+        pos, commands = _decode_bitwise(br, indexed, max_commands=max_commands)
+        return pos, commands, _bit_pos(br)
+    # первые два служебных бита (11) пропускаем
+    acc, nbits, p = (stream[0] << 8) | stream[1], 14, 2
+    pos = 0
+    commands = 0
+
+    while pos < SIZE:
+        if nbits + (end - p) * 8 < _TAIL_BITS:
+            break
+        while nbits < _TAIL_BITS:
+            acc = ((acc & ((1 << nbits) - 1)) << 16) | (stream[p] << 8) | stream[p + 1]
+            p += 2
+            nbits += 16
+        pix = (acc >> (nbits - 4)) & 0xF
+        used, offset = prefix_table[(acc >> (nbits - 4 - PREFIX_WINDOW)) & 0xFF]
+        r = nbits - 4 - used
+        entry = run_table[(acc >> (r - RUN_WINDOW)) & 0xFFFF]
+        if entry:
+            r -= entry & 0x1F
+            repeat = entry >> 5
         else:
-            t3=0
-            while True:
-                b=br.get_bit()
-                if b==1: break
-                t3+=1
-            t=2; t2=2
-            for _ in range(t3):
-                t+=t2; t2*=2
-            rem=0
-            for _ in range(t3+1):
-                rem=(rem<<1)|br.get_bit()
-            repeat=(t-2)+rem
-            for k in range(1,repeat):
-                idx=pos+k
-                if idx<SIZE: indexed[idx]=last
-            pos+=repeat
+            v = acc & ((1 << r) - 1)
+            t3 = r - v.bit_length() if v else r
+            if 2 * (t3 + 1) > r:
+                break
+            r -= 2 * (t3 + 1)
+            repeat = (2 << t3) - 2 + ((v >> r) & ((1 << (t3 + 1)) - 1))
+        commands += 1
+        if commands > max_commands:
+            # Как у _decode_bitwise: остановка сразу после пикселя лишней команды
+            return pos, commands, p * 8 - nbits + 4
+        nbits = r
+
+        indexed[pos] = pix
+        if offset:
+            target = pos + W - offset
+            if 0 <= target < SIZE:
+                indexed[target] = pix
+        if repeat > 1:
+            stop = min(pos + repeat, SIZE)
+            if stop > pos + 1:
+                indexed[pos + 1:stop] = fill[pix] * (stop - pos - 1)
+        pos += repeat
+
+    if pos < SIZE:
+        # Побитовый хвост с начала незавершённой команды
+        br = BitReader(stream)
+        if nbits % 16:
+            br.offset = p - 2 * (nbits // 16)
+            br.length = nbits % 16
+            br.barrel = ((acc >> (nbits - br.length)) << (16 - br.length)) & 0xFFFF
+        else:
+            br.offset = p - nbits // 8
+        pos, commands = _decode_bitwise(br, indexed, pos, commands, max_commands)
+        return pos, commands, _bit_pos(br)
+    return pos, commands, p * 8 - nbits
+
+
+def _take_bits(br, n):
+    # n бит из BitReader кусками до слова; None — поток кончился
+    val = 0
+    while n:
+        if not br.length and not br._fill():
+            return None
+        take = min(n, br.length)
+        val = (val << take) | ((br.barrel & 0xFFFF) >> (16 - take))
+        br.barrel = (br.barrel << take) & 0xFFFFFFFF
+        br.length -= take
+        n -= take
+    return val
+
+
+def _read_run(br):
+    # Код длины серии: t3 нулей, единица, t3+1 бит остатка; None — поток кончился
+    t3 = 0
+    while True:
+        if br.length and not br.barrel & 0xFFFF:
+            # остаток слова — одни нули (мусор, поток из нулей): пропускаем словом
+            t3 += br.length
+            br.length = 0
             continue
+        b = br.get_bit()
+        if b is None:
+            return None
+        if b == 1:
+            break
+        t3 += 1
+    rem = br.get_bits(t3 + 1) if t3 < 16 else _take_bits(br, t3 + 1)
+    if rem is None:
+        return None
+    return (2 << t3) - 2 + rem
+
+
+def _parse_bitwise(br, commands, pos=0, max_commands=command_budget(64*64)):
+    """
+    Побитовый разбор в команды (позиция, пиксель, длина, сдвиг копии или 0),
+    как _decode_bitwise, но без записи в кадр. Если поток кончился посреди
+    команды, её пиксель и копия остаются (длина 1), как у _decode_bitwise,
+    и разбор останавливается. Лишняя команда сверх max_commands не
+    добавляется, но считается.
+    Возвращает: (позиция остановки, число команд).
+    """
+    SIZE = 64*64
+    while pos < SIZE:
+        pix = br.get_bits(4)
+        if pix is None:
+            break
+        if len(commands) >= max_commands:
+            return pos, len(commands) + 1
+        pix &= 0xF
+        nxt = br.get_bit()
+        if nxt is None:
+            commands.append((pos, pix, 1, 0))
+            break
+        offset = 0
+        if nxt == 1:
+            if br.get_bit() == 0:
+                offset = 1 if br.get_bit() == 1 else 2
+                if offset == 2:
+                    br.get_bits(2)
+            br.get_bits(3)
+        repeat = _read_run(br)
+        if repeat is None:
+            commands.append((pos, pix, 1, offset))
+            break
+        commands.append((pos, pix, repeat, offset))
+        pos += repeat
+    return pos, len(commands)
+
+
+def _parse_tables(stream, max_commands=command_budget(64*64)):
+    """
+    Табличный разбор (как _decode_tables) в список команд
+    (позиция, пиксель, длина серии, сдвиг копии вниз-влево или 0).
+    Хвост потока дочитывается _parse_bitwise.
+    Возвращает: (список команд, позиция остановки, число команд, бит остановки).
+    """
+    SIZE = 64*64
+    prefix_table = PREFIX_TABLE
+    run_table = RUN_TABLE
+    commands = []
+    append = commands.append
+    end = len(stream) & ~1
+    if not end:
+        br = BitReader(stream)
+        br.get_bit(); br.get_bit()
+        pos, count = _parse_bitwise(br, commands, max_commands=max_commands)
+        return commands, pos, count, _bit_pos(br)
+    acc, nbits, p = (stream[0] << 8) | stream[1], 14, 2
+    pos = 0
 
-    img = Image.new('RGBA', (W, H))
-    px = img.load()
-    for i, v in enumerate(indexed):
-        x = i % W
-        y = i // W
-        if v == 0:
-            px[x, y] = (0, 0, 0, 0)
+    while pos < SIZE:
+        if nbits + (end - p) * 8 < _TAIL_BITS:
+            break
+        while nbits < _TAIL_BITS:
+            acc = ((acc & ((1 << nbits) - 1)) << 16) | (stream[p] << 8) | stream[p + 1]
+            p += 2
+            nbits += 16
+        pix = (acc >> (nbits - 4)) & 0xF
+        used, offset = prefix_table[(acc >> (nbits - 4 - PREFIX_WINDOW)) & 0xFF]
+        r = nbits - 4 - used
+        entry = run_table[(acc >> (r - RUN_WINDOW)) & 0xFFFF]
+        if entry:
+            r -= entry & 0x1F
+            repeat = entry >> 5
+        else:
+            v = acc & ((1 << r) - 1)
+            t3 = r - v.bit_length() if v else r
+            if 2 * (t3 + 1) > r:
+                break
+            r -= 2 * (t3 + 1)
+            repeat = (2 << t3) - 2 + ((v >> r) & ((1 << (t3 + 1)) - 1))
+        if len(commands) >= max_commands:
+            return commands, pos, len(commands) + 1, p * 8 - nbits + 4
+        nbits = r
+        append((pos, pix, repeat, offset))
+        pos += repeat
+
+    if pos < SIZE:
+        br = BitReader(stream)
+        if nbits % 16:
+            br.offset = p - 2 * (nbits // 16)
+            br.length = nbits % 16
+            br.barrel = ((acc >> (nbits - br.length)) << (16 - br.length)) & 0xFFFF
         else:
-            r, g, b, a = palette[v & 0xF]
-            px[x, y] = (r, g, b, 255)
+            br.offset = p - nbits // 8
+        pos, count = _parse_bitwise(br, commands, pos, max_commands)
+        return commands, pos, count, _bit_pos(br)
+    return commands, pos, len(commands), p * 8 - nbits
+
+
+def _clamp(stream):
+    # Бюджет бит: дальше bit_budget поток не читается
+    limit = bit_budget(64*64, len(stream) * 8) // 8
+    if len(stream) > limit:
+        return stream[:limit], True
+    return stream, False
+
+
+def _check(pos, commands, clamped, bit_pos, partial):
+    # Кадр не дописан или бюджет команд исчерпан — PortraitDecodeError с причиной, иначе None
+    if commands > command_budget(64*64):
+        reason = COMMANDS_EXCEEDED
+    elif pos >= 64*64:
+        return None
+    elif clamped:
+        reason = BITS_EXCEEDED
+    else:
+        reason = STREAM_ENDED
+    return PortraitDecodeError(reason, bit_pos, partial)
+
+
+def parse_stream(stream, strict=False):
+    """
+    Разбирает графику (байты после magic) в PortraitIR 64x64 без записи пикселей.
+    Копия вниз-влево на offset — цепочка из одного шага -offset.
+    Кадр — parse_stream(stream).fill(), то же, что decode_stream(stream).
+    strict — как в decode_stream (partial ошибки — PortraitIR).
+    """
+    stream, clamped = _clamp(stream)
+    commands, pos, count, bit_pos = _parse_tables(stream)
+    ir = PortraitIR(64, 64)
+    if commands:
+        last_pos, pix, repeat, offset = commands[-1]
+        if repeat > 64*64 - last_pos:
+            # за кадр выходит только последняя серия; длина из мусорного кода не влезает в IR
+            commands[-1] = (last_pos, pix, 64*64 - last_pos, offset)
+        positions, pixels, runs, offsets = zip(*commands)
+        starts = list(accumulate((1 if o else 0 for o in offsets), initial=0))
+        ir = PortraitIR.packed(64, 64, positions, pixels, runs, starts, [-o for o in offsets if o])
+    if strict:
+        error = _check(pos, count, clamped, bit_pos, ir)
+        if error:
+            raise error
+    return ir
+
+
+@timed('decode')
+def decode_stream(stream, tables=True, strict=False):
+    """
+    Распаковывает графику (байты после magic) в список индексов палитры 64x64.
+    tables=False — побитовый эталонный декодер (для сравнения и отладки).
+    Читается не больше бюджета бит и команд (PortraitDecodeError.py). Если кадр
+    не дописан (поток кончился или бюджет исчерпан), возвращается то, что успело
+    распаковаться; strict=True вместо этого поднимает PortraitDecodeError.
+    """
+    stream, clamped = _clamp(stream)
+    indexed = bytearray(64*64)
+    if tables:
+        pos, commands, bit_pos = _decode_tables(stream, indexed)
+    else:
+        br = BitReader(stream)
+        br.get_bit(); br.get_bit()
+        pos, commands = _decode_bitwise(br, indexed)
+        bit_pos = _bit_pos(br)
+    if strict:
+        error = _check(pos, commands, clamped, bit_pos, indexed)
+        if error:
+            raise error
+    return indexed
+
+
+def decode_my_compressor(data, strict=False):
+    """
+    Распаковывает BIN, созданный SF1PortraitCompressor, целиком в памяти.
+    data — bytes/bytearray/memoryview или файловый объект (io.BytesIO).
+    strict=True — недописанный кадр поднимает PortraitDecodeError (см. decode_stream).
+    Возвращает: (палитра RGBA, bytearray индексов 64x64, PIL.Image 'P', индекс 0 прозрачный).
+    """
+    if hasattr(data, 'read'):
+        data = data.read()
+    palette, graphic_offset = read_palette_from_header(data)
+    indexed = decode_stream(data[graphic_offset:], strict=strict)
+
+    img = render_indices(indexed, palette)
+    return palette, indexed, img
+
+
+def decompress_from_my_compressor(data_stream: io.BytesIO, output_png_path: str):
+    """
+    Распаковывает BIN, созданный SF1PortraitCompressor, в PNG 64x64.
+    Обёртка над decode_my_compressor, которая только сохраняет картинку.
+    Возвращает: путь к сохранённому PNG файлу.
+    """
+    _, _, img = decode_my_compressor(data_stream)
     img.save(output_png_path)
     return output_png_path
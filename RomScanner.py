@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Поиск и распаковка портретов прямо в образе ROM Shining Force.
+
+Образ отображается в память (mmap), ничего не копируется. Запись портрета
+ищется по той же раскладке, что проверяет SF1PortraitParser.parse:
+    blink (00, count, count*4) + talk (00, count, count*4) + палитра 32 байта + 08 08
+Либо, если известна таблица указателей, записи берутся по указателям.
+Найденная графика распаковывается SF1PortraitDecompressor прямо по смещению.
+
+Сканирование режется на куски по образу и раздаётся пулу процессов;
+каждый процесс сам открывает и отображает файл.
+"""
+import mmap
+import os
+
+from SF1PortraitDecompressor import SF1PortraitDecompressor
+from PortraitDecodeError import PortraitDecodeError
+
+MAGIC = b'\x08\x08'
+PALETTE_SIZE = 32
+# Больше кадров анимации в блоке blink/talk не бывает на практике
+MAX_FRAMES = 16
+CHUNK_SIZE = 256 * 1024
+
+
+def is_genesis_palette(pal):
+    """Каждый цвет — слово Genesis 0000BBB0 GGG0RRR0: лишние биты нулевые."""
+    for i in range(0, len(pal), 2):
+        if pal[i] & 0xF1 or pal[i + 1] & 0x11:
+            return False
+    return True
+
+
+def _blocks_before(buf, end, low):
+    # Блоки 00, count, count*4 байт, заканчивающиеся ровно на end: от большего count
+    # к меньшему. Подходить могут несколько (хвост блока 00 00 — это и блок count=0),
+    # а настоящий блок целиком включает меньшие
+    for count in range(MAX_FRAMES, -1, -1):
+        start = end - 2 - count * 4
+        if start >= low and buf[start] == 0 and buf[start + 1] == count:
+            yield start, count
+
+
+def record_before_magic(buf, magic_pos, low=0):
+    """
+    Восстанавливает запись по найденным байтам magic: палитра перед ними,
+    перед палитрой — talk, перед ним — blink. Из подходящих длин блоков берётся
+    самый длинный talk, перед которым есть blink, и самый длинный такой blink.
+    Возвращает dict записи или None, если раскладка не сходится.
+    """
+    pal_start = magic_pos - PALETTE_SIZE
+    if pal_start < low or not is_genesis_palette(buf[pal_start:magic_pos]):
+        return None
+    for talk in _blocks_before(buf, pal_start, low):
+        blink = next(_blocks_before(buf, talk[0], low), None)
+        if blink is not None:
+            return {
+                'offset': blink[0],
+                'blink_frames': blink[1],
+                'talk_frames': talk[1],
+                'palette_offset': pal_start,
+                'graphic_offset': magic_pos,
+            }
+    return None
+
+
+def record_at(buf, offset, magic=MAGIC):
+    """
+    Разбирает запись вперёд от offset (режим таблицы указателей). None — не портрет.
+    magic=None — любые два байта ширины/высоты после палитры, не только 08 08.
+    """
+    pos = offset
+    counts = []
+    for _ in range(2):
+        if pos + 2 > len(buf) or buf[pos] != 0:
+            return None
+        counts.append(buf[pos + 1])
+        pos += 2 + buf[pos + 1] * 4
+    pal_start = pos
+    magic_pos = pal_start + PALETTE_SIZE
+    if magic_pos + 2 > len(buf) or (magic is not None and buf[magic_pos:magic_pos + 2] != magic):
+        return None
+    if not is_genesis_palette(buf[pal_start:magic_pos]):
+        return None
+    return {
+        'offset': offset,
+        'blink_frames': counts[0],
+        'talk_frames': counts[1],
+        'palette_offset': pal_start,
+        'graphic_offset': magic_pos,
+    }
+
+
+def decode_record(buf, record):
+    """
+    Распаковывает графику записи на месте. Дополняет запись полями
+    width/height/compressed_length/non_transparent и возвращает индексы,
+    либо None, если поток не похож на портрет.
+    """
+    decompressor = SF1PortraitDecompressor(buf, record['graphic_offset'])
+    try:
+        indices, non_trans = decompressor.get_indices(strict=True)
+    except PortraitDecodeError:
+        # поток кончился раньше кадра или вышел за бюджет бит/команд
+        return None
+    if not non_trans:
+        # ничего не нарисовал
+        return None
+    record['width'] = decompressor.width
+    record['height'] = decompressor.height
+    record['compressed_length'] = decompressor.stream_length
+    record['non_transparent'] = non_trans
+    return indices
+
+
+def _scan_chunk(job):
+    # Задание пула: (путь ROM, начало, конец, каталог для PNG или None)
+    path, start, end, extract_dir = job
+    records = []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = mm.find(MAGIC, start, end + 1)
+        while pos != -1 and pos < end:
+            record = record_before_magic(mm, pos)
+            if record is not None:
+                indices = decode_record(mm, record)
+                if indices is not None:
+                    records.append(record)
+                    if extract_dir:
+                        _extract(mm, record, indices, extract_dir)
+            pos = mm.find(MAGIC, pos + 1, end + 1)
+    return end - start, records
+
+
+def _pointer_chunk(job):
+    # Задание пула: (путь ROM, список смещений записей, каталог для PNG или None)
+    path, offsets, extract_dir = job
+    records = []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for offset in offsets:
+            record = record_at(mm, offset) if 0 <= offset < len(mm) else None
+            if record is None:
+                continue
+            indices = decode_record(mm, record)
+            if indices is not None:
+                records.append(record)
+                if extract_dir:
+                    _extract(mm, record, indices, extract_dir)
+    return sum(r['compressed_length'] for r in records), records
+
+
+def _extract(buf, record, indices, extract_dir):
+    from PortraitRenderer import render_indices, decode_sf1_palette
+    palette = decode_sf1_palette(buf[record['palette_offset']:record['graphic_offset']])
+    img = render_indices(indices, palette, record['width'], record['height'])
+    img.save(os.path.join(extract_dir, f"portrait_{record['offset']:06X}.png"))
+
+
+def read_pointer_table(path, table_offset, count, mask=0x00FFFFFF):
+    """Читает count 32-битных указателей (big-endian, как у 68000) начиная с table_offset."""
+    with open(path, 'rb') as f:
+        f.seek(table_offset)
+        raw = f.read(count * 4)
+    return [int.from_bytes(raw[i:i + 4], 'big') & mask for i in range(0, len(raw) - 3, 4)]
+
+
+def scan_jobs(path, extract_dir=None, chunk_size=CHUNK_SIZE, pointers=None, workers=1):
+    """Готовит задания пула: куски образа или порции указателей."""
+    if pointers is not None:
+        step = max(1, len(pointers) // max(1, workers * 4))
+        return _pointer_chunk, [(path, pointers[i:i + step], extract_dir)
+                                for i in range(0, len(pointers), step)]
+    size = os.path.getsize(path)
+    return _scan_chunk, [(path, start, min(start + chunk_size, size), extract_dir)
+                         for start in range(0, size, chunk_size)]
+
+
+def merge_records(results):
+    """Собирает записи из результатов заданий, убирает дубли, сортирует по смещению."""
+    seen = {}
+    for _, records in results:
+        for record in records:
+            seen.setdefault(record['graphic_offset'], record)
+    return [seen[k] for k in sorted(seen)]
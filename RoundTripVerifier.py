@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Проверка круга PNG -> SF1PortraitCompressor -> RLEDecompressor -> сравнение пикселей.
+
+Сравнение идёт с точностью Genesis: исходная и распакованная картинки
+проходят одно и то же квантование (quantize_image) и сравниваются по
+ключам пикселей. Так ловятся ошибки и битового потока, и палитры, а
+округление 3 бит -> 8 бит различием не считается; прозрачный пиксель
+равен только прозрачному.
+
+Задания раздаёт пул процессов PortraitBatch (команда verify):
+
+    python PortraitBatch.py verify png/ --effort lazy
+    python PortraitBatch.py verify --corpus lineart:200 noisy:50 --save-failures bad/
+"""
+import os
+import statistics
+from collections import namedtuple
+
+from PIL import Image
+
+from SF1PortraitCompressor import SF1PortraitCompressor, quantize_image
+from RLEDecompressor import decode_my_compressor
+
+# Кодер на процесс пула и уровень сжатия
+_encoders = {}
+# Задание пула: label — путь к PNG или метка сгенерированной картинки,
+# raw — её байты RGBA (None для файла), save_dir — куда сохранять расхождения
+VerifyJob = namedtuple('VerifyJob', 'label effort raw save_dir')
+
+
+def first_mismatch(source, decoded, width=64):
+    """
+    Сравнивает две картинки RGBA после квантования до Genesis.
+    Возвращает None или dict: x, y первого различия, expected / got — RGBA
+    пикселей в этой точке, count — всего различных пикселей.
+    """
+    _, expected = quantize_image(source)
+    _, got = quantize_image(decoded)
+    diff = [i for i, (a, b) in enumerate(zip(expected, got)) if a != b]
+    if not diff:
+        return None
+    x, y = diff[0] % width, diff[0] // width
+    return {
+        'x': x,
+        'y': y,
+        'expected': source.getpixel((x, y)),
+        'got': decoded.getpixel((x, y)),
+        'count': len(diff),
+    }
+
+
+def verify_image(image, effort='fast', encoder=None):
+    """
+    Один круг для картинки 64x64.
+    Возвращает: (bytes .bin, dict mismatch или None).
+    """
+    encoder = encoder or SF1PortraitCompressor(effort=effort)
+    source = encoder.load_image(image)
+    data = encoder.encode(source)
+    _, _, img = decode_my_compressor(data)
+    return data, first_mismatch(source, img.convert('RGBA'))
+
+
+def _load(job):
+    # Файл PNG либо сгенерированная картинка (raw — байты RGBA)
+    label, raw = job.label, job.raw
+    if raw is not None:
+        return Image.frombytes('RGBA', (64, 64), raw), len(raw)
+    with Image.open(label) as img:
+        return img.convert('RGBA'), os.path.getsize(label)
+
+
+def verify_job(job):
+    """Задание пула: -> (байт на входе, размер .bin, bpp, mismatch или None)."""
+    label, effort, _, save_dir = job
+    if effort not in _encoders:
+        _encoders[effort] = SF1PortraitCompressor(effort=effort)
+    encoder = _encoders[effort]
+    img, size_in = _load(job)
+    data, mismatch = verify_image(img, effort, encoder)
+    if mismatch and save_dir:
+        # Исходник и сжатый файл — чтобы повторить руками
+        stem = os.path.splitext(os.path.basename(label))[0].replace(':', '_').replace('#', '_')
+        img.save(os.path.join(save_dir, stem + '.png'))
+        with open(os.path.join(save_dir, stem + '.bin'), 'wb') as f:
+            f.write(data)
+    return size_in, len(data), encoder.stats['bpp'], mismatch
+
+
+def size_stats(values):
+    """Распределение: min, median, mean, p90, max (пустой список — None)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {
+        'min': ordered[0],
+        'median': statistics.median(ordered),
+        'mean': round(statistics.fmean(ordered), 3),
+        'p90': ordered[min(len(ordered) - 1, (len(ordered) * 9) // 10)],
+        'max': ordered[-1],
+    }
+
+
+def format_mismatch(label, mismatch):
+    return (f"MISMATCH {label}: first at ({mismatch['x']}, {mismatch['y']}) "
+            f"expected {mismatch['expected']} got {mismatch['got']}, {mismatch['count']} pixels differ")
+
+
+def format_stats(name, stats, digits=0):
+    if stats is None:
+        return f"{name}: n/a"
+    return f"{name}: " + ", ".join(f"{k} {v:.{digits}f}" for k, v in stats.items())
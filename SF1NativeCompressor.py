@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Кодер в оригинальный поток SF1 — тот, что читает SF1PortraitDecompressor.
+
+Поток: ширина/8, высота/8, затем команды
+    код пропуска (pos += значение), пиксель 4 бита, флаг цепочки,
+    цепочка копирования вниз: 1b / 01 / 0011 / 0010, конец — 000.
+Горизонтальных серий в формате нет, зато цепочка ставит пиксель строкой
+ниже со сдвигом 0, ±1 (2 бита) или ±2 (4 бита), так что вертикальные и
+наклонные штрихи стоят 2 бита на пиксель против 7+ бит за отдельную команду.
+
+Кодер жадный: идёт по позициям по порядку, ставит пиксель там, где
+декодер ещё не даёт нужный цвет, и тянет от него цепочку вниз, пока
+есть непокрытые пиксели того же цвета. Прозрачные пиксели (0) просто
+пропускаются: декодер оставляет их 0xFF.
+"""
+from SF1PortraitCompressor import SF1PortraitCompressor
+from PortraitCodes import MAX_RUN, RUN_CODES, run_code, CHAIN_CODES, CHAIN_END
+from StageTimer import timed
+from PortraitIR import PortraitIR
+
+# Порядок перебора сдвигов цепочки: сначала дешёвые (2 бита), потом ±2
+CHAIN_ORDER = (0, -1, 1, -2, 2)
+# Незаписанный пиксель декодера
+UNSET = 0xFF
+
+
+class SF1NativeCompressor(SF1PortraitCompressor):
+    """
+    Тот же интерфейс, что у SF1PortraitCompressor (encode, encode_indices,
+    compress, compress_many), но графика пишется в оригинальном формате SF1.
+    Палитра — те же 32 байта слов Genesis 0000BBB0GGG0RRR0.
+    """
+    def __init__(self, png_path=None, image=None, width=64, height=64):
+        super().__init__(png_path=png_path, image=image)
+        self.width = width
+        self.height = height
+        self.size = width * height
+
+    def put_run(self, value):
+        code, bits = RUN_CODES[value] if value <= MAX_RUN else run_code(value)
+        self.put_bits(code, bits)
+
+    def _passable(self, target, decoded, p, pixel):
+        # Шаг-мост: запись pixel сюда ничего не портит — пиксель того же цвета
+        # либо непрозрачный пиксель, которому всё равно нужна своя команда
+        want = target[p]
+        return want == pixel or (want and decoded[p] != want)
+
+    def chain_from(self, target, decoded, start, pixel):
+        """
+        Жадно строит цепочку вниз от start: на каждом шаге — первый сдвиг из
+        CHAIN_ORDER, попадающий на пиксель цвета pixel, который декодер ещё не закрыл.
+        Если такого нет, цепочка может пройти одним шагом-мостом по пикселю,
+        который запись не портит, если сразу за ним есть непокрытый пиксель.
+        Отмечает покрытые пиксели в decoded, возвращает список сдвигов.
+        """
+        width = self.width
+        size = self.size
+        dxs = []
+        pos2 = start
+        while True:
+            base = pos2 + width
+            step = None
+            for dx in CHAIN_ORDER:
+                p = base + dx
+                if p < size and target[p] == pixel and decoded[p] != pixel:
+                    step = (dx,)
+                    break
+            else:
+                for dx in CHAIN_ORDER:
+                    p = base + dx
+                    if p + width - 2 >= size or not self._passable(target, decoded, p, pixel):
+                        continue
+                    for dx2 in CHAIN_ORDER:
+                        q = p + width + dx2
+                        if q < size and target[q] == pixel and decoded[q] != pixel:
+                            step = (dx, dx2)
+                            break
+                    if step:
+                        break
+            if step is None:
+                return dxs
+            for dx in step:
+                pos2 += width + dx
+                decoded[pos2] = pixel
+                dxs.append(dx)
+
+    def plan(self, indexed):
+        """
+        Жадный разбор кадра в PortraitIR: команды по возрастанию позиции,
+        у каждой — один пиксель (run 1) и цепочка копирования вниз.
+        """
+        if len(indexed) != self.size:
+            raise ValueError(f"Expected {self.size} palette indices, got {len(indexed)}")
+        ir = PortraitIR(self.width, self.height)
+        # 0xFF (незаписанный пиксель декодера) и 0 — одинаково прозрачные
+        target = bytes(indexed).replace(bytes([UNSET]), b'\0')
+        decoded = bytearray([UNSET]) * self.size
+        for pos in range(self.size):
+            pixel = target[pos]
+            if decoded[pos] == pixel or (pixel == 0 and decoded[pos] == UNSET):
+                continue
+            decoded[pos] = pixel
+            ir.append(pos, pixel, 1, self.chain_from(target, decoded, pos, pixel) if pixel else ())
+        return ir
+
+    def write_ir(self, ir):
+        """
+        Графика из PortraitIR: ширина/8, высота/8 и битовый поток (bytes).
+        Команды — по возрастанию позиции, без серий (формат их не знает).
+        """
+        self.reset()
+        self.output.append(ir.width // 8)
+        self.output.append(ir.height // 8)
+        size = ir.width * ir.height
+        prev = -1
+        for pos, pixel, run, chain in ir:
+            if pos <= prev or run != 1:
+                raise ValueError(f"SF1 stream needs single pixels in increasing order (position {pos}, run {run})")
+            self.put_run(pos - prev)
+            prev = pos
+            self.put_bits(pixel, 4)
+            if chain:
+                self.put_bit(1)
+                for dx in chain:
+                    self.put_bits(*CHAIN_CODES[dx])
+                self.put_bits(*CHAIN_END)
+            else:
+                self.put_bit(0)
+        # Последний пропуск уводит pos за конец кадра — декодер останавливается
+        self.put_run(size - prev)
+        self.flush_bits()
+        return bytes(self.output)
+
+    def encode_graphics(self, indexed):
+        """Только графика: ширина/8, высота/8 и битовый поток (bytes)."""
+        return self.write_ir(self.plan(indexed))
+
+    @timed('encode')
+    def encode_indices(self, indexed, palette_data):
+        """
+        Сжимает буфер индексов (width*height, 0..15 или 0xFF) с 32 байтами палитры.
+        Возвращает: bytes файла .bin (blink, talk, палитра, графика с 08 08 в начале).
+        """
+        if len(palette_data) != 32:
+            raise ValueError(f"Expected 32 bytes of palette data, got {len(palette_data)}")
+        graphics = self.encode_graphics(indexed)
+        return b"\x00\x00" + b"\x00\x00" + bytes(palette_data) + graphics
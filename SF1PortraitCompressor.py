@@ -1,11 +1,60 @@
 # -*- coding: utf-8 -*-
 import io
 from PIL import Image
+from PortraitCodes import MAX_RUN, RUN_CODES, run_code
+from StageTimer import timed
+from PortraitIR import PortraitIR
+
+# Аккумулятор сбрасывается в output, когда набралось столько бит (кратно 16)
+FLUSH_BITS = 64
+# Таблицы для Image.point: канал -> 3 бита Genesis, альфа -> 0/1 (0 — прозрачный)
+_OPAQUE = [0] + [1] * 255
+_MASK = [0] + [255] * 255
+_QUANTIZE = [c >> 5 for c in range(256)] * 3 + list(range(256))
+
+# Уровни сжатия: жадный (исходный) и отложенное копирование. Больше искать нечего:
+# разбиение серии на две никогда не короче, а копию перезаписывает следующая команда
+EFFORTS = ('fast', 'lazy')
+# blink (00 00) + talk (00 00) + палитра 32 байта + magic (08 08)
+HEADER_SIZE = 2 + 2 + 32 + 2
+
+
+def run_lengths(indexed):
+    """Длина серии одинаковых пикселей, начинающейся в каждой позиции."""
+    size = len(indexed)
+    runs = [1] * size
+    for pos in range(size - 2, -1, -1):
+        if indexed[pos] == indexed[pos + 1]:
+            runs[pos] = runs[pos + 1] + 1
+    return runs
+
+
+def command_bits(pixel, copy, repeat):
+    """Цена команды в битах: пиксель 4, префикс 1 или 6 (с копированием), плюс '0' и код длины."""
+    return 4 + (6 if copy else 1) + (RUN_CODES[repeat][1] if repeat <= MAX_RUN else run_code(repeat)[1])
+
+
+def quantize_image(img):
+    """
+    RGBA -> (raw, keys): raw — байты RGBA, где прозрачные пиксели обнулены,
+    а альфа непрозрачных равна 1; keys — список 32-битных ключей пикселей
+    после квантования каналов до 3 бит Genesis (0 — прозрачный пиксель).
+    """
+    r, g, b, a = img.split()
+    opaque = Image.merge('RGBA', (r, g, b, a.point(_OPAQUE)))
+    opaque = Image.composite(opaque, Image.new('RGBA', img.size, 0), a.point(_MASK))
+    raw = opaque.tobytes()
+    return raw, memoryview(opaque.point(_QUANTIZE).tobytes()).cast('I').tolist()
+
 
 class SF1PortraitCompressor:
-    def __init__(self, png_path=None, image=None):
+    def __init__(self, png_path=None, image=None, effort='fast'):
         self.png_path = png_path
         self.image = image
+        if effort not in EFFORTS:
+            raise ValueError(f"Unknown effort {effort!r}, expected one of {EFFORTS}")
+        self.effort = effort
+        self.stats = None
         self.barrel = 0
         self.length = 0
         self.output = bytearray()
@@ -13,209 +62,266 @@ class SF1PortraitCompressor:
         self.pos2 = 0
         self.last = 0
         self.width = 64
+        self.height = 64
         self.size = 64 * 64
         self.value_map = {0: 0, 1: 2, 2: 4, 3: 6, 4: 8, 5: 10, 6: 12, 7: 14}  # SF2PaletteManager VALUE_ARRAY
 
     def put_bit(self, bit):
         self.barrel = (self.barrel << 1) | (1 if bit else 0)
         self.length += 1
-        if self.length == 16:
-            self.output.extend(self.barrel.to_bytes(2, 'big'))
-            self.length = 0
-            self.barrel = 0
+        if self.length >= FLUSH_BITS:
+            self.flush_words()
 
     def put_bits(self, value, bits):
         if value < 0 or value >= (1 << bits):
             raise ValueError(f"Value {value} is out of range for {bits} bits")
-        for i in range(bits - 1, -1, -1):
-            self.put_bit((value >> i) & 1)
+        # Поле целиком вдвигается в аккумулятор, готовые слова сбрасываются пачкой
+        self.barrel = (self.barrel << bits) | value
+        self.length += bits
+        if self.length >= FLUSH_BITS:
+            self.flush_words()
+
+    def flush_words(self):
+        words = self.length >> 4
+        if words:
+            keep = self.length & 15
+            self.output += (self.barrel >> keep).to_bytes(words * 2, 'big')
+            self.barrel &= (1 << keep) - 1
+            self.length = keep
 
     def put_pixel(self, pixel):
         self.put_bits(pixel, 4)
         self.last = pixel
 
-    def repeat_last(self, repeat):
-        t = 2
-        t2 = 2
-        t3 = 0
-        while repeat >= t * 2 - 2:
-            t += t2
-            t2 *= 2
-            t3 += 1
-        for _ in range(t3):
-            self.put_bit(0)
-        self.put_bit(1)
-        repeat -= (t - 2)
-        t2 = 1 << t3
-        for i in range(t3 + 1):
-            self.put_bit(1 if (t2 & repeat) else 0)
-            t2 >>= 1
+    def repeat_last(self, repeat, lead_zero=False):
+        """Код длины серии из таблицы RUN_CODES; lead_zero — дописать перед ним бит 0."""
+        code, bits = RUN_CODES[repeat] if repeat <= MAX_RUN else run_code(repeat)
+        self.put_bits(code, bits + 1 if lead_zero else bits)
 
     def copy_down_left(self, offset):
         if offset == 1:
-            self.put_bit(0)
-            self.put_bit(1)
+            self.put_bits(0b01, 2)
         elif offset == 2:
-            self.put_bit(0)
-            self.put_bit(0)
-            self.put_bit(1)
-            self.put_bit(0)
+            self.put_bits(0b0010, 4)
         self.pos2 += self.width
         self.pos2 -= offset
 
-    def search(self, found):
-        if self.pos2 + self.width - 1 < self.size:
-            if self.indexed_pixels[self.pos2 + self.width - 1] == self.last and \
-               (self.pos2 + self.width - 2 >= self.size or self.indexed_pixels[self.pos2 + self.width - 2] != self.last):
-                if not found:
-                    self.put_bit(1)
-                self.copy_down_left(1)
-                return True
-        return False
-
     def flush_bits(self):
+        self.flush_words()
         if self.length > 0:
-            if self.length > 16:
-                self.length = 0
-                self.barrel = 0
             self.barrel <<= (16 - self.length)
             self.output.extend(self.barrel.to_bytes(2, 'big'))
             self.length = 0
             self.barrel = 0
 
+    @timed('quantize')
+    def index_pixels(self, img):
+        """
+        Переводит RGBA 64x64 в индексы палитры за несколько проходов PIL без цикла по пикселям.
+        Цвет пикселя — 32-битный ключ (R, G, B, 1) после квантования каналов до 3 бит,
+        у прозрачных пикселей ключ 0. Палитра — в порядке первого появления ключа,
+        цвет записи — исходный RGB первого такого пикселя.
+        Заполняет self.indexed_pixels, возвращает палитру из 16 цветов.
+        """
+        raw, keys = quantize_image(img)
+
+        colors = set(memoryview(raw).cast('I'))
+        colors.discard(0)
+        if len(colors) > 15:
+            raise ValueError("Ошибка: Максимум 16 цветов в палитре (включая прозрачный)")
+
+        # Palette conversion (based on SF2PaletteManager PaletteEncoder.java)
+        palette = [(0, 0, 0, 0)]  # Первый цвет — прозрачный
+        lut = {0: 0}
+        for key in dict.fromkeys(keys):
+            if key and len(palette) < 16:
+                i = keys.index(key) * 4
+                palette.append((raw[i], raw[i + 1], raw[i + 2], 255))  # Сохраняем оригинальные RGB
+                lut[key] = len(palette) - 1
+        while len(palette) < 16:
+            palette.append((0, 0, 0, 0))
+
+        self.indexed_pixels = bytearray(map(lut.__getitem__, keys))
+        return palette
+
+    def reset(self):
+        """Сбрасывает состояние кодера: один экземпляр можно использовать много раз."""
+        self.barrel = 0
+        self.length = 0
+        self.output = bytearray()
+        self.pos = 0
+        self.pos2 = 0
+        self.last = 0
+
+    def load_image(self, image=None):
+        """RGBA 64x64 из image, self.image или self.png_path."""
+        if image is None:
+            image = self.image
+        if image is None:
+            if self.png_path is None:
+                raise ValueError("Either png_path or image must be provided")
+            image = Image.open(self.png_path)
+        img = image.convert('RGBA')
+        width, height = img.size
+        if width != 64 or height != 64:
+            raise ValueError("Ошибка: Размер изображения должен быть ровно 64x64 пикселей")
+        return img
+
+    def encode_palette(self, palette):
+        # Формируем данные палитры (SF2 format: first byte = B, second byte = (G << 4) | R)
+        palette_data = bytearray()
+        for i, (r, g, b, _) in enumerate(palette):
+            r_3bit = self.value_map.get((r >> 5) & 0x07, 0)
+            g_3bit = self.value_map.get((g >> 5) & 0x07, 0)
+            b_3bit = self.value_map.get((b >> 5) & 0x07, 0)
+            first = b_3bit & 0x0F
+            second = ((g_3bit << 4) & 0xF0) | (r_3bit & 0x0F)
+            palette_data.extend([first, second])
+        return palette_data
+
+    def encode(self, image=None):
+        """
+        Сжимает картинку (по умолчанию — заданную в конструкторе).
+        Возвращает: bytes файла .bin целиком (blink, talk, палитра, magic, графика).
+        """
+        img = self.load_image(image)
+        palette = self.index_pixels(img)
+        return self.encode_indices(self.indexed_pixels, self.encode_palette(palette))
+
+    @timed('encode')
+    def encode_indices(self, indexed, palette_data):
+        """
+        Сжимает готовый буфер индексов (64*64 значений 0..15) с 32 байтами палитры.
+        Возвращает: bytes файла .bin целиком.
+        """
+        if len(indexed) != self.size:
+            raise ValueError(f"Expected {self.size} palette indices, got {len(indexed)}")
+        if len(palette_data) != 32:
+            raise ValueError(f"Expected 32 bytes of palette data, got {len(palette_data)}")
+        self.reset()
+        self.indexed_pixels = bytearray(indexed)
+
+        # Build .bin structure
+        self.output.extend(b"\x00\x00")  # BLINK block (empty)
+        self.output.extend(b"\x00\x00")  # TALK block (empty)
+        self.output.extend(palette_data)  # Palette (32 bytes)
+        self.output.extend(b"\x08\x08")  # Magic bytes
+
+        # Compress graphics с исправлением прозрачности
+        self.put_bits(0b11, 2)
+        commands = self.parse(self.indexed_pixels)
+        self.emit(self.to_ir(commands))
+        self.flush_bits()
+        bits = 2 + sum(command_bits(*command) for command in commands)
+        self.stats = {
+            'effort': self.effort,
+            'commands': len(commands),
+            'bytes': len(self.output),
+            'bits': bits,
+            'bpp': bits / self.size,
+        }
+        return bytes(self.output)
+
+    def measure_indices(self, indexed):
+        """
+        Размер файла .bin в байтах без записи потока: только разбор и цены команд.
+        Совпадает с len(encode_indices(indexed, ...)) для того же effort.
+        """
+        if len(indexed) != self.size:
+            raise ValueError(f"Expected {self.size} palette indices, got {len(indexed)}")
+        bits = 2 + sum(command_bits(*command) for command in self.parse(indexed))
+        return HEADER_SIZE + (bits + 15) // 16 * 2
+
+    def parse(self, indexed):
+        """Разбор кадра на команды (пиксель, копирование, длина серии) по self.effort."""
+        if self.effort == 'fast':
+            return self.parse_fast(indexed)
+        if self.effort == 'lazy':
+            return self.parse_lazy(indexed)
+        raise ValueError(f"Unknown effort {self.effort!r}, expected one of {EFFORTS}")
+
+    def parse_fast(self, indexed):
+        """
+        Жадный разбор (исходный алгоритм): серия до первого отличающегося пикселя,
+        копирование вниз-влево на 1 — как только строкой ниже левее стоит тот же
+        пиксель, а слева от него — другой.
+        """
+        width = self.width
+        runs = run_lengths(indexed)
+        commands = []
+        pos = 0
+        while pos < self.size:
+            pixel = indexed[pos]
+            copy = 0
+            # Прозрачные пиксели копий не ищут
+            if pixel and pos + width - 1 < self.size and indexed[pos + width - 1] == pixel and \
+               (pos + width - 2 >= self.size or indexed[pos + width - 2] != pixel):
+                copy = 1
+            commands.append((pixel, copy, runs[pos]))
+            pos += runs[pos]
+        return commands
+
+    def parse_lazy(self, indexed):
+        """
+        Жадный разбор, но решение о копировании откладывается до конца разбора:
+        копия остаётся, только если её пиксель не перезапишет следующая команда.
+        """
+        commands = self.parse_fast(indexed)
+        covered = 0
+        for i, (pixel, copy, repeat) in enumerate(commands):
+            covered += repeat
+            # Команды идут подряд и закрывают все позиции до конца кадра,
+            # так что цель копии (pos + width - 1) выживает, только если кадр кончился раньше
+            if copy and covered - repeat + self.width - 1 < self.size:
+                commands[i] = (pixel, 0, repeat)
+        return commands
+
+    def to_ir(self, commands):
+        """Команды разбора (пиксель, копирование, длина серии) -> PortraitIR."""
+        ir = PortraitIR(self.width, self.height)
+        pos = 0
+        for pixel, copy, repeat in commands:
+            ir.append(pos, pixel, repeat, (-copy,) if copy else ())
+            pos += repeat
+        return ir
+
+    def emit(self, ir):
+        """
+        Пишет PortraitIR в битовый поток: пиксель, префикс копирования, '0' + код длины.
+        Команды должны идти подряд с позиции 0; из цепочек формат знает только
+        одну копию вниз-влево на 1 или 2.
+        """
+        for pos, pixel, repeat, chain in ir:
+            if pos != self.pos:
+                raise ValueError(f"RLE commands must be contiguous: expected position {self.pos}, got {pos}")
+            self.put_pixel(pixel)
+            if chain == (-1,):
+                # '1' + copy_down_left(1) + '00', дальше как у обычной серии
+                self.put_bits(0b10100, 5)
+                self.pos2 += self.width - 1
+            elif chain == (-2,):
+                # '1' + copy_down_left(2) + '0000'
+                self.put_bits(0b1000000, 7)
+                self.pos2 += self.width - 2
+            elif chain:
+                raise ValueError(f"RLE stream cannot encode copy chain {chain}")
+            self.repeat_last(repeat, lead_zero=True)
+            self.pos += repeat
+            self.pos2 = self.pos
+
+    def compress_many(self, images):
+        """Генератор: bytes для каждой картинки, один экземпляр и общие таблицы на всю пачку."""
+        for image in images:
+            yield self.encode(image)
+
+    @timed('compress')
     def compress(self, output_path):
         try:
-            if self.image is None:
-                if self.png_path is None:
-                    raise ValueError("Either png_path or image must be provided")
-                img = Image.open(self.png_path).convert('RGBA')
-            else:
-                img = self.image.convert('RGBA')
-            width, height = img.size
-            if width != 64 or height != 64:
-                raise ValueError("Ошибка: Размер изображения должен быть ровно 64x64 пикселей")
-            pixels = list(img.getdata())
-            colors = set(pixel[:3] for pixel in pixels if pixel[3] != 0)
-            if len(colors) > 15:
-                raise ValueError("Ошибка: Максимум 16 цветов в палитре (включая прозрачный)")
-
-            # Palette conversion (based on SF2PaletteManager PaletteEncoder.java)
-            palette = [(0, 0, 0, 0)]  # Первый цвет — прозрачный
-            color_map = {palette[0]: 0}
-            for r, g, b, a in pixels:
-                if a == 0:
-                    continue
-                # Конверсия в 3-3-2 (R,G: 0-7, B: 0-7 mapped to VALUE_ARRAY)
-                r_3bit = self.value_map.get((r >> 5) & 0x07, 0)
-                g_3bit = self.value_map.get((g >> 5) & 0x07, 0)
-                b_3bit = self.value_map.get((b >> 5) & 0x07, 0)  # Используем 3 бита для B
-                color_key = (r_3bit, g_3bit, b_3bit, 255)
-                if color_key not in color_map and len(palette) < 16:
-                    palette.append((r, g, b, 255))  # Сохраняем оригинальные RGB
-                    color_map[color_key] = len(palette) - 1
-            while len(palette) < 16:
-                palette.append((0, 0, 0, 0))
-
-            # Формируем данные палитры (SF2 format: first byte = B, second byte = (G << 4) | R)
-            palette_data = bytearray()
-            for i, (r, g, b, _) in enumerate(palette):
-                r_3bit = self.value_map.get((r >> 5) & 0x07, 0)
-                g_3bit = self.value_map.get((g >> 5) & 0x07, 0)
-                b_3bit = self.value_map.get((b >> 5) & 0x07, 0)
-                first = b_3bit & 0x0F
-                second = ((g_3bit << 4) & 0xF0) | (r_3bit & 0x0F)
-                palette_data.extend([first, second])
-
-            # Map pixels to palette indices
-            self.indexed_pixels = bytearray()
-            for r, g, b, a in pixels:
-                if a == 0:
-                    self.indexed_pixels.append(0)  # Прозрачные пиксели всегда индекс 0
-                else:
-                    r_3bit = self.value_map.get((r >> 5) & 0x07, 0)
-                    g_3bit = self.value_map.get((g >> 5) & 0x07, 0)
-                    b_3bit = self.value_map.get((b >> 5) & 0x07, 0)
-                    color_key = (r_3bit, g_3bit, b_3bit, 255)
-                    self.indexed_pixels.append(color_map.get(color_key, 0))
-
-            # Build .bin structure
-            self.output = bytearray()
-            self.output.extend(b"\x00\x00")  # BLINK block (empty)
-            self.output.extend(b"\x00\x00")  # TALK block (empty)
-            self.output.extend(palette_data)  # Palette (32 bytes)
-            self.output.extend(b"\x08\x08")  # Magic bytes
-
-            # Compress graphics с исправлением прозрачности
-            self.put_bit(1)
-            self.put_bit(1)
-            iteration_count = 0
-            max_iterations = self.size * 2
-            while self.pos < self.size:
-                iteration_count += 1
-                if iteration_count > max_iterations:
-                    raise RuntimeError(f"Infinite loop detected at pos {self.pos}, iteration {iteration_count}")
-                
-                current_pixel = self.indexed_pixels[self.pos]
-                
-                # Если пиксель прозрачный (0), кодируем его отдельно и не ищем копии
-                if current_pixel == 0:
-                    self.put_pixel(0)
-                    self.last = 0
-                    self.pos += 1
-                    self.pos2 = self.pos
-                    # Проверяем, есть ли ещё прозрачные пиксели для повторения
-                    if self.pos < self.size and self.indexed_pixels[self.pos] == 0:
-                        self.pos2 = self.pos
-                        repeat = 1
-                        while self.pos2 < self.size and self.indexed_pixels[self.pos2] == 0:
-                            self.pos2 += 1
-                            repeat += 1
-                        self.pos = self.pos2
-                        self.put_bit(0)
-                        self.repeat_last(repeat)
-                    else:
-                        self.put_bit(0)
-                        self.put_bit(1)
-                        self.put_bit(1)
-                    continue
-
-                # Для непрозрачных пикселей — оригинальная логика
-                self.put_pixel(current_pixel)
-                self.last = current_pixel
-                self.pos2 = self.pos
-                found = 0
-                t = False
-                while found == 0:
-                    t = self.search(found)
-                    if t:
-                        found = 1
-                    else:
-                        break
-                if found:
-                    self.put_bit(0)
-                    self.put_bit(0)
-
-                if self.pos + 1 < self.size and self.indexed_pixels[self.pos + 1] == self.last:
-                    self.pos2 = self.pos + 1
-                    repeat = 1
-                    while self.pos2 < self.size and self.indexed_pixels[self.pos2] == self.last:
-                        self.pos2 += 1
-                        repeat += 1
-                    self.pos = self.pos2
-                    self.put_bit(0)
-                    self.repeat_last(repeat)
-                else:
-                    self.put_bit(0)
-                    self.put_bit(1)
-                    self.put_bit(1)
-                    self.pos += 1
-                    self.pos2 = self.pos
-
-            self.flush_bits()
+            data = self.encode()
 
             # Save
             with open(output_path, "wb") as f:
-                f.write(self.output)
+                f.write(data)
 
         except Exception as e:
             print(f"Compression error: {str(e)}")
@@ -1,5 +1,10 @@
 # -*- coding: utf-8 -*-
-import io
+import mmap
+from PortraitCodes import RUN_WINDOW, RUN_TABLE, CHAIN_WINDOW, CHAIN_TABLE
+from StageTimer import timed, stage
+from PortraitIR import PortraitIR
+from PortraitDecodeError import (PortraitDecodeError, bit_budget, command_budget,
+                                 STREAM_ENDED, BITS_EXCEEDED, COMMANDS_EXCEEDED)
 
 class SF1PortraitDecompressor:
     """
@@ -8,10 +13,31 @@ class SF1PortraitDecompressor:
     Небольшое изменение: get_data принимает опциональный параметр offset.
     Если offset передан (целое число), файл будет смещён на него перед чтением
     ширины/высоты, чтобы поведение совпадало с PixelDecompressor.get_data(offset).
+
+    Источник данных — bytes/bytearray/memoryview/mmap (читается напрямую, без
+    копирования и без побайтовых read()) либо файловый объект вроде io.BytesIO,
+    как раньше. offset в конструкторе задаёт начало потока по умолчанию.
+
+    Поток читается не дальше бюджета бит и команд (PortraitDecodeError.py);
+    если кадр не дописан, причина — в self.error, а strict=True её поднимает.
     """
-    def __init__(self, f: io.BytesIO):
-        self.file = f
-        self.barrel = 0
+    def __init__(self, f, offset: int = None):
+        if isinstance(f, (bytes, bytearray, memoryview, mmap.mmap)):
+            self.file = None
+            self.buf = f
+            self.start = offset if offset is not None else 0
+        else:
+            # Файловый объект: берём содержимое целиком, поток начинается с текущей позиции
+            self.file = f
+            self.start = offset if offset is not None else f.tell()
+            if hasattr(f, 'getvalue'):
+                self.buf = f.getvalue()
+            else:
+                f.seek(0)
+                self.buf = f.read()
+        self.end = len(self.buf)
+        self.p = self.start  # позиция следующего 16-битного слова в буфере
+        self.barrel = 0      # текущее слово, значимы младшие self.length бит
         self.length = 0
         self.pos = -1
         self.pos2 = 0
@@ -21,37 +47,55 @@ class SF1PortraitDecompressor:
         self.height = 0
         self.size = 0
         self.last = 0
+        self.commands = 0
+        self.max_commands = 0
+        self.clamped = False
+        self.error = None
+
+    @property
+    def stream_length(self):
+        """Длина потока в байтах (включая ширину/высоту): прочитанные биты целыми словами."""
+        return (self.bits_consumed + 15) // 16 * 2
+
+    @property
+    def bits_consumed(self):
+        """Сколько бит потока (включая ширину/высоту) прочитано от начала."""
+        return (self.p - self.start) * 8 - self.length
+
+    def _refill(self):
+        # Неполное слово в конце буфера не читается — как и в исходной версии
+        p = self.p
+        if p + 2 > self.end:
+            return False
+        buf = self.buf
+        self.barrel = (buf[p] << 8) | buf[p + 1]
+        self.p = p + 2
+        self.length = 16
+        return True
 
     def get_bit(self):
-        if self.length == 0:
-            hi = self.file.read(1)
-            if not hi:
-                return False
-            lo = self.file.read(1)
-            if not lo:
-                return False
-            self.barrel = (hi[0] << 8) | lo[0]
-            self.length = 16
-        bit = (self.barrel & 0x8000) != 0
-        self.barrel = (self.barrel << 1) & 0xFFFF
+        if self.length == 0 and not self._refill():
+            return False
         self.length -= 1
-        return bit
+        return (self.barrel >> self.length) & 1 == 1
 
     def get_bits(self, n):
-        c = 0
-        for _ in range(n):
-            if self.length == 0:
-                hi = self.file.read(1)
-                if not hi:
-                    return c
-                lo = self.file.read(1)
-                if not lo:
-                    return c
-                self.barrel = (hi[0] << 8) | lo[0]
-                self.length = 16
-            c = (c << 1) | (1 if (self.barrel & 0x8000) else 0)
-            self.barrel = (self.barrel << 1) & 0xFFFF
-            self.length -= 1
+        length = self.length
+        if n <= length:
+            length -= n
+            self.length = length
+            return (self.barrel >> length) & ((1 << n) - 1)
+        # Поле пересекает границу слова
+        c = self.barrel & ((1 << length) - 1)
+        n -= length
+        self.length = 0
+        while n:
+            if not self._refill():
+                return c
+            take = n if n < 16 else 16
+            self.length = 16 - take
+            c = (c << take) | ((self.barrel >> self.length) & ((1 << take) - 1))
+            n -= take
         return c
 
     def copy_down_bit_right(self):
@@ -73,13 +117,247 @@ class SF1PortraitDecompressor:
         if self.pos2 < self.size:
             self.data[self.pos2] = self.last
 
-    def get_data(self, offset: int = None):
+    def _read_head(self):
         """
-        Распаковывает портрет из текущего self.file.
-        Если offset указан (int), сначала делает self.file.seek(offset).
-        Возвращает: (список_hex_нибблов, количество непрозрачных пикселей).
+        Побитово читает код пропуска и двигает self.pos.
+        False — поток закончился посреди унарной части.
+        """
+        # do { ... } while (!bit); — считаем нули целыми словами через bit_length
+        self.count = 0
+        while True:
+            if self.length == 0 and not self._refill():
+                return False
+            bits = self.barrel & ((1 << self.length) - 1)
+            if bits:
+                zeros = self.length - bits.bit_length()
+                self.count += zeros
+                self.length -= zeros + 1
+                break
+            self.count += self.length
+            self.length = 0
+
+        shift = 2 << self.count
+        self.pos += shift - 2
+
+        self.count += 1
+        if self.count:
+            self.pos += self.get_bits(self.count)
+        return True
+
+    def _read_chain(self):
+        """Побитово читает цепочку копирования вниз от self.pos2 до кода 000."""
+        restart = False
+        while not restart:
+            if self.get_bit():
+                self.copy_down_bit_right()
+            elif self.get_bit():
+                self.copy_down_left(1)
+            elif self.get_bit():
+                if self.get_bit():
+                    self.copy_down_right(2)
+                else:
+                    self.copy_down_left(2)
+            else:
+                restart = True
+
+    def _decode_bitwise(self):
+        """Эталонный цикл: каждый бит через get_bit/get_bits (повторяет логику Pixel.h)."""
+        while self.pos < self.size or self.pos == -1 or self.pos == 0xFFFFFFFF:
+            if not self._read_head():
+                # досрочный выход — поток закончился
+                return
+            if self.pos >= self.size:
+                break
+            c = self.get_bits(4) & 0xF
+            flag = self.get_bit()
+            # как у _decode_tables: лишняя команда прочитана, но не записана
+            self.commands += 1
+            if self.commands > self.max_commands:
+                return
+            self.data[self.pos] = c
+            self.last = c
+
+            if flag:
+                self.pos2 = self.pos
+                self._read_chain()
+
+    def _decode_tables(self, stop=None):
+        """
+        Тот же цикл, но код пропуска и цепочки копирования разбираются
+        окнами по RUN_WINDOW/CHAIN_WINDOW бит через таблицы PortraitCodes.
+        Длинные коды и хвост потока дочитываются побитово.
+        stop — остановиться, как только позиция дойдёт до stop (состояние
+        сохраняется в self, повторный вызов продолжает с того же места).
         """
-        # Сброс состояния декодера
+        buf = self.buf
+        end = self.end
+        data = self.data
+        size = self.size
+        stop = size if stop is None else min(stop, size)
+        width = self.width
+        run_table = RUN_TABLE
+        chain_table = CHAIN_TABLE
+        acc, nbits, p = self.barrel, self.length, self.p
+        pos = self.pos
+        c = self.last
+        commands = self.commands
+        max_commands = self.max_commands
+
+        while pos < stop:
+            while nbits < 32 and p + 2 <= end:
+                acc = ((acc & ((1 << nbits) - 1)) << 16) | (buf[p] << 8) | buf[p + 1]
+                p += 2
+                nbits += 16
+            entry = run_table[(acc >> (nbits - RUN_WINDOW)) & 0xFFFF] if nbits >= RUN_WINDOW else 0
+            if entry and (entry & 0x1F) + 5 <= nbits:
+                nbits -= entry & 0x1F
+                pos += entry >> 5
+                if pos >= size:
+                    break
+                nbits -= 5
+                c = (acc >> (nbits + 1)) & 0xF
+                flag = (acc >> nbits) & 1
+            else:
+                # длинный код или конец потока
+                self.barrel, self.length, self.p, self.pos = acc, nbits, p, pos
+                if not self._read_head():
+                    self.last, self.commands = c, commands
+                    return
+                pos = self.pos
+                if pos >= size:
+                    # биты длинного кода уже прочитаны _read_head — состояние из self
+                    acc, nbits, p = self.barrel, self.length, self.p
+                    break
+                c = self.get_bits(4) & 0xF
+                flag = self.get_bit()
+                acc, nbits, p = self.barrel, self.length, self.p
+
+            commands += 1
+            if commands > max_commands:
+                break
+            data[pos] = c
+            if flag:
+                pos2 = pos
+                while True:
+                    while nbits < CHAIN_WINDOW and p + 2 <= end:
+                        acc = ((acc & ((1 << nbits) - 1)) << 16) | (buf[p] << 8) | buf[p + 1]
+                        p += 2
+                        nbits += 16
+                    if nbits < CHAIN_WINDOW:
+                        self.barrel, self.length, self.p = acc, nbits, p
+                        self.pos2, self.last = pos2, c
+                        self._read_chain()
+                        acc, nbits, p = self.barrel, self.length, self.p
+                        break
+                    used, dxs, ended = chain_table[(acc >> (nbits - CHAIN_WINDOW)) & 0xFF]
+                    nbits -= used
+                    for dx in dxs:
+                        pos2 += width + dx
+                        if pos2 < size:
+                            data[pos2] = c
+                    if ended:
+                        break
+
+        self.barrel, self.length, self.p, self.pos = acc, nbits, p, pos
+        self.last, self.commands = c, commands
+
+    def _read_chain_dxs(self):
+        """Побитово читает цепочку до кода 000, возвращает сдвиги (как _read_chain, но без записи)."""
+        dxs = []
+        while True:
+            if self.get_bit():
+                dxs.append(1 if self.get_bit() else 0)
+            elif self.get_bit():
+                dxs.append(-1)
+            elif self.get_bit():
+                dxs.append(2 if self.get_bit() else -2)
+            else:
+                return dxs
+
+    def _parse_tables(self):
+        """
+        Тот же цикл, что _decode_bitwise, но код пропуска и цепочки копирования
+        разбираются окнами по RUN_WINDOW/CHAIN_WINDOW бит через таблицы PortraitCodes,
+        а команды не пишутся в кадр, а собираются в списки для PortraitIR.packed:
+        (позиции, пиксели, начала цепочек, сдвиги цепочек).
+        Длинные коды и хвост потока дочитываются побитово.
+        """
+        buf = self.buf
+        end = self.end
+        size = self.size
+        run_table = RUN_TABLE
+        chain_table = CHAIN_TABLE
+        # Списки, а не array: append/extend у списка заметно дешевле
+        positions, pixels, starts, dxs = [], [], [0], []
+        pos_append = positions.append
+        pixel_append = pixels.append
+        start_append = starts.append
+        dxs_extend = dxs.extend
+        acc, nbits, p = self.barrel, self.length, self.p
+        pos = self.pos
+        c = self.last
+        max_commands = self.max_commands
+
+        while pos < size:
+            while nbits < 32 and p + 2 <= end:
+                acc = ((acc & ((1 << nbits) - 1)) << 16) | (buf[p] << 8) | buf[p + 1]
+                p += 2
+                nbits += 16
+            entry = run_table[(acc >> (nbits - RUN_WINDOW)) & 0xFFFF] if nbits >= RUN_WINDOW else 0
+            if entry and (entry & 0x1F) + 5 <= nbits:
+                nbits -= entry & 0x1F
+                pos += entry >> 5
+                if pos >= size:
+                    break
+                nbits -= 5
+                c = (acc >> (nbits + 1)) & 0xF
+                flag = (acc >> nbits) & 1
+            else:
+                # длинный код или конец потока
+                self.barrel, self.length, self.p, self.pos = acc, nbits, p, pos
+                if not self._read_head():
+                    self.last, self.commands = c, len(positions)
+                    return positions, pixels, starts, dxs
+                pos = self.pos
+                if pos >= size:
+                    # биты длинного кода уже прочитаны _read_head — состояние из self
+                    acc, nbits, p = self.barrel, self.length, self.p
+                    break
+                c = self.get_bits(4) & 0xF
+                flag = self.get_bit()
+                acc, nbits, p = self.barrel, self.length, self.p
+
+            if len(positions) >= max_commands:
+                # одна лишняя — чтобы было видно, что бюджет превышен
+                self.commands = max_commands + 1
+                break
+            pos_append(pos)
+            pixel_append(c)
+            if flag:
+                while True:
+                    while nbits < CHAIN_WINDOW and p + 2 <= end:
+                        acc = ((acc & ((1 << nbits) - 1)) << 16) | (buf[p] << 8) | buf[p + 1]
+                        p += 2
+                        nbits += 16
+                    if nbits < CHAIN_WINDOW:
+                        self.barrel, self.length, self.p = acc, nbits, p
+                        dxs_extend(self._read_chain_dxs())
+                        acc, nbits, p = self.barrel, self.length, self.p
+                        break
+                    used, steps, ended = chain_table[(acc >> (nbits - CHAIN_WINDOW)) & 0xFF]
+                    nbits -= used
+                    dxs_extend(steps)
+                    if ended:
+                        break
+            start_append(len(dxs))
+
+        self.barrel, self.length, self.p, self.pos = acc, nbits, p, pos
+        self.last = c
+        self.commands = max(self.commands, len(positions))
+        return positions, pixels, starts, dxs
+
+    def _start(self, offset):
+        # Сброс состояния и чтение ширины/высоты (первые два байта потока)
         self.length = 0
         self.pos = -1
         self.pos2 = 0
@@ -87,80 +365,130 @@ class SF1PortraitDecompressor:
 
         # Если задан offset — переходим на него
         if offset is not None:
-            # допустимое поведение: если offset не int — будет исключение у caller
-            self.file.seek(offset)
+            self.start = offset
+        self.p = self.start
 
-        # читаем ширину/высоту (первые два байта потока)
-        width_data = self.file.read(1)
-        if not width_data:
-            raise ValueError("Недостаточно данных для чтения ширины")
-        self.width = width_data[0] * 8
+        end = len(self.buf)
+        if self.p >= end:
+            raise PortraitDecodeError("no width byte", 0)
+        self.width = self.buf[self.p] * 8
+        if self.p + 1 >= end:
+            raise PortraitDecodeError("no height byte", 8)
+        self.height = self.buf[self.p + 1] * 8
+        self.p += 2
+        self.size = self.width * self.height
+        if not self.size:
+            raise PortraitDecodeError(f"empty {self.width}x{self.height} frame", 16)
 
-        height_data = self.file.read(1)
-        if not height_data:
-            raise ValueError("Недостаточно данных для чтения высоты")
-        self.height = height_data[0] * 8
+        # Бюджеты: окно чтения обрезается до bit_budget бит, команды считаются в циклах
+        available = (end - self.p) * 8
+        budget = bit_budget(self.size, available)
+        self.end = self.p + budget // 8
+        self.clamped = budget < available
+        self.commands = 0
+        self.max_commands = command_budget(self.size)
+        self.error = None
 
-        self.size = self.width * self.height
-        # Инициализируем буфер прозрачностью 0xFF (как в оригинале)
-        self.data = bytearray([0xFF] * self.size)
+    def _check(self, partial):
+        """
+        Кадр не дописан или бюджет команд исчерпан — PortraitDecodeError
+        с причиной, иначе None.
+        """
+        if self.commands > self.max_commands:
+            reason = COMMANDS_EXCEEDED
+        elif self.pos >= self.size:
+            return None
+        elif self.clamped:
+            reason = BITS_EXCEEDED
+        else:
+            reason = STREAM_ENDED
+        return PortraitDecodeError(reason, self.bits_consumed, partial)
 
-        # Основной цикл декомпрессии (повторяет логику Pixel.h)
-        while self.pos < self.size or self.pos == -1 or self.pos == 0xFFFFFFFF:
-            restart = False
-            self.count = -1
-            shift = 2
-
-            # do { ... } while (!bit);
-            while True:
-                if self.length == 0:
-                    hi = self.file.read(1)
-                    if not hi:
-                        # досрочный выход — возвращаем накопленные данные
-                        return [f"{x:X}" for x in self.data[:self.size]], \
-                               sum(1 for x in self.data if x != 0xFF)
-                    lo = self.file.read(1)
-                    if not lo:
-                        return [f"{x:X}" for x in self.data[:self.size]], \
-                               sum(1 for x in self.data if x != 0xFF)
-                    self.barrel = (hi[0] << 8) | lo[0]
-                    self.length = 16
-                bit = (self.barrel & 0x8000) != 0
-                self.barrel = (self.barrel << 1) & 0xFFFF
-                self.length -= 1
-                self.count += 1
-                if bit:
-                    break
+    def get_ir(self, offset: int = None, strict: bool = False):
+        """
+        Разбирает поток в команды без записи пикселей (см. PortraitIR).
+        offset и strict — как в get_indices (partial ошибки — PortraitIR).
+        Возвращает: PortraitIR (width x height).
+        """
+        self._start(offset)
+        positions, pixels, starts, dxs = self._parse_tables()
+        # Серий в потоке SF1 нет: каждая команда ставит один пиксель
+        ir = PortraitIR.packed(self.width, self.height, positions, pixels, [1] * len(pixels), starts, dxs)
+        self.error = self._check(ir)
+        if strict and self.error:
+            raise self.error
+        return ir
 
-            shift <<= self.count
-            self.pos += shift - 2
+    @timed('decode')
+    def get_indices(self, offset: int = None, tables: bool = True, strict: bool = False):
+        """
+        Распаковывает портрет из буфера.
+        Если offset указан (int), поток читается с этого смещения,
+        иначе — с начала, заданного в конструкторе.
+        tables=False — побитовый эталонный декодер (для сравнения и отладки).
+        Разбор и заливка раздельно — get_ir() и PortraitIR.fill().
+        Возвращает: (bytearray индексов палитры width*height, количество непрозрачных пикселей).
+        Незаписанные пиксели остаются 0xFF (прозрачные).
+        Если кадр не дописан (поток кончился, исчерпан бюджет), возвращается
+        что успело распаковаться, а причина — в self.error; strict=True
+        вместо этого поднимает PortraitDecodeError (partial — этот же кадр).
+        """
+        self._start(offset)
+        # Инициализируем буфер прозрачностью 0xFF (как в оригинале)
+        self.data = bytearray(b'\xFF') * self.size
+        if tables:
+            self._decode_tables()
+        else:
+            self._decode_bitwise()
+        self.error = self._check(self.data)
+        if strict and self.error:
+            raise self.error
 
-            self.count += 1
-            if self.count:
-                self.pos += self.get_bits(self.count)
+        # считаем непрозрачные пиксели одним проходом
+        return self.data, self.size - self.data.count(0xFF)
 
-            if self.pos >= self.size:
-                break
+    def iter_rows(self, offset: int = None, rows: int = 8, strict: bool = False):
+        """
+        Прогрессивная распаковка: отдаёт строки кадра, как только они готовы.
+        Позиция в потоке только растёт, а пиксель и его цепочка копирования
+        пишутся не раньше текущей позиции, поэтому строки целиком выше неё
+        уже не изменятся. Поток распаковывается кусками примерно по rows строк;
+        если позиция перепрыгнула дальше, готовый диапазон получается длиннее.
 
-            c = self.get_bits(4) & 0xF
-            self.data[self.pos] = c
-            self.last = c
+        Отдаёт кортежи (y0, y1, bytes индексов строк y0..y1-1); весь кадр —
+        в self.data. Генератор можно бросить на любой строке (например, когда
+        первые строки не похожи на портрет) — остаток потока не читается.
+        Последняя строка приходит последней: в неё пишет особенность data[-1].
+        strict — как в get_indices: недописанный кадр поднимает PortraitDecodeError
+        вместо последнего диапазона.
+        """
+        self._start(offset)
+        self.data = bytearray(b'\xFF') * self.size
+        width, height = self.width, self.height
+        done = 0
+        while done < height:
+            stop = (done + rows) * width
+            with stage('decode'):
+                self._decode_tables(stop)
+            if self.pos < stop or self.commands > self.max_commands:
+                # кадр дописан, поток кончился (в том числе на бюджете бит) или
+                # команд больше бюджета — записей больше не будет; лишняя команда
+                # могла прийти и за stop, поэтому бюджет команд проверяется всегда
+                ready = height
+            else:
+                ready = min(self.pos // width, height)
+            if ready == height:
+                # последний диапазон: итог тот же, что у get_indices
+                self.error = self._check(self.data)
+                if strict and self.error:
+                    raise self.error
+            yield done, ready, bytes(self.data[done * width:ready * width])
+            done = ready
 
-            if self.get_bit():
-                self.pos2 = self.pos
-                while not restart:
-                    if self.get_bit():
-                        self.copy_down_bit_right()
-                    elif self.get_bit():
-                        self.copy_down_left(1)
-                    elif self.get_bit():
-                        if self.get_bit():
-                            self.copy_down_right(2)
-                        else:
-                            self.copy_down_left(2)
-                    else:
-                        restart = True
-
-        # считаем непрозрачные пиксели
-        non_trans = sum(1 for x in self.data[:self.size] if x != 0xFF)
-        return [f"{x:X}" for x in self.data[:self.size]], non_trans
+    def get_data(self, offset: int = None, tables: bool = True, strict: bool = False):
+        """
+        Совместимый формат: то же, что get_indices, но индексы — строки f"{x:X}".
+        Возвращает: (список_hex_нибблов, количество непрозрачных пикселей).
+        """
+        data, non_trans = self.get_indices(offset, tables, strict)
+        return [f"{x:X}" for x in data], non_trans
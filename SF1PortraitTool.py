@@ -2,16 +2,19 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 from PIL import Image, ImageTk
-import io
 import os
 from datetime import datetime
 from SF1PortraitParser import SF1PortraitParser
-from SF1PortraitDecompressor import SF1PortraitDecompressor
 from SF1PortraitCompressor import SF1PortraitCompressor
 from Lingua import LANGS
-from RLEDecompressor import BitReader, read_palette_from_header, decompress_from_my_compressor
+from RLEDecompressor import BitReader, read_palette_from_header, decode_my_compressor
 from RleParser import RleParser
 from AnimationEditor import AnimationEditor
+from PortraitRenderer import render_indices, decode_sf1_palette, decode_rle_palette
+from PortraitCache import shared_cache
+from StageTimer import timer, stage
+from Transcoder import transcode
+from FormatDetector import decode_any
 
 class PortraitViewerApp:
     def __init__(self, master):
@@ -23,10 +26,13 @@ class PortraitViewerApp:
         self.current_lang = 'ru'
         self.scale = 4  # initial zoom factor
         self.last_image = None
+        # Пиксели last_image сразу после открытия: по ним save_bin видит, что картинку не меняли
+        self.opened_pixels = None
         self.last_log_text = ''
         self.last_file_path = ''
         self.last_parser = None
         self.last_palette = None  # Для хранения палитры PNG
+        self.cache = shared_cache()  # распакованные портреты, общие с пакетным режимом
         self.last_pixels = None   # Для хранения пиксельных данных PNG
 
         # Language selector с флагами
@@ -46,6 +52,8 @@ class PortraitViewerApp:
         self.btn_open.pack(side=tk.LEFT, padx=2)
         self.btn_open_portrait = tk.Button(button_frame, text=LANGS[self.current_lang]['open_portrait'], command=self.open_portrait)
         self.btn_open_portrait.pack(side=tk.LEFT, padx=2, pady=5)
+        self.btn_open_any = tk.Button(button_frame, text=LANGS[self.current_lang]['open_any'], command=self.open_any)
+        self.btn_open_any.pack(side=tk.LEFT, padx=2)
         self.btn_open_png = tk.Button(button_frame, text=LANGS[self.current_lang]['open_png_file'], command=self.open_png)
         self.btn_open_png.pack(side=tk.LEFT, padx=2)
         self.btn_save_png = tk.Button(button_frame, text=LANGS[self.current_lang]['save_png'], command=self.save_image)
@@ -62,6 +70,11 @@ class PortraitViewerApp:
         self.btn_zoom_out.pack(side=tk.LEFT, padx=2)
         self.btn_edit_anim = tk.Button(button_frame, text=LANGS[self.current_lang]['edit_animations'], command=self.edit_animations)
         self.btn_edit_anim.pack(side=tk.LEFT, padx=2)
+        # Замер стадий: таблица времени дописывается в лог после каждой операции
+        self.timing_var = tk.BooleanVar(value=False)
+        self.chk_timing = tk.Checkbutton(button_frame, text=LANGS[self.current_lang]['timing'],
+                                         variable=self.timing_var, command=self.toggle_timing)
+        self.chk_timing.pack(side=tk.LEFT, padx=2)
 
         self.canvas = tk.Canvas(self.frame, width=64*self.scale, height=64*self.scale, bg='white')
         self.canvas.pack(pady=5)
@@ -94,6 +107,7 @@ class PortraitViewerApp:
     def update_button_texts(self):
         self.btn_open.config(text=LANGS[self.current_lang]['open_file'])
         self.btn_open_portrait.config(text=LANGS[self.current_lang]['open_portrait'])
+        self.btn_open_any.config(text=LANGS[self.current_lang]['open_any'])
         self.btn_open_png.config(text=LANGS[self.current_lang]['open_png_file'])
         self.btn_save_png.config(text=LANGS[self.current_lang]['save_png'])
         self.btn_save_log.config(text=LANGS[self.current_lang]['save_log'])
@@ -102,6 +116,19 @@ class PortraitViewerApp:
         self.btn_zoom_in.config(text=LANGS[self.current_lang]['scale_up'])
         self.btn_zoom_out.config(text=LANGS[self.current_lang]['scale_down'])
         self.btn_edit_anim.config(text=LANGS[self.current_lang]['edit_animations'])
+        self.chk_timing.config(text=LANGS[self.current_lang]['timing'])
+
+    def toggle_timing(self):
+        timer.enable(self.timing_var.get())
+
+    def append_timing(self):
+        """Дописывает в лог таблицу стадий последней операции и сбрасывает таймер."""
+        if not timer.enabled or not timer.records:
+            return
+        report = "\n\n" + timer.format_report()
+        timer.clear()
+        self.last_log_text += report
+        self.text.insert(tk.END, report)
 
     def zoom_in(self):
         self.scale = min(10, self.scale + 1)
@@ -120,29 +147,20 @@ class PortraitViewerApp:
             self.canvas.create_image((64*self.scale)//2, (64*self.scale)//2, image=self.photo, anchor='center')
             self.canvas.image = self.photo
 
-    def build_image_sf1_linear(self, nibbles, palette):
-        flat = [int(x, 16) if x != '' else 0 for x in nibbles[:64*64]]
-        img = Image.new('RGBA', (64, 64))
-        pixels = []
-        for idx in range(64*64):
-            if idx < len(flat):
-                ci = flat[idx]
-                if ci < len(palette):
-                    pixels.append(palette[ci])
-                else:
-                    pixels.append((0,0,0,0))
-            else:
-                pixels.append((0,0,0,0))
-        img.putdata(pixels)
-        return img, len(flat)
-
-    def open_file(self):
-        file_path = filedialog.askopenfilename(title=LANGS[self.current_lang]['open_file'],
-                                               filetypes=[('Binary files','*.bin'),('All files','*.*')])
+    def build_image_sf1_linear(self, indices, palette):
+        indices = indices[:64*64]
+        img = render_indices(indices, palette).convert('RGBA')
+        return img, len(indices)
+
+    def open_file(self, file_path=None):
+        if file_path is None:
+            file_path = filedialog.askopenfilename(title=LANGS[self.current_lang]['open_file'],
+                                                   filetypes=[('Binary files','*.bin'),('All files','*.*')])
         if file_path:
             try:
                 self.last_file_path = file_path
-                with open(file_path, 'rb') as f:
+                timer.clear()
+                with stage('read'), open(file_path, 'rb') as f:
                     data = f.read()
                 
                 parser = SF1PortraitParser(file_path)
@@ -152,44 +170,22 @@ class PortraitViewerApp:
                 if graphic_offset >= len(data):
                     raise ValueError(f"Графический offset ({graphic_offset}) больше размера файла ({len(data)})")
                 
-                file_stream = io.BytesIO(data)
-                
-                decompressor = SF1PortraitDecompressor(file_stream)
-                nibbles, non_trans = decompressor.get_data(graphic_offset)
-                
                 palette_data = parser.palette if hasattr(parser, 'palette') else b''
                 
-                def decode_palette_genesis(palette_data):
-                    pal = []
-                    for i in range(16):
-                        if i*2+1 >= len(palette_data):
-                            pal.append((0,0,0,255))
-                            continue
-                        low = palette_data[i*2]
-                        high = palette_data[i*2+1]
-                        word = (low << 8) | high
-                        r = ((word >> 0) & 0x0E) >> 1
-                        g = ((word >> 4) & 0x0E) >> 1
-                        b = ((word >> 8) & 0x0E) >> 1
-                        scale = 255 // 7
-                        r = r * scale
-                        g = g * scale
-                        b = b * scale
-                        alpha = 0 if i == 0 else 255
-                        pal.append((r,g,b,alpha))
-                    return pal
-
-                palette = decode_palette_genesis(palette_data)
-                self.last_palette = palette
-                img, _ = self.build_image_sf1_linear(nibbles, palette)
-                self.last_image = img
-                self.last_pixels = nibbles
+                # Повторное открытие того же потока берётся из кэша без распаковки
+                img, indices = self.cache.render('sf1', data[graphic_offset:], palette_data)
+                non_trans = len(indices) - indices.count(0xFF)
+                self.last_palette = decode_sf1_palette(palette_data)
+                self.last_image = img.convert('RGBA')
+                self.opened_pixels = self.last_image.tobytes()
+                self.last_pixels = indices
 
                 parser_summary = parser.get_summary_text() if hasattr(parser, 'get_summary_text') else ''
                 self.last_log_text = parser_summary
                 self.text.delete(1.0, tk.END)
                 self.text.insert(tk.END, self.last_log_text)
                 self.redraw_image()
+                self.append_timing()
                 self.status.config(text=f"✅ Открыт портрет: {os.path.basename(file_path)} | {non_trans} пикселей")
                 
             except Exception as e:
@@ -199,13 +195,15 @@ class PortraitViewerApp:
                 messagebox.showerror("Ошибка", f"Ошибка при загрузке файла:\n{str(e)}\n\nПроверь консоль для подробностей.")
                 self.status.config(text=f"❌ Ошибка: {str(e)}")
 
-    def open_portrait(self):
-        file_path = filedialog.askopenfilename(title=LANGS[self.current_lang]['open_portrait'],
-                                               filetypes=[('Binary files', '*.bin'), ('All files', '*.*')])
+    def open_portrait(self, file_path=None):
+        if file_path is None:
+            file_path = filedialog.askopenfilename(title=LANGS[self.current_lang]['open_portrait'],
+                                                   filetypes=[('Binary files', '*.bin'), ('All files', '*.*')])
         if file_path:
             try:
                 self.last_file_path = file_path
-                with open(file_path, 'rb') as f:
+                timer.clear()
+                with stage('read'), open(file_path, 'rb') as f:
                     data = f.read()
 
                 parser = RleParser(file_path)
@@ -215,55 +213,24 @@ class PortraitViewerApp:
                 if len(parser.palette) != 32:
                     raise ValueError("Неполные или отсутствующие данные палитры в файле.")
 
-                def decode_palette_genesis(palette_data):
-                    pal = []
-                    for i in range(0, 32, 2):
-                        first = palette_data[i]
-                        second = palette_data[i+1]
-                        b_n = first & 0x0F
-                        g_n = (second >> 4) & 0x0F
-                        r_n = second & 0x0F
-                        r = int(round(r_n * 255 / 15))  # Изменено на /15 без mapping
-                        g = int(round(g_n * 255 / 15))
-                        b = int(round(b_n * 255 / 15))
-                        alpha = 0 if i == 0 else 255
-                        pal.append((r, g, b, alpha))
-                    return pal
-
-                self.last_palette = decode_palette_genesis(parser.palette)
+                self.last_palette = decode_rle_palette(parser.palette)
 
                 graphic_data_offset = parser.graphic_offset
                 if graphic_data_offset is None or graphic_data_offset >= len(data):
                     raise ValueError("Не удалось определить смещение графических данных.")
 
-                file_stream = io.BytesIO(data)
-                
-                temp_png_path = "temp_decompressed.png"
-                decompress_from_my_compressor(file_stream, temp_png_path)
-                
-                img = Image.open(temp_png_path).convert('RGBA')
-                self.last_image = img
-                
-                pixels = list(img.getdata())
-                color_map = {(r, g, b, a): i for i, (r, g, b, a) in enumerate(self.last_palette)}
-                self.last_pixels = []
-                for r, g, b, a in pixels:
-                    if a == 0:
-                        self.last_pixels.append('0')
-                    else:
-                        color_key = (r, g, b, a)
-                        idx = color_map.get(color_key, 0)
-                        self.last_pixels.append(f"{idx:X}")
-                
-                non_trans = sum(1 for px in pixels if px[3] != 0)
+                img, indexed = self.cache.render('rle', data[graphic_data_offset + 2:], parser.palette)
+                self.last_image = img.convert('RGBA')
+                self.opened_pixels = self.last_image.tobytes()
+                self.last_pixels = indexed
+                non_trans = len(indexed) - indexed.count(0)
                 
                 self.text.delete(1.0, tk.END)
                 self.text.insert(tk.END, self.last_log_text)
                 self.redraw_image()
+                self.append_timing()
                 self.status.config(text=f"✅ Открыт портрет (RLE): {os.path.basename(file_path)} | {non_trans} пикселей")
                 
-                os.remove(temp_png_path)
-                
             except Exception as e:
                 import traceback
                 error_details = traceback.format_exc()
@@ -271,6 +238,43 @@ class PortraitViewerApp:
                 messagebox.showerror("Ошибка", f"Ошибка при загрузке портрета (RLE7):\n{str(e)}\n\nПроверь консоль для подробностей.")
                 self.status.config(text=f"❌ Ошибка: {str(e)}")
 
+    def open_any(self):
+        """Открыть .bin любого формата: SF1 или RLE определяется по заголовку и началу потока."""
+        file_path = filedialog.askopenfilename(title=LANGS[self.current_lang]['open_any'],
+                                               filetypes=[('Binary files', '*.bin'), ('All files', '*.*')])
+        if not file_path:
+            return
+        try:
+            timer.clear()
+            with stage('read'), open(file_path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            messagebox.showerror("Ошибка", f"Ошибка при чтении файла:\n{str(e)}")
+            return
+        try:
+            # Тот же путь «определить, затем распаковать», что у decode --format auto
+            found, palette, indices, img = decode_any(data, cache=self.cache)
+        except ValueError as e:
+            messagebox.showerror("Ошибка", f"Файл не похож на портрет:\n{str(e)}")
+            self.status.config(text=f"❌ Не портрет: {os.path.basename(file_path)}")
+            return
+        parser = SF1PortraitParser(file_path) if found['format'] == 'sf1' else RleParser(file_path)
+        self.last_file_path = file_path
+        self.last_parser = parser
+        self.last_log_text = parser.get_summary_text()
+        self.last_palette = palette
+        self.last_image = img.convert('RGBA')
+        self.opened_pixels = self.last_image.tobytes()
+        self.last_pixels = indices
+        # В SF1 прозрачный пиксель — незаписанный (0xFF), в RLE — индекс 0
+        non_trans = len(indices) - indices.count(0xFF if found['format'] == 'sf1' else 0)
+        self.text.delete(1.0, tk.END)
+        self.text.insert(tk.END, self.last_log_text)
+        self.redraw_image()
+        self.append_timing()
+        self.status.config(text=f"✅ Открыт портрет ({found['format'].upper()}): "
+                                f"{os.path.basename(file_path)} | {non_trans} пикселей")
+
     def open_png(self):
         file_path = filedialog.askopenfilename(
             title=LANGS[self.current_lang]['open_png_file'],
@@ -310,6 +314,7 @@ class PortraitViewerApp:
                         indexed_pixels.append(f"{color_map.get(color, 0):X}")
 
                 self.last_image = img
+                self.opened_pixels = self.last_image.tobytes()
                 self.last_palette = palette
                 self.last_pixels = indexed_pixels
                 self.last_file_path = file_path
@@ -398,7 +403,18 @@ class PortraitViewerApp:
                     filetypes=[('Binary files', '*.bin'), ('All files', '*.*')]
                 )
                 if output_path:
-                    compressor.compress(output_path)
+                    timer.clear()
+                    if isinstance(self.last_parser, SF1PortraitParser) and self.last_file_path and \
+                            self.last_image.tobytes() == self.opened_pixels:
+                        # Открыт и не изменён оригинальный портрет: перекодируем поток напрямую,
+                        # палитра и анимации сохраняются без квантования RGBA
+                        with open(self.last_file_path, 'rb') as f:
+                            data = transcode(f.read(), 'rle')
+                        with open(output_path, 'wb') as f:
+                            f.write(data)
+                    else:
+                        compressor.compress(output_path)
+                    self.append_timing()
                     self.status.config(text=f"💾 Сохранён BIN: {os.path.basename(output_path)}")
                     messagebox.showinfo("Успех", f"Сохранён BIN:\n{output_path}")
             except Exception as e:
@@ -417,7 +433,9 @@ class PortraitViewerApp:
                         filetypes=[('Binary files', '*.bin'), ('All files', '*.*')]
                     )
                     if output_path:
+                        timer.clear()
                         compressor.compress(output_path)
+                        self.append_timing()
                         self.status.config(text=f"💾 Сохранён BIN: {os.path.basename(output_path)}")
                         messagebox.showinfo("Успех", f"Сохранён BIN:\n{output_path}")
                 except Exception as e:
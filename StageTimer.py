@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Замер времени по стадиям открытия и сжатия портрета.
+
+Стадии: read (чтение файла), parse (заголовок), decode (битовый поток),
+palette (палитра), render (картинка), encode / compress (сжатие).
+Для каждой записываются время и прирост числа выделенных блоков памяти
+(sys.getallocatedblocks — живые блоки после стадии минус до неё).
+
+По умолчанию выключено: timed-обёртка и stage() только проверяют флаг.
+
+    from StageTimer import timer, stage
+    timer.enable()
+    with stage('read'):
+        data = f.read()
+    print(timer.format_report())
+    timer.save_json('profile.json')
+    timer.save_chrome_trace('trace.json')   # chrome://tracing, Perfetto
+"""
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+
+_NULL = nullcontext()
+
+
+class _Stage:
+    __slots__ = ('timer', 'name', 'start', 'blocks')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.timer._depth += 1
+        self.blocks = sys.getallocatedblocks()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        timer = self.timer
+        timer._depth -= 1
+        timer.records.append({
+            'name': self.name,
+            'start': self.start - timer.origin,
+            'seconds': end - self.start,
+            'blocks': sys.getallocatedblocks() - self.blocks,
+            'depth': timer._depth,
+        })
+        return False
+
+
+class StageTimer:
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+        self.origin = time.perf_counter()
+        self._depth = 0
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+        if enabled:
+            self.clear()
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        self.records = []
+        self.origin = time.perf_counter()
+        self._depth = 0
+
+    def stage(self, name):
+        """Контекстный менеджер стадии; выключенный таймер отдаёт общий nullcontext."""
+        if not self.enabled:
+            return _NULL
+        return _Stage(self, name)
+
+    def totals(self):
+        """dict стадия -> count, seconds, mean, max, blocks в порядке первого появления."""
+        result = {}
+        for r in self.records:
+            t = result.setdefault(r['name'], {'count': 0, 'seconds': 0.0, 'max': 0.0, 'blocks': 0})
+            t['count'] += 1
+            t['seconds'] += r['seconds']
+            t['max'] = max(t['max'], r['seconds'])
+            t['blocks'] += r['blocks']
+        for t in result.values():
+            t['mean'] = t['seconds'] / t['count']
+        return result
+
+    def format_report(self):
+        """Таблица по стадиям для лога."""
+        lines = [f"{'stage':10} {'count':>5} {'total ms':>9} {'mean ms':>8} {'max ms':>8} {'blocks':>7}"]
+        for name, t in self.totals().items():
+            lines.append(f"{name:10} {t['count']:5d} {t['seconds'] * 1000:9.3f} {t['mean'] * 1000:8.3f} "
+                         f"{t['max'] * 1000:8.3f} {t['blocks']:7d}")
+        return "\n".join(lines)
+
+    def to_json(self):
+        return {'stages': self.records, 'totals': self.totals()}
+
+    def save_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_json(), f, indent=2)
+        return path
+
+    def to_chrome_trace(self):
+        """События 'X' формата Trace Event (микросекунды), вложенность — по времени."""
+        pid = os.getpid()
+        tid = threading.get_ident()
+        events = [{
+            'name': r['name'],
+            'ph': 'X',
+            'ts': round(r['start'] * 1e6, 3),
+            'dur': round(r['seconds'] * 1e6, 3),
+            'pid': pid,
+            'tid': tid,
+            'args': {'blocks': r['blocks']},
+        } for r in self.records]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save_chrome_trace(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_chrome_trace(), f)
+        return path
+
+
+# Один таймер на процесс
+timer = StageTimer()
+
+
+def stage(name):
+    return timer.stage(name)
+
+
+def timed(name):
+    """Декоратор: вызов функции — стадия name (пока таймер включён)."""
+    def wrap(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not timer.enabled:
+                return func(*args, **kwargs)
+            with _Stage(timer, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return wrap
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Перекодирование портретов между оригинальным потоком SF1 и RLE SF1PortraitCompressor
+без картинки RGBA: сжатый поток -> буфер индексов палитры -> сжатый поток.
+
+32 байта палитры переносятся как есть: в обоих форматах это те же слова
+Genesis 0000BBB0 GGG0RRR0, так что цвета не проходят через квантование
+value_map и не сдвигаются. Блоки blink и talk тоже копируются без изменений.
+Незаписанные пиксели SF1 (0xFF) и индекс 0 — прозрачные в обоих форматах.
+
+    rle = sf1_to_rle(open('portrait00.bin', 'rb').read())
+    sf1 = transcode(rle, 'sf1')  # то же, что rle_to_sf1(rle)
+    python PortraitBatch.py transcode portraits/ --to rle --out custom/
+"""
+from SF1PortraitParser import SF1PortraitParser
+from RleParser import RleParser
+from SF1PortraitDecompressor import SF1PortraitDecompressor
+from SF1PortraitCompressor import SF1PortraitCompressor
+from SF1NativeCompressor import SF1NativeCompressor, UNSET
+from RLEDecompressor import decode_stream
+
+TARGETS = ('rle', 'sf1')
+MAGIC = b'\x08\x08'
+# Пустые blink и talk, которые пишет SF1PortraitCompressor.encode_indices
+EMPTY_BLOCKS = 4
+
+
+def _header(parser):
+    if len(parser.palette) != 32:
+        raise ValueError(f"Incomplete palette: {len(parser.palette)} bytes instead of 32")
+    return bytes(parser.blink), bytes(parser.talk), bytes(parser.palette)
+
+
+def sf1_indices(data):
+    """Оригинальный портрет SF1 -> (blink, talk, палитра, bytes индексов, ширина, высота)."""
+    parser = SF1PortraitParser(data)
+    blink, talk, palette = _header(parser)
+    decompressor = SF1PortraitDecompressor(parser.data, parser.graphic_offset)
+    indices, _ = decompressor.get_indices()
+    return blink, talk, palette, bytes(indices).replace(bytes([UNSET]), b'\0'), \
+        decompressor.width, decompressor.height
+
+
+def rle_indices(data):
+    """Портрет SF1PortraitCompressor -> (blink, talk, палитра, bytes индексов 64x64)."""
+    parser = RleParser(data)
+    blink, talk, palette = _header(parser)
+    if parser.magic != MAGIC:
+        raise ValueError("RLE portrait has no 08 08 magic before the graphics")
+    return blink, talk, palette, bytes(decode_stream(parser.data[parser.graphic_offset + 2:]))
+
+
+def sf1_to_rle(data, effort='fast', encoder=None):
+    """bytes портрета SF1 -> bytes портрета RLE (64x64) с той же палитрой и анимациями."""
+    blink, talk, palette, indices, width, height = sf1_indices(data)
+    if (width, height) != (64, 64):
+        raise ValueError(f"RLE portraits are 64x64, this one is {width}x{height}")
+    encoder = encoder or SF1PortraitCompressor(effort=effort)
+    return blink + talk + encoder.encode_indices(indices, palette)[EMPTY_BLOCKS:]
+
+
+def rle_to_sf1(data, encoder=None):
+    """bytes портрета RLE -> bytes оригинального портрета SF1 с той же палитрой и анимациями."""
+    blink, talk, palette, indices = rle_indices(data)
+    encoder = encoder or SF1NativeCompressor()
+    return blink + talk + palette + encoder.encode_graphics(indices)
+
+
+def transcode(data, target, effort='fast', encoder=None):
+    """
+    Перекодирует bytes портрета в формат target ('rle' из SF1 или 'sf1' из RLE).
+    encoder — готовый кодер целевого формата (SF1PortraitCompressor / SF1NativeCompressor).
+    """
+    if target == 'rle':
+        return sf1_to_rle(data, effort, encoder)
+    if target == 'sf1':
+        return rle_to_sf1(data, encoder)
+    raise ValueError(f"Unknown target format {target!r}, expected one of {TARGETS}")